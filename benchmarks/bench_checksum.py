@@ -0,0 +1,29 @@
+"""
+校验和性能测试: python benchmarks/bench_checksum.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checksum import ALGORITHMS
+
+
+def main():
+    data = os.urandom(16 * 1024 * 1024)
+    for algorithm in ALGORITHMS.values():
+        algorithm.compute(b'warmup')  # 生成查表
+        best = min(_timed(algorithm.compute, data) for _ in range(3))
+        print(f"{algorithm.label:<22} {len(data) / best / 1e6:10.1f} MB/s")
+
+
+def _timed(func, data) -> float:
+    start = time.perf_counter()
+    func(data)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+十六进制显示性能测试
+对比旧的逐字节实现与新的整块实现: python benchmarks/bench_hexdump.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import bytes_to_hex, iter_hex_lines
+
+
+def legacy_bytes_to_hex(data: bytes, bytes_per_line: int = 16) -> str:
+    """旧实现（逐字节生成器表达式）"""
+    lines = []
+    for i in range(0, len(data), bytes_per_line):
+        chunk = data[i:i + bytes_per_line]
+        hex_part = ' '.join(f'{b:02X}' for b in chunk)
+        ascii_part = ''.join(chr(b) if 32 <= b < 127 else '.' for b in chunk)
+        lines.append(f'{i:04X}  {hex_part:<{bytes_per_line * 3}}  {ascii_part}')
+    return '\n'.join(lines)
+
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {name:<12} {seconds * 1000:8.3f} ms")
+    return seconds
+
+
+def main():
+    for size in (64, 4096, 64 * 1024, 1024 * 1024):
+        data = os.urandom(size)
+        assert bytes_to_hex(data) == legacy_bytes_to_hex(data)
+        number = max(1, 2_000_000 // size)
+        print(f"{size} 字节:")
+        old = bench("旧实现", lambda: legacy_bytes_to_hex(data), number)
+        new = bench("新实现", lambda: bytes_to_hex(data), number)
+        bench("流式生成", lambda: sum(1 for _ in iter_hex_lines(data)), number)
+        print(f"  加速比      {old / new:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
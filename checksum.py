@@ -0,0 +1,239 @@
+"""
+校验和计算
+CRC-8、CRC-16（Modbus/CCITT/XMODEM）、CRC-32、累加和、异或校验，
+以及继电器帧使用的双累加和，支持按字节范围自动追加和校验接收帧
+
+CRC-32 和 CRC-16/CCITT/XMODEM 使用 zlib/binascii 的C实现；
+其余CRC用查表法，每次处理2个字节（65536项表，首次使用时生成）
+"""
+
+import binascii
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _reflected_table(poly: int) -> List[int]:
+    """反射（低位在前）CRC的单字节表"""
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+def _normal_table(poly: int, width: int) -> List[int]:
+    """非反射（高位在前）CRC的单字节表"""
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for i in range(256):
+        crc = i << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+    return table
+
+
+# 双字节表按小端16位字构造，大端机器上逐对组装
+_LITTLE_ENDIAN = memoryview(b'\x01\x00').cast('H')[0] == 1
+
+
+class _TableCRC:
+    """查表CRC（8位或反射16位），按2字节一组查65536项的表"""
+    def __init__(self, width: int, poly: int, init: int, reflected: bool, xorout: int = 0):
+        self.width = width
+        self.poly = poly
+        self.init = init
+        self.reflected = reflected
+        self.xorout = xorout
+        self._table: Optional[List[int]] = None
+        self._table2: Optional[List[int]] = None
+
+    def _build(self):
+        """生成单字节表和双字节表"""
+        if self.reflected:
+            table = _reflected_table(self.poly)
+            # 低字节先处理：先查低字节再查高字节
+            step = lambda crc, b: (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+        else:
+            assert self.width == 8, "非反射CRC只用于8位"
+            table = _normal_table(self.poly, self.width)
+            step = lambda crc, b: table[crc ^ b]
+        # 双字节表：索引为 (crc ^ 小端16位字)，等价于依次处理这两个字节
+        if self.width == 8:
+            table2 = [step(step(0, w & 0xFF), w >> 8) for w in range(65536)]
+        else:
+            table2 = [step(step(w, 0), 0) for w in range(65536)]
+        self._table, self._table2 = table, table2
+
+    def __call__(self, data: bytes) -> int:
+        if self._table2 is None:
+            self._build()
+        table, table2 = self._table, self._table2
+        crc = self.init
+        n = len(data) & ~1
+        if n:
+            if _LITTLE_ENDIAN:
+                for w in memoryview(data)[:n].cast('H'):
+                    crc = table2[crc ^ w]
+            else:
+                for i in range(0, n, 2):
+                    crc = table2[crc ^ (data[i] | data[i + 1] << 8)]
+        if n < len(data):
+            b = data[-1]
+            crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF] if self.reflected else table[crc ^ b]
+        return crc ^ self.xorout
+
+
+def _sum8(data: bytes) -> int:
+    return sum(data) & 0xFF
+
+
+def _sum16(data: bytes) -> int:
+    return sum(data) & 0xFFFF
+
+
+def _xor8(data: bytes) -> int:
+    """异或校验：把整块数据当作大整数对折异或，避免逐字节循环"""
+    if not data:
+        return 0
+    value = int.from_bytes(data, 'little')
+    nbytes = len(data)
+    while nbytes > 1:
+        half = (nbytes + 1) // 2
+        value = (value >> (half * 8)) ^ (value & ((1 << (half * 8)) - 1))
+        nbytes = half
+    return value
+
+
+def _relay_sum(data: bytes) -> int:
+    """继电器帧校验：第一字节为累加和，第二字节为累加和再加第一字节"""
+    s = sum(data) & 0xFF
+    return (s << 8) | ((s + s) & 0xFF)
+
+
+class ChecksumAlgorithm:
+    """一种校验算法"""
+    def __init__(self, name: str, label: str, size: int, func: Callable[[bytes], int], byteorder: str = "big"):
+        self.name = name
+        self.label = label
+        self.size = size            # 校验值字节数
+        self.func = func
+        self.byteorder = byteorder  # 追加到帧尾时的字节序
+
+    def compute(self, data: bytes) -> int:
+        """计算校验值"""
+        return self.func(data)
+
+    def digest(self, data: bytes, byteorder: Optional[str] = None) -> bytes:
+        """计算校验值并按字节序转换为字节"""
+        return self.func(data).to_bytes(self.size, byteorder or self.byteorder)
+
+
+ALGORITHMS: Dict[str, ChecksumAlgorithm] = {a.name: a for a in (
+    ChecksumAlgorithm("sum8", "累加和 (8位)", 1, _sum8),
+    ChecksumAlgorithm("sum16", "累加和 (16位)", 2, _sum16),
+    ChecksumAlgorithm("xor8", "异或校验 (BCC)", 1, _xor8),
+    ChecksumAlgorithm("crc8", "CRC-8", 1, _TableCRC(8, 0x07, 0x00, reflected=False)),
+    ChecksumAlgorithm("crc8_maxim", "CRC-8/MAXIM", 1, _TableCRC(8, 0x8C, 0x00, reflected=True)),
+    ChecksumAlgorithm("crc16_modbus", "CRC-16/MODBUS", 2, _TableCRC(16, 0xA001, 0xFFFF, reflected=True), "little"),
+    ChecksumAlgorithm("crc16_ccitt", "CRC-16/CCITT-FALSE", 2, lambda data: binascii.crc_hqx(data, 0xFFFF)),
+    ChecksumAlgorithm("crc16_xmodem", "CRC-16/XMODEM", 2, lambda data: binascii.crc_hqx(data, 0)),
+    ChecksumAlgorithm("crc32", "CRC-32", 4, zlib.crc32),
+    ChecksumAlgorithm("relay_sum", "继电器双累加和", 2, _relay_sum),
+)}
+
+# 常用帧格式预设: 名称 -> (算法, 起始偏移, 结束偏移)
+PRESETS: Dict[str, Tuple[str, int, Optional[int]]] = {
+    "继电器 (CC DD 帧头)": ("relay_sum", 2, None),
+    "Modbus RTU": ("crc16_modbus", 0, None),
+}
+
+
+def get_algorithm(name: str) -> ChecksumAlgorithm:
+    """按名称获取算法"""
+    try:
+        return ALGORITHMS[name]
+    except KeyError:
+        raise ValueError(f"不支持的校验算法: {name}") from None
+
+
+def compute(name: str, data: bytes) -> int:
+    """计算校验值"""
+    return get_algorithm(name).compute(data)
+
+
+def append_checksum(frame: bytes, name: str, start: int = 0, end: Optional[int] = None) -> bytes:
+    """对 frame[start:end] 计算校验并追加到帧尾（start/end 与切片规则相同）"""
+    algorithm = get_algorithm(name)
+    return frame + algorithm.digest(frame[start:end])
+
+
+def verify_checksum(frame: bytes, name: str, start: int = 0,
+                    end: Optional[int] = None) -> Tuple[bool, Optional[bytes], Optional[bytes]]:
+    """校验以校验值结尾的帧，返回 (是否一致, 计算值, 帧中的值)
+
+    start/end 针对去掉尾部校验值后的数据，与 append_checksum 的参数一致
+    """
+    algorithm = get_algorithm(name)
+    if len(frame) <= algorithm.size:
+        return False, None, frame or None
+    body, actual = frame[:-algorithm.size], frame[-algorithm.size:]
+    expected = algorithm.digest(body[start:end])
+    return expected == actual, expected, actual
+
+
+class ChecksumConfig:
+    """发送自动追加/接收校验的设置"""
+    def __init__(self, algorithm: str = "", start: int = 0, end: Optional[int] = None,
+                 append: bool = False, verify: bool = False):
+        self.algorithm = algorithm  # 算法名，空字符串表示不使用
+        self.start = start          # 参与计算的起始偏移
+        self.end = end              # 结束偏移（不含），None表示到末尾，负数从末尾倒数
+        self.append = append        # 发送时自动追加
+        self.verify = verify        # 校验接收数据
+        self.checked = 0            # 已校验的接收帧数
+        self.errors = 0             # 校验不一致的帧数
+
+    def apply(self, frame: bytes) -> bytes:
+        """发送前按设置追加校验值"""
+        if self.append and self.algorithm:
+            return append_checksum(frame, self.algorithm, self.start, self.end)
+        return frame
+
+    def check(self, frame: bytes) -> Optional[str]:
+        """按设置校验接收帧，不一致时返回标记文字，一致或未启用时返回None"""
+        if not (self.verify and self.algorithm):
+            return None
+        ok, expected, actual = verify_checksum(frame, self.algorithm, self.start, self.end)
+        self.checked += 1
+        if ok:
+            return None
+        self.errors += 1
+        if expected is None:
+            return "[校验错误 帧过短] "
+        return f"[校验错误 计算:{expected.hex(' ').upper()} 帧内:{actual.hex(' ').upper()}] "
+
+    def summary(self) -> str:
+        """单行文字摘要"""
+        if not self.algorithm or not (self.append or self.verify):
+            return ""
+        modes = [m for m, on in (("追加", self.append), ("校验", self.verify)) if on]
+        end = "末尾" if self.end is None else self.end
+        return f"{ALGORITHMS[self.algorithm].label} [{self.start}:{end}] {'/'.join(modes)}"
+
+    def to_dict(self) -> dict:
+        return {"algorithm": self.algorithm, "start": self.start, "end": self.end,
+                "append": self.append, "verify": self.verify}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ChecksumConfig":
+        """从字典创建，参数无效时抛出 ValueError"""
+        algorithm = d.get("algorithm") or ""
+        if algorithm:
+            get_algorithm(algorithm)
+        end = d.get("end")
+        return cls(algorithm, int(d.get("start") or 0), None if end in (None, "") else int(end),
+                   bool(d.get("append")), bool(d.get("verify")))
@@ -0,0 +1,315 @@
+"""
+配置存储
+配置常驻内存，修改后延迟合并写盘：先追加到日志文件（config.json.journal），
+日志过大时压缩为完整的 config.json（写临时文件后原子替换）。
+日志每行一条操作：整项替换，或列表型配置项（如发送历史）中单条记录的插入/更新/删除，
+后者只记录改动的那一条，不必每次写入整个列表。
+同时监视 config.json 的修改时间，外部编辑后自动重新加载：外部改动过的配置项以文件为准，
+其余配置项保留日志中的修改，合并结果立即压缩写回主文件
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+_MISSING = object()
+
+
+def _apply_entry(data: Dict[str, Any], entry: dict):
+    """把一条日志操作应用到配置"""
+    key = entry['key']
+    op = entry.get('op', 'set')
+    if op == 'set':
+        data[key] = entry['value']
+        return
+    items = data.get(key)
+    if not isinstance(items, list):
+        items = data[key] = []
+    field, ident = entry['field'], entry['id']
+    pos = next((i for i, item in enumerate(items) if isinstance(item, dict) and item.get(field) == ident), None)
+    if op == 'delete':
+        if pos is not None:
+            del items[pos]
+    elif op == 'upsert':
+        if pos is not None and not entry.get('front'):
+            items[pos] = entry['item']
+            return
+        if pos is not None:
+            del items[pos]
+        items.insert(0, entry['item'])
+        limit = entry.get('limit')
+        if limit:
+            del items[limit:]
+
+
+class ConfigStore:
+    """带延迟写入和日志压缩的JSON配置存储"""
+    def __init__(self, path: str, delay: float = 1.0, watch_interval: float = 2.0,
+                 compact_entries: int = 100, compact_bytes: int = 256 * 1024):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.delay = delay                    # 修改后延迟多久写盘（期间的修改合并为一次）
+        self.watch_interval = watch_interval  # 检查外部修改的间隔
+        self.compact_entries = compact_entries
+        self.compact_bytes = compact_bytes
+        self.data: Dict[str, Any] = {}
+        self._pending: List[dict] = []        # 尚未写盘的日志操作（按顺序）
+        self._deadline: Optional[float] = None
+        self._journal_entries = 0
+        self._mtime: Optional[int] = None
+        self._main: Dict[str, Any] = {}       # 主文件上次读取/写入时的内容，用于判断外部改了哪些配置项
+        self._reloaded: Optional[Dict[str, Any]] = None  # 合并了外部修改、尚未通知监听者的配置
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self.load()
+        # 进程退出时写入尚未写盘的修改
+        atexit.register(self.flush)
+
+    # ===== 读取 =====
+
+    def load(self) -> Dict[str, Any]:
+        """读取配置文件并重放日志"""
+        data = self._read_main()
+        entries = self._replay_journal(data)
+        with self._cond:
+            self.data = data
+            self._journal_entries = entries
+        return data
+
+    def _replay_journal(self, data: Dict[str, Any]) -> int:
+        """把日志文件中的操作应用到 data，返回条数"""
+        entries = 0
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # 最后一行可能因崩溃而不完整
+                    _apply_entry(data, entry)
+                    entries += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取配置日志失败: {e}")
+        return entries
+
+    def _read_main(self) -> Dict[str, Any]:
+        """读取主配置文件，并记录其修改时间和内容"""
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            data = json.loads(text)
+            if isinstance(data, dict):
+                self._main = json.loads(text)
+                return data
+        except FileNotFoundError:
+            self._mtime = None
+        except Exception as e:
+            print(f"加载配置失败: {e}")
+        self._main = {}
+        return {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """获取配置项"""
+        return self.data.get(key, default)
+
+    # ===== 修改 =====
+
+    def set(self, key: str, value: Any):
+        """修改配置项（只改内存，由后台线程延迟写盘）"""
+        self.update({key: value})
+
+    def update(self, values: Dict[str, Any]):
+        """批量修改配置项"""
+        with self._cond:
+            self.data.update(values)
+            # 整项替换覆盖同一配置项之前尚未写盘的操作
+            self._pending = [e for e in self._pending if e['key'] not in values]
+            self._pending.extend({'key': key, 'value': value} for key, value in values.items())
+            self._schedule()
+
+    def upsert_item(self, key: str, item: dict, field: str, front: bool = True, limit: Optional[int] = None):
+        """插入或更新列表型配置项中的一条记录（按 item[field] 识别），日志只记录这一条
+
+        front=True 时移到列表最前，limit 为列表最大长度（超出的从尾部丢弃）
+        """
+        entry = {'key': key, 'op': 'upsert', 'field': field, 'id': item[field], 'item': item, 'front': front}
+        if limit:
+            entry['limit'] = limit
+        self._append(entry)
+
+    def delete_item(self, key: str, field: str, ident: Any):
+        """删除列表型配置项中 field 等于 ident 的记录"""
+        self._append({'key': key, 'op': 'delete', 'field': field, 'id': ident})
+
+    def _append(self, entry: dict):
+        with self._cond:
+            _apply_entry(self.data, entry)
+            self._pending.append(entry)
+            self._schedule()
+
+    def _schedule(self):
+        """安排延迟写盘（调用方已持有锁）"""
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.delay
+        self._ensure_thread()
+        self._cond.notify()
+
+    def flush(self, compact: bool = False):
+        """立即把未写盘的修改写入（退出时调用）"""
+        with self._cond:
+            self._write_pending()
+            if compact and self._journal_entries:
+                self._compact()
+        self._notify_reloaded()
+
+    # ===== 外部修改通知 =====
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """注册外部修改回调（在后台线程中调用，参数为重新加载后的完整配置）"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+        with self._cond:
+            self._ensure_thread()
+
+    def remove_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def stop(self):
+        """停止后台线程并写入全部修改"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self.flush(compact=True)
+
+    # ===== 后台线程 =====
+
+    def _ensure_thread(self):
+        """启动后台线程（调用方已持有锁）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """延迟写盘 + 监视外部修改"""
+        next_watch = time.monotonic() + self.watch_interval
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.monotonic()
+                wake = next_watch if self._deadline is None else min(next_watch, self._deadline)
+                if wake > now:
+                    self._cond.wait(wake - now)
+                    continue
+                if self._deadline is not None and self._deadline <= now:
+                    self._write_pending()
+            self._notify_reloaded()
+            if now >= next_watch:
+                next_watch = now + self.watch_interval
+                self._check_external_change()
+
+    def _write_pending(self):
+        """把未写盘的修改追加到日志，日志过大时压缩（调用方已持有锁）"""
+        self._deadline = None
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            lines = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in pending)
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+            self._journal_entries += len(pending)
+            if (self._journal_entries >= self.compact_entries
+                    or os.path.getsize(self.journal_path) >= self.compact_bytes):
+                self._compact()
+        except Exception as e:
+            print(f"保存配置失败: {e}")
+
+    def _compact(self):
+        """把完整配置写入主文件并清空日志（调用方已持有锁）"""
+        tmp_path = self.path + ".tmp"
+        try:
+            # 主文件在上次检查后被外部修改时先合并，避免覆盖外部编辑
+            self._merge_external()
+            text = json.dumps(self.data, ensure_ascii=False, indent=2)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+            self._main = json.loads(text)
+            # 主文件已包含全部修改，日志可以删除
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._journal_entries = 0
+        except Exception as e:
+            print(f"压缩配置失败: {e}")
+
+    def _check_external_change(self):
+        """主配置文件被外部修改时重新加载"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"检查配置文件失败: {e}")
+            return
+        if mtime == self._mtime:
+            return
+        with self._cond:
+            # 合并后立即压缩，合并结果成为新的主文件，旧日志删除
+            if self._merge_external():
+                self._compact()
+        self._notify_reloaded()
+
+    def _merge_external(self) -> bool:
+        """主文件被外部修改时合并到内存（调用方已持有锁），返回是否有外部修改
+
+        外部改动过（与上次读取/写入的内容不同）的配置项以文件为准，
+        其余配置项保留日志中已写盘的修改，最后应用尚未写盘的修改
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        before = self._main
+        flushed = json.loads(json.dumps(before))
+        self._replay_journal(flushed)
+        edited = self._read_main()
+        data = {}
+        for key in list(edited) + [k for k in flushed if k not in edited]:
+            changed = edited.get(key, _MISSING) != before.get(key, _MISSING)
+            value = edited.get(key, _MISSING) if changed else flushed.get(key, _MISSING)
+            if value is not _MISSING:
+                data[key] = value
+        for entry in self._pending:
+            _apply_entry(data, entry)
+        self.data = data
+        self._reloaded = data
+        return True
+
+    def _notify_reloaded(self):
+        """通知监听者配置已重新加载（不持有锁时调用）"""
+        with self._cond:
+            data, self._reloaded = self._reloaded, None
+        if data is None:
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(dict(data))
+            except Exception as e:
+                print(f"配置重新加载回调失败: {e}")
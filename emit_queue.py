@@ -0,0 +1,160 @@
+"""
+批量推送队列
+网络线程只把事件放入队列，由单独的线程按固定节奏（默认50ms，或积累到一定字节数时提前）
+合并为一条 event_batch 消息推送给浏览器，网络线程不做任何 websocket 读写。
+队列有上限，浏览器跟不上时丢弃最旧的数据事件（带字节数的事件，如 rx/receive_data）并计数，
+下一批中告知丢弃了多少；连接状态、端点表等控制事件总是送达
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class EmitQueue:
+    """一个会话的推送队列"""
+    def __init__(self, emit: Callable[[dict], None], interval: float = 0.05, flush_bytes: int = 64 * 1024,
+                 max_bytes: int = 4 * 1024 * 1024, max_events: int = 20000):
+        self.emit = emit                # emit(batch)，在推送线程中调用
+        self.interval = interval        # 推送间隔（秒）
+        self.flush_bytes = flush_bytes  # 积累到该字节数时不等间隔立即推送
+        self.max_bytes = max_bytes      # 队列上限，超过时丢弃最旧的数据事件
+        self.max_events = max_events
+        self._events: deque = deque()   # [事件名, 数据或生成数据的函数, 字节数, 接收时间]，被丢弃的事件名置为 None
+        self._data: deque = deque()     # 队列中的数据事件（与 _events 中同一个列表），按先后排列
+        self._count = 0                 # 队列中未丢弃的事件数
+        self._latest: Dict[str, Any] = {}  # 只保留最新一份的事件（如客户端列表）
+        self._bytes = 0
+        self._dropped = 0               # 自上次推送以来丢弃的事件数
+        self._dropped_bytes = 0
+        self.stats = {"events": 0, "batches": 0, "bytes": 0, "dropped": 0, "dropped_bytes": 0}
+        self._lock = threading.Lock()
+        self._has_data = threading.Event()  # 队列非空（空闲时推送线程在此等待）
+        self._flush_now = threading.Event()  # 积累数据已达 flush_bytes
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # 一批推送完成后回调 on_emitted(各事件数据的接收时间 monotonic_ns 列表)，在推送线程中调用
+        self.on_emitted: Optional[Callable[[List[int]], None]] = None
+
+    def push(self, event: str, payload: Any, size: int = 0, received_ns: int = 0):
+        """加入一个事件（payload 可以是无参函数，推送时才调用以生成数据）
+
+        received_ns: 事件对应数据的接收时间（monotonic_ns），用于统计接收到推送的延迟
+        """
+        entry = [event, payload, size, received_ns]
+        with self._lock:
+            self._events.append(entry)
+            self._count += 1
+            if size:
+                self._data.append(entry)
+                self._bytes += size
+                while (self._bytes > self.max_bytes or len(self._data) > self.max_events) and self._data:
+                    self._drop(self._data.popleft())
+            self._ensure_thread()
+            self._has_data.set()
+            if self._bytes >= self.flush_bytes:
+                self._flush_now.set()
+
+    def _drop(self, entry: list):
+        """丢弃一个数据事件（调用方已持有锁），留在 _events 中的空位过多时整理一次"""
+        self._bytes -= entry[2]
+        self._count -= 1
+        self._dropped += 1
+        self._dropped_bytes += entry[2]
+        entry[0] = entry[1] = None
+        if len(self._events) > 2 * self._count + 64:
+            self._events = deque(e for e in self._events if e[0] is not None)
+
+    def push_latest(self, event: str, payload: Any):
+        """加入一个只需推送最新值的事件，同一批内多次加入只推送最后一次"""
+        with self._lock:
+            self._latest[event] = payload
+            self._ensure_thread()
+            self._has_data.set()
+
+    def configure(self, interval: Optional[float] = None, flush_bytes: Optional[int] = None,
+                  max_bytes: Optional[int] = None):
+        """修改推送节奏和队列上限"""
+        if interval is not None:
+            self.interval = max(0.005, interval)
+        if flush_bytes is not None:
+            self.flush_bytes = max(1, flush_bytes)
+        if max_bytes is not None:
+            self.max_bytes = max(1, max_bytes)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"interval_ms": self.interval * 1000, "flush_kb": self.flush_bytes / 1024,
+                    "max_kb": self.max_bytes / 1024, "queued": self._count,
+                    "queued_bytes": self._bytes, "stats": dict(self.stats)}
+
+    def depth(self) -> Tuple[int, int]:
+        """队列中的事件数和字节数（不加锁读取，供监控抓取，不影响网络线程）"""
+        return self._count, self._bytes
+
+    def stop(self):
+        self._running = False
+        self._has_data.set()
+        self._flush_now.set()
+
+    def _ensure_thread(self):
+        """启动推送线程（调用方已持有锁）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _take(self) -> Tuple[list, dict, int, int]:
+        """取出当前队列内容"""
+        with self._lock:
+            events, self._events = self._events, deque()
+            self._data = deque()
+            latest, self._latest = self._latest, {}
+            dropped, dropped_bytes = self._dropped, self._dropped_bytes
+            self._bytes = self._count = self._dropped = self._dropped_bytes = 0
+            self._has_data.clear()
+            self._flush_now.clear()
+        return [e for e in events if e[0] is not None], latest, dropped, dropped_bytes
+
+    def _run(self):
+        """推送线程: 距上次推送满一个间隔（或积累足够数据）时推送一批，空闲时不占用CPU"""
+        next_flush = 0.0
+        while True:
+            self._has_data.wait()
+            if not self._running:
+                return
+            # 空闲后的第一个事件立即推送，之后按间隔合并
+            wait = next_flush - time.monotonic()
+            if wait > 0:
+                self._flush_now.wait(wait)
+            next_flush = time.monotonic() + self.interval
+            events, latest, dropped, dropped_bytes = self._take()
+            batch = {"events": [], "dropped": dropped, "dropped_bytes": dropped_bytes}
+            size = 0
+            received = []
+            for event, payload, nbytes, received_ns in events:
+                try:
+                    batch["events"].append([event, payload() if callable(payload) else payload])
+                except Exception as e:
+                    print(f"生成推送数据失败: {e}")
+                size += nbytes
+                if received_ns:
+                    received.append(received_ns)
+            for event, payload in latest.items():
+                try:
+                    batch["events"].append([event, payload() if callable(payload) else payload])
+                except Exception as e:
+                    print(f"生成推送数据失败: {e}")
+            with self._lock:
+                self.stats["events"] += len(events)
+                self.stats["batches"] += 1
+                self.stats["bytes"] += size
+                self.stats["dropped"] += dropped
+                self.stats["dropped_bytes"] += dropped_bytes
+            try:
+                self.emit(batch)
+            except Exception as e:
+                print(f"推送数据失败: {e}")
+            if received and self.on_emitted:
+                self.on_emitted(received)
@@ -0,0 +1,74 @@
+"""
+数据显示格式化层
+只保存一份原始数据，按需渲染为文本/十六进制/二进制，
+渲染结果按 (记录, 显示模式) 缓存，切换显示模式时只需渲染可见的记录
+"""
+
+from typing import Dict, Iterator, List, Optional
+
+from timestamps import TimestampFormatter, default_formatter, times_of
+from utils import format_payload
+
+# 显示模式
+MODE_TEXT = "text"
+MODE_HEX = "hex"
+MODE_BINARY = "binary"
+
+
+def display_mode(show_hex: bool, show_binary: bool) -> str:
+    """由界面上的两个勾选框得到显示模式（二进制优先）"""
+    if show_binary:
+        return MODE_BINARY
+    return MODE_HEX if show_hex else MODE_TEXT
+
+
+class DisplayRecord:
+    """一条待显示的数据：原始字节 + 元数据"""
+    __slots__ = ('data', 'wall_ns', 'mono_ns', 'sent', 'prefix', 'highlight', '_rendered', '_version')
+
+    def __init__(self, data: bytes, sent: bool = False, prefix: str = "", highlight: bool = False):
+        self.data = data
+        # 接收数据使用网络层记录的接收时间，发送数据使用创建记录的时间
+        self.wall_ns, self.mono_ns = times_of(data)
+        self.sent = sent
+        self.prefix = prefix            # 来源等前缀，如 "[来自 1.2.3.4:5000] "
+        self.highlight = highlight      # 命中触发模式，显示时高亮
+        self._rendered: Dict[str, str] = {}
+        self._version = -1
+
+    def render(self, mode: str, clock: Optional[TimestampFormatter] = None) -> str:
+        """渲染为指定显示模式的文本（带缓存，时间戳设置变化后缓存失效）"""
+        clock = clock or default_formatter
+        if self._version != clock.version:
+            self._rendered.clear()
+            self._version = clock.version
+        text = self._rendered.get(mode)
+        if text is None:
+            text = self.prefix + format_payload(self.data, clock.format(self.wall_ns, self.mono_ns),
+                                                mode == MODE_HEX, mode == MODE_BINARY, self.sent)
+            self._rendered[mode] = text
+        return text
+
+
+class DisplayLog:
+    """显示记录列表"""
+    def __init__(self):
+        self.records: List[DisplayRecord] = []
+
+    def add(self, data: bytes, sent: bool = False, prefix: str = "", highlight: bool = False) -> DisplayRecord:
+        """添加一条记录"""
+        record = DisplayRecord(data, sent, prefix, highlight)
+        self.records.append(record)
+        return record
+
+    def clear(self):
+        """清空记录"""
+        self.records.clear()
+
+    def render_all(self, mode: str) -> Iterator[str]:
+        """按显示模式依次渲染全部记录"""
+        for record in self.records:
+            yield record.render(mode)
+
+    def __len__(self) -> int:
+        return len(self.records)
@@ -1,15 +1,43 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 from typing import Optional, Tuple
-import json
 import os
+import re
 import sys
+import time
+from datetime import datetime
 
-from network import get_network_interfaces, NetworkInterface, TCPClient, TCPServer, UDPClient, UDPServer
+from network import (
+    get_network_interfaces, interface_inventory, NetworkInterface,
+    TCPClient, TCPServer, UDPClient, UDPServer
+)
+from proxy import TCPProxy, UDPProxy, DIRECTION_LABELS
+from impairment import ImpairmentConfig, attach_impairment, impairment_stats
+from ratelimit import RateLimiter, GLOBAL_LIMITER
+from checksum import ALGORITHMS, PRESETS, ChecksumConfig
+from triggers import TriggerPattern, TriggerSet, match_label
+from responder import MATCH_LABELS, Rule, RuleEngine
+from nic_monitor import NicMonitor, format_rate
 from utils import (
-    bytes_to_hex, hex_to_bytes, is_valid_hex,
-    format_received_data, format_sent_data, HistoryManager, HistoryItem
+    bytes_to_hex, hex_to_bytes, HexParseError,
+    HistoryManager, HistoryItem
 )
+from config_store import ConfigStore
+from formatter import DisplayLog, display_mode
+from scrollback import Scrollback
+from traffic_query import DIRECTION_NAMES, TrafficQuery
+from wire import DIR_RECEIVED, DIR_SENT, DIRECTION_CODES, EndpointTable, unpack_records
+from timestamps import PRECISION_LABELS, default_formatter, kernel_timestamps_supported
+
+# 历史下拉框最多显示的匹配条数
+HISTORY_VIEW_LIMIT = 500
+
+# 查找结果每批条数
+SEARCH_PAGE_LIMIT = 500
+
+# 查找对话框中的方向选项
+SEARCH_DIRECTIONS = {"全部方向": "", "接收": "received", "发送": "sent",
+                     "客户端→上游": "c2s", "上游→客户端": "s2c"}
 
 # 获取程序运行目录（支持打包后的exe）
 def get_app_dir():
@@ -40,6 +68,8 @@ class TCPToolGUI:
         self.tcp_server = TCPServer()
         self.udp_client = UDPClient()
         self.udp_server = UDPServer()
+        self.tcp_proxy = TCPProxy()
+        self.udp_proxy = UDPProxy()
         
         # 状态
         self.is_server_mode = False
@@ -47,15 +77,43 @@ class TCPToolGUI:
         self.show_hex = tk.BooleanVar(value=True)
         self.show_binary = tk.BooleanVar(value=False)  # 二进制显示
         self.send_hex = tk.BooleanVar(value=True)
+        # 接收区显示记录：保存原始数据，切换显示模式时按需重新渲染
+        self.display_log = DisplayLog()
+        self.display_mode = display_mode(True, False)
+        self._stale_records: set[int] = set()  # 仍是旧显示模式的记录下标
+        self._render_pending = False
         self.selected_client: Optional[Tuple[str, int]] = None
         
         # 接收暂停状态
         self.is_receive_paused = False
         self.paused_data_buffer: list[tuple] = []  # 暂停时缓冲的数据
         self.history_manager = HistoryManager()
+        self._history_view: list[str] = []  # 历史下拉框中各项对应的发送内容
+        self._history_view_key = None       # (版本, 关键字, 分组)，未变化时不刷新下拉框
+        self._history_search_job = None
         self.connection_history: list[tuple[str, int]] = []  # 连接历史 (ip, port)
         self.udp_connection_history: list[tuple[str, int]] = []  # UDP连接历史
         
+        # 网络损伤模拟
+        self.impairment_config = ImpairmentConfig()
+        self.impair_tx = tk.BooleanVar(value=True)
+        self.impair_rx = tk.BooleanVar(value=False)
+        
+        # 校验和: 发送自动追加 / 接收校验
+        self.checksum_config = ChecksumConfig()
+        
+        # 触发匹配（在网络线程中扫描接收数据）
+        self.triggers = TriggerSet()
+        self._trigger_bell_at = 0.0
+        
+        # 自动应答（服务器模式下模拟设备）
+        self.responder = RuleEngine()
+        self.responder.on_reply = self._on_auto_reply
+        self.auto_reply_enabled = tk.BooleanVar(value=False)
+        
+        # 网卡吞吐监视
+        self.nic_monitor = NicMonitor()
+        
         # 设置回调
         self.tcp_client.on_data_received = self._on_client_data
         self.tcp_client.on_disconnected = self._on_client_disconnected
@@ -64,12 +122,22 @@ class TCPToolGUI:
         self.tcp_server.on_data_received = self._on_server_data
         self.udp_client.on_data_received = self._on_udp_client_data
         self.udp_server.on_data_received = self._on_udp_server_data
+        self.tcp_proxy.on_traffic = self._on_proxy_traffic
+        self.udp_proxy.on_traffic = self._on_proxy_traffic
         
-        # 加载配置
+        # 加载配置（常驻内存，修改后延迟写盘）
+        self.config_store = ConfigStore(CONFIG_FILE)
         self._load_config()
+        self.config_store.add_listener(self._on_config_reloaded)
+        
+        # 收发记录索引（与接收区记录一一对应，序号 = 记录下标 + 1），供查找对话框使用
+        self.record_endpoints = EndpointTable(lambda: self.scrollback.endpoint_ids())
+        self.scrollback = self._new_scrollback()
         
         self._create_widgets()
-        self._refresh_interfaces()
+        self._populate_interfaces()
+        # 网卡变化时由后台监视线程通知，无需手动刷新
+        interface_inventory.add_listener(self._on_interfaces_changed)
         
         # 更新连接历史显示
         self._update_connection_history_combo()
@@ -113,7 +181,14 @@ class TCPToolGUI:
         ttk.Radiobutton(control_frame, text="客户端模式", variable=self.mode_var, 
                        value="client", command=self._on_mode_change).grid(row=0, column=6, padx=(0, 10))
         ttk.Radiobutton(control_frame, text="服务器模式", variable=self.mode_var,
-                       value="server", command=self._on_mode_change).grid(row=0, column=7)
+                       value="server", command=self._on_mode_change).grid(row=0, column=7, padx=(0, 10))
+        ttk.Radiobutton(control_frame, text="代理模式", variable=self.mode_var,
+                       value="proxy", command=self._on_mode_change).grid(row=0, column=8, padx=(0, 20))
+        
+        ttk.Button(control_frame, text="损伤模拟", command=self._open_impairment_dialog).grid(row=0, column=9, padx=(0, 5))
+        ttk.Button(control_frame, text="发送限速", command=self._open_rate_limit_dialog).grid(row=0, column=10, padx=(0, 5))
+        ttk.Button(control_frame, text="自动应答", command=self._open_responder_dialog).grid(row=0, column=11, padx=(0, 5))
+        ttk.Button(control_frame, text="网卡统计", command=self._open_nic_monitor).grid(row=0, column=12)
         
         # ===== 连接配置区 =====
         self.config_frame = ttk.LabelFrame(main_frame, text="连接配置", padding="10")
@@ -179,6 +254,34 @@ class TCPToolGUI:
         client_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.client_listbox.config(yscrollcommand=client_scrollbar.set)
         
+        # 代理模式配置
+        self.proxy_config_frame = ttk.Frame(self.config_frame)
+        # 默认隐藏
+        
+        ttk.Label(self.proxy_config_frame, text="监听端口:").grid(row=0, column=0, sticky=tk.W, padx=(0, 5))
+        self.proxy_listen_port_entry = ttk.Entry(self.proxy_config_frame, width=8)
+        self.proxy_listen_port_entry.grid(row=0, column=1, padx=(0, 10))
+        self.proxy_listen_port_entry.insert(0, "9000")
+        
+        ttk.Label(self.proxy_config_frame, text="上游IP:").grid(row=0, column=2, sticky=tk.W, padx=(0, 5))
+        self.proxy_target_ip_entry = ttk.Entry(self.proxy_config_frame, width=16)
+        self.proxy_target_ip_entry.grid(row=0, column=3, padx=(0, 10))
+        self.proxy_target_ip_entry.insert(0, "127.0.0.1")
+        
+        ttk.Label(self.proxy_config_frame, text="端口:").grid(row=0, column=4, sticky=tk.W, padx=(0, 5))
+        self.proxy_target_port_entry = ttk.Entry(self.proxy_config_frame, width=8)
+        self.proxy_target_port_entry.grid(row=0, column=5, padx=(0, 10))
+        self.proxy_target_port_entry.insert(0, "8080")
+        
+        self.start_proxy_btn = ttk.Button(self.proxy_config_frame, text="启动代理", command=self._toggle_proxy)
+        self.start_proxy_btn.grid(row=0, column=6, padx=(0, 10))
+        
+        self.proxy_status_label = ttk.Label(self.proxy_config_frame, text="未启动", foreground="red")
+        self.proxy_status_label.grid(row=0, column=7)
+        
+        self.proxy_latency_label = ttk.Label(self.proxy_config_frame, text="")
+        self.proxy_latency_label.grid(row=1, column=0, columnspan=8, sticky=tk.W, pady=(5, 0))
+        
         # ===== 数据区 =====
         # 接收区
         receive_frame = ttk.LabelFrame(main_frame, text="接收数据", padding="10")
@@ -188,6 +291,11 @@ class TCPToolGUI:
         
         self.receive_text = scrolledtext.ScrolledText(receive_frame, wrap=tk.WORD, height=20)
         self.receive_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.receive_text.configure(yscrollcommand=self._on_receive_scroll)
+        self.receive_text.tag_configure("trigger", background="#fff3b0")
+        self.receive_text.tag_configure("search_hit", background="#cde8ff")
+        self.show_hex.trace_add("write", self._on_display_mode_change)
+        self.show_binary.trace_add("write", self._on_display_mode_change)
         
         receive_btn_frame = ttk.Frame(receive_frame)
         receive_btn_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
@@ -195,6 +303,20 @@ class TCPToolGUI:
         ttk.Checkbutton(receive_btn_frame, text="十六进制显示", variable=self.show_hex).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Checkbutton(receive_btn_frame, text="二进制显示", variable=self.show_binary).pack(side=tk.LEFT, padx=(0, 10))
         
+        # 时间戳精度与相对时间
+        ttk.Label(receive_btn_frame, text="时间戳:").pack(side=tk.LEFT)
+        self.ts_precision_combo = ttk.Combobox(receive_btn_frame, values=list(PRECISION_LABELS.values()),
+                                               width=5, state="readonly")
+        self.ts_precision_combo.set(PRECISION_LABELS[default_formatter.precision])
+        self.ts_precision_combo.pack(side=tk.LEFT, padx=(2, 5))
+        self.ts_precision_combo.bind("<<ComboboxSelected>>", lambda e: self._on_timestamp_format_change())
+        self.ts_relative = tk.BooleanVar(value=default_formatter.relative)
+        ttk.Checkbutton(receive_btn_frame, text="相对时间", variable=self.ts_relative,
+                        command=lambda: self._on_timestamp_format_change(reset_session=True)).pack(side=tk.LEFT, padx=(0, 10))
+        self.kernel_ts = tk.BooleanVar(value=False)
+        ttk.Checkbutton(receive_btn_frame, text="内核时间戳", variable=self.kernel_ts,
+                        command=self._toggle_kernel_timestamps).pack(side=tk.LEFT, padx=(0, 10))
+        
         # 暂停接收按钮
         self.pause_btn = ttk.Button(receive_btn_frame, text="暂停接收", command=self._toggle_receive_pause)
         self.pause_btn.pack(side=tk.LEFT, padx=(0, 5))
@@ -205,6 +327,10 @@ class TCPToolGUI:
         
         ttk.Button(receive_btn_frame, text="清空", command=self._clear_receive).pack(side=tk.LEFT)
         ttk.Button(receive_btn_frame, text="保存", command=self._save_receive).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(receive_btn_frame, text="查找", command=self._open_search_dialog).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(receive_btn_frame, text="触发", command=self._open_trigger_dialog).pack(side=tk.LEFT, padx=(10, 5))
+        self.trigger_label = ttk.Label(receive_btn_frame, text="", foreground="red")
+        self.trigger_label.pack(side=tk.LEFT)
         
         # 发送区
         send_frame = ttk.LabelFrame(main_frame, text="发送数据", padding="10")
@@ -223,6 +349,15 @@ class TCPToolGUI:
         self.history_combo = ttk.Combobox(history_frame, state="readonly", width=28)
         self.history_combo.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
         self.history_combo.bind('<<ComboboxSelected>>', self._on_history_select)
+        # 检索：关键字匹配备注/分组/标签/内容，可按分组过滤
+        ttk.Label(history_frame, text="搜索:").pack(side=tk.LEFT, padx=(0, 2))
+        self.history_search_entry = ttk.Entry(history_frame, width=10)
+        self.history_search_entry.pack(side=tk.LEFT, padx=(0, 5))
+        self.history_search_entry.bind('<KeyRelease>', self._on_history_search)
+        self.history_group_combo = ttk.Combobox(history_frame, state="readonly", width=8, values=["全部分组"])
+        self.history_group_combo.set("全部分组")
+        self.history_group_combo.pack(side=tk.LEFT, padx=(0, 5))
+        self.history_group_combo.bind('<<ComboboxSelected>>', lambda e: self._update_history_combo())
         ttk.Button(history_frame, text="备注", width=4, command=self._add_remark).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(history_frame, text="删除", width=4, command=self._delete_history_item).pack(side=tk.LEFT, padx=(0, 5))
         
@@ -235,14 +370,35 @@ class TCPToolGUI:
         ttk.Checkbutton(send_btn_frame, text="保存到历史", variable=self.save_to_history_var).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(send_btn_frame, text="发送", command=self._send_data).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(send_btn_frame, text="清空", command=self._clear_send).pack(side=tk.LEFT)
+        ttk.Button(send_btn_frame, text="校验和", command=self._open_checksum_dialog).pack(side=tk.LEFT, padx=(10, 5))
+        self.checksum_label = ttk.Label(send_btn_frame, text=self.checksum_config.summary(), foreground="gray")
+        self.checksum_label.pack(side=tk.LEFT)
     
     def _refresh_interfaces(self):
-        """刷新网卡列表"""
+        """手动刷新网卡列表"""
+        if not interface_inventory.refresh():
+            self._populate_interfaces()
+    
+    def _on_interfaces_changed(self, interfaces):
+        """网卡变化通知（后台线程）"""
+        self.root.after(0, self._populate_interfaces)
+    
+    def _populate_interfaces(self):
+        """用缓存的网卡列表填充下拉框，尽量保持当前选择"""
+        selected = self._get_selected_interface()
         self.interfaces = get_network_interfaces()
-        interface_names = [str(iface) for iface in self.interfaces]
+        interface_names = [str(iface) if iface.is_up else f"{iface} [未启用]" for iface in self.interfaces]
         self.interface_combo['values'] = interface_names
-        if interface_names:
-            self.interface_combo.current(0)
+        if not interface_names:
+            self.interface_combo.set("")
+            return
+        index = 0
+        if selected:
+            for i, iface in enumerate(self.interfaces):
+                if iface.name == selected.name and iface.ip == selected.ip:
+                    index = i
+                    break
+        self.interface_combo.current(index)
     
     def _get_selected_interface(self) -> Optional[NetworkInterface]:
         """获取选中的网卡"""
@@ -265,8 +421,25 @@ class TCPToolGUI:
             self.connect_btn.config(command=self._toggle_udp_connection)
             self.start_server_btn.config(command=self._toggle_udp_server)
         
-        if self.is_server_mode:
+        # 离开代理模式时停止代理
+        if mode != "proxy" and (self.tcp_proxy.running or self.udp_proxy.running):
+            self._toggle_proxy()
+        
+        if mode == "proxy":
             self.client_config_frame.grid_remove()
+            self.server_config_frame.grid_remove()
+            self.proxy_config_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
+            if self.tcp_client.connected:
+                self._toggle_client_connection()
+            if self.udp_client.connected:
+                self._toggle_udp_connection()
+            if self.tcp_server.running:
+                self._toggle_server()
+            if self.udp_server.running:
+                self._toggle_udp_server()
+        elif self.is_server_mode:
+            self.client_config_frame.grid_remove()
+            self.proxy_config_frame.grid_remove()
             self.server_config_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
             # 断开客户端连接
             if protocol == "TCP" and self.tcp_client.connected:
@@ -275,6 +448,7 @@ class TCPToolGUI:
                 self._toggle_udp_connection()
         else:
             self.server_config_frame.grid_remove()
+            self.proxy_config_frame.grid_remove()
             self.client_config_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
             # 停止服务器
             if protocol == "TCP" and self.tcp_server.running:
@@ -337,10 +511,12 @@ class TCPToolGUI:
     
     def _on_client_data(self, data: bytes):
         """客户端接收到数据"""
-        self.root.after(0, lambda: self._append_receive(data, from_server=False))
+        mark = self._scan_triggers(("tcp_client",), data)
+        self.root.after(0, lambda: self._append_receive(data, from_server=False, mark=mark))
     
     def _on_client_disconnected(self):
         """客户端断开连接"""
+        self.triggers.reset(("tcp_client",))
         self.root.after(0, lambda: self._update_client_status(False))
     
     def _on_server_client_connected(self, ip: str, port: int):
@@ -349,11 +525,13 @@ class TCPToolGUI:
     
     def _on_server_client_disconnected(self, ip: str, port: int):
         """服务器客户端断开"""
+        self.triggers.reset(("tcp_server", (ip, port)))
         self.root.after(0, lambda: self._remove_client(ip, port))
     
     def _on_server_data(self, ip: str, port: int, data: bytes):
         """服务器接收到数据"""
-        self.root.after(0, lambda: self._append_receive(data, from_server=True, client_addr=(ip, port)))
+        mark = self._scan_triggers(("tcp_server", (ip, port)), data)
+        self.root.after(0, lambda: self._append_receive(data, from_server=True, client_addr=(ip, port), mark=mark))
     
     def _update_client_status(self, connected: bool):
         """更新客户端连接状态"""
@@ -441,65 +619,86 @@ class TCPToolGUI:
         self.conn_history_combo['values'] = history_names
     
     def _load_config(self):
-        """从配置文件加载连接历史"""
+        """从配置存储加载连接历史和发送历史"""
         try:
-            if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    # 加载TCP连接历史（支持新旧两种格式）
-                    saved_history = config.get('connection_history', [])
-                    self.connection_history = []
-                    for item in saved_history:
-                        if isinstance(item, dict):
-                            # 新格式: {"ip": ip, "port": port, "remark": remark}
-                            self.connection_history.append({
-                                "ip": item["ip"],
-                                "port": int(item["port"]),
-                                "remark": item.get("remark", "")
-                            })
-                        elif isinstance(item, (list, tuple)) and len(item) == 2:
-                            # 旧格式: [ip, port]
-                            self.connection_history.append({
-                                "ip": item[0],
-                                "port": int(item[1]),
-                                "remark": ""
-                            })
-                    # 加载UDP连接历史（支持新旧两种格式）
-                    udp_history = config.get('udp_connection_history', [])
-                    self.udp_connection_history = []
-                    for item in udp_history:
-                        if isinstance(item, dict):
-                            # 新格式
-                            self.udp_connection_history.append({
-                                "ip": item["ip"],
-                                "port": int(item["port"]),
-                                "remark": item.get("remark", "")
-                            })
-                        elif isinstance(item, (list, tuple)) and len(item) == 2:
-                            # 旧格式
-                            self.udp_connection_history.append({
-                                "ip": item[0],
-                                "port": int(item[1]),
-                                "remark": ""
-                            })
-                    # 加载发送历史
-                    send_history = config.get('send_history', [])
-                    self.history_manager.from_list(send_history)
+            config = self.config_store.data
+            # 加载TCP连接历史（支持新旧两种格式）
+            saved_history = config.get('connection_history', [])
+            self.connection_history = []
+            for item in saved_history:
+                if isinstance(item, dict):
+                    # 新格式: {"ip": ip, "port": port, "remark": remark}
+                    self.connection_history.append({
+                        "ip": item["ip"],
+                        "port": int(item["port"]),
+                        "remark": item.get("remark", "")
+                    })
+                elif isinstance(item, (list, tuple)) and len(item) == 2:
+                    # 旧格式: [ip, port]
+                    self.connection_history.append({
+                        "ip": item[0],
+                        "port": int(item[1]),
+                        "remark": ""
+                    })
+            # 加载UDP连接历史（支持新旧两种格式）
+            udp_history = config.get('udp_connection_history', [])
+            self.udp_connection_history = []
+            for item in udp_history:
+                if isinstance(item, dict):
+                    # 新格式
+                    self.udp_connection_history.append({
+                        "ip": item["ip"],
+                        "port": int(item["port"]),
+                        "remark": item.get("remark", "")
+                    })
+                elif isinstance(item, (list, tuple)) and len(item) == 2:
+                    # 旧格式
+                    self.udp_connection_history.append({
+                        "ip": item[0],
+                        "port": int(item[1]),
+                        "remark": ""
+                    })
+            # 加载发送历史
+            send_history = config.get('send_history', [])
+            self.history_manager.from_list(send_history)
+            # 加载校验和设置
+            if config.get('checksum'):
+                self.checksum_config = ChecksumConfig.from_dict(config['checksum'])
+            # 加载触发模式（未修改时不重新编译，保留计数）
+            triggers = config.get('triggers', [])
+            if triggers != self.triggers.to_list():
+                self.triggers.from_list(triggers)
+            # 加载自动应答规则
+            auto_reply = config.get('auto_reply', {})
+            if auto_reply.get('rules', []) != self.responder.to_list():
+                self.responder.from_list(auto_reply.get('rules', []))
+            self.auto_reply_enabled.set(bool(auto_reply.get('enabled')))
+            self._apply_responder()
         except Exception as e:
             print(f"加载配置失败: {e}")
     
     def _save_config(self):
-        """保存配置到文件"""
-        try:
-            config = {
-                'connection_history': self.connection_history,
-                'udp_connection_history': self.udp_connection_history,
-                'send_history': self.history_manager.to_list()
-            }
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存配置失败: {e}")
+        """保存连接历史（只更新内存，由配置存储延迟写盘）；发送历史按条目保存，见 _save_history_item"""
+        self.config_store.update({
+            'connection_history': [dict(item) for item in self.connection_history],
+            'udp_connection_history': [dict(item) for item in self.udp_connection_history],
+        })
+    
+    def _save_history_item(self, item, front: bool = True):
+        """保存一条发送历史（日志只记录这一条），front 表示移到最前"""
+        self.config_store.upsert_item('send_history', item.to_dict(), 'data', front=front,
+                                      limit=self.history_manager.max_history)
+    
+    def _on_config_reloaded(self, config: dict):
+        """配置文件被外部修改（后台线程回调）"""
+        self.root.after(0, self._reload_config)
+    
+    def _reload_config(self):
+        """重新加载配置并刷新历史下拉框"""
+        self._load_config()
+        self._update_connection_history_combo()
+        self._update_history_combo()
+        self.checksum_label.config(text=self.checksum_config.summary())
     
     def _on_connection_history_select(self, event):
         """选择历史连接并自动连接"""
@@ -634,30 +833,120 @@ class TCPToolGUI:
     
     def _flush_paused_data(self):
         """将缓冲的数据显示到文本区"""
-        for data, from_server, client_addr in self.paused_data_buffer:
-            self._display_received_data(data, from_server, client_addr)
+        for data, from_server, client_addr, direction, mark in self.paused_data_buffer:
+            self._display_received_data(data, from_server, client_addr, direction, mark)
         self.paused_data_buffer.clear()
     
-    def _display_received_data(self, data: bytes, from_server: bool = False, client_addr: Optional[Tuple[str, int]] = None):
+    def _display_received_data(self, data: bytes, from_server: bool = False, client_addr: Optional[Tuple[str, int]] = None,
+                               direction: Optional[str] = None, mark: str = ""):
         """实际显示接收数据"""
-        show_hex = self.show_hex.get()
-        
-        if from_server and client_addr:
+        prefix = ""
+        if direction and client_addr:
+            prefix = f"[{DIRECTION_LABELS[direction]} {client_addr[0]}:{client_addr[1]}] "
+        elif from_server and client_addr:
             prefix = f"[来自 {client_addr[0]}:{client_addr[1]}] "
-            self.receive_text.insert(tk.END, prefix)
-        
-        formatted = format_received_data(data, show_hex, self.show_binary.get())
-        self.receive_text.insert(tk.END, formatted)
+        if direction is None:
+            prefix += self.checksum_config.check(data) or ""
+        self._add_display_record(data, prefix=prefix + mark, highlight=bool(mark),
+                                 source=f"{client_addr[0]}:{client_addr[1]}" if client_addr else None,
+                                 direction=direction)
+    
+    def _add_display_record(self, data: bytes, sent: bool = False, prefix: str = "", highlight: bool = False,
+                            source: Optional[str] = None, direction: Optional[str] = None):
+        """追加一条显示记录，每条记录起始处放一个mark以便切换模式时原地替换"""
+        endpoint_id, _ = self.record_endpoints.lookup(source)
+        self.scrollback.append(data, DIR_SENT if sent else DIRECTION_CODES.get(direction, DIR_RECEIVED), endpoint_id)
+        record = self.display_log.add(data, sent, prefix, highlight)
+        pos = self.receive_text.index("end-1c")
+        self.receive_text.insert(tk.END, record.render(self.display_mode), ("trigger",) if highlight else ())
+        self.receive_text.mark_set(f"rec{len(self.display_log) - 1}", pos)
         self.receive_text.see(tk.END)
     
-    def _append_receive(self, data: bytes, from_server: bool = False, client_addr: Optional[Tuple[str, int]] = None):
+    def _on_display_mode_change(self, *args):
+        """十六进制/二进制显示切换"""
+        mode = display_mode(self.show_hex.get(), self.show_binary.get())
+        if mode == self.display_mode:
+            return
+        self.display_mode = mode
+        self._rerender_records()
+    
+    def _on_timestamp_format_change(self, reset_session: bool = False):
+        """时间戳精度或相对时间切换，开启相对时间时从此刻开始计时"""
+        precision = {label: key for key, label in PRECISION_LABELS.items()}[self.ts_precision_combo.get()]
+        default_formatter.configure(precision, self.ts_relative.get())
+        if reset_session and self.ts_relative.get():
+            default_formatter.reset_session()
+        self._rerender_records()
+    
+    def _toggle_kernel_timestamps(self):
+        """内核接收时间戳开关，下次连接/启动时生效"""
+        enabled = self.kernel_ts.get()
+        if enabled and not kernel_timestamps_supported():
+            self.kernel_ts.set(False)
+            messagebox.showinfo("提示", "当前系统不支持内核接收时间戳，将使用程序接收时间")
+            return
+        for endpoint in (self.tcp_client, self.tcp_server, self.udp_client, self.udp_server,
+                         self.tcp_proxy, self.udp_proxy):
+            endpoint.kernel_timestamps = enabled
+        if enabled:
+            messagebox.showinfo("提示", "内核时间戳将在下次连接或启动时生效")
+    
+    def _rerender_records(self):
+        """只重新渲染可见的记录，其余在滚动到时再渲染"""
+        self._stale_records = set(range(len(self.display_log)))
+        at_bottom = self.receive_text.yview()[1] >= 0.999
+        self._render_visible()
+        if at_bottom:
+            self.receive_text.see(tk.END)
+    
+    def _on_receive_scroll(self, first, last):
+        """接收区滚动回调"""
+        self.receive_text.vbar.set(first, last)
+        if self._stale_records and not self._render_pending:
+            self._render_pending = True
+            self.root.after_idle(self._render_visible)
+    
+    def _record_at(self, index: str) -> int:
+        """二分查找文本位置所在的记录下标"""
+        lo, hi = 0, len(self.display_log) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.receive_text.compare(f"rec{mid}", "<=", index):
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+    
+    def _render_visible(self):
+        """把可见范围内仍是旧显示模式的记录替换为当前模式"""
+        self._render_pending = False
+        if not self._stale_records:
+            return
+        text = self.receive_text
+        first = self._record_at(text.index("@0,0"))
+        last = self._record_at(text.index(f"@0,{text.winfo_height()}"))
+        count = len(self.display_log)
+        for i in range(first, last + 1):
+            if i not in self._stale_records:
+                continue
+            self._stale_records.discard(i)
+            end = text.index(f"rec{i + 1}") if i + 1 < count else text.index("end-1c")
+            # 先在旧内容之后插入新内容再删除旧内容，保证相邻记录的mark位置不变
+            record = self.display_log.records[i]
+            text.insert(end, record.render(self.display_mode), ("trigger",) if record.highlight else ())
+            text.delete(f"rec{i}", end)
+    
+    def _append_receive(self, data: bytes, from_server: bool = False, client_addr: Optional[Tuple[str, int]] = None,
+                        direction: Optional[str] = None, mark: str = ""):
         """追加接收数据到显示区"""
+        if mark:
+            self._notify_trigger()
         if self.is_receive_paused:
             # 如果暂停，将数据存入缓冲区
-            self.paused_data_buffer.append((data, from_server, client_addr))
+            self.paused_data_buffer.append((data, from_server, client_addr, direction, mark))
             return
         
-        self._display_received_data(data, from_server, client_addr)
+        self._display_received_data(data, from_server, client_addr, direction, mark)
     
     def _send_data(self):
         """发送数据"""
@@ -667,18 +956,28 @@ class TCPToolGUI:
         
         # 如果勾选了保存到历史
         if self.save_to_history_var.get():
-            self.history_manager.add(data_str)
+            self._save_history_item(self.history_manager.add(data_str))
             self._update_history_combo()
-            self._save_config()
         
         # 转换数据
         if self.send_hex.get():
-            if not is_valid_hex(data_str):
-                messagebox.showerror("错误", "无效的十六进制数据")
+            try:
+                data = hex_to_bytes(data_str)
+            except HexParseError as e:
+                messagebox.showerror("错误", f"无效的十六进制数据，{e}")
+                if e.position is not None:
+                    # 定位到出错字符（data_str 已去掉首尾空白）
+                    raw = self.send_text.get("1.0", "end-1c")
+                    index = f"1.0 + {len(raw) - len(raw.lstrip()) + e.position} chars"
+                    self.send_text.tag_remove(tk.SEL, "1.0", tk.END)
+                    self.send_text.tag_add(tk.SEL, index, f"{index} + 1 chars")
+                    self.send_text.mark_set(tk.INSERT, index)
+                    self.send_text.see(index)
+                    self.send_text.focus_set()
                 return
-            data = hex_to_bytes(data_str)
         else:
             data = data_str.encode('utf-8')
+        data = self.checksum_config.apply(data)
         
         # 发送
         success = False
@@ -704,9 +1003,8 @@ class TCPToolGUI:
                 success = self.udp_client.send(data)
         
         if success:
-            formatted = format_sent_data(data, self.show_hex.get(), self.show_binary.get())
-            self.receive_text.insert(tk.END, formatted)
-            self.receive_text.see(tk.END)
+            target = self.selected_client if self.is_server_mode else None
+            self._add_display_record(data, sent=True, source=f"{target[0]}:{target[1]}" if target else None)
         else:
             messagebox.showerror("错误", "发送失败")
     
@@ -715,45 +1013,78 @@ class TCPToolGUI:
         self._send_data(save_to_history=True)
     
     def _update_history_combo(self):
-        """更新历史记录下拉框"""
-        self.history_combo['values'] = self.history_manager.get_display_names()
+        """按检索条件更新历史记录下拉框（条件和记录都未变化时跳过）"""
+        query = self.history_search_entry.get()
+        group = self.history_group_combo.get()
+        group = None if group == "全部分组" else group
+        view_key = (self.history_manager.version, query, group)
+        if view_key == self._history_view_key:
+            return
+        self._history_view_key = view_key
+        items = self.history_manager.search(query, group=group, limit=HISTORY_VIEW_LIMIT)
+        self._history_view = [item.data for item in items]
+        self.history_combo['values'] = [str(item) for item in items]
+        self.history_combo.set("")
+        self.history_group_combo['values'] = ["全部分组"] + self.history_manager.groups()
+    
+    def _on_history_search(self, event=None):
+        """检索输入变化，稍作延迟后刷新以免每次按键都检索"""
+        if self._history_search_job:
+            self.root.after_cancel(self._history_search_job)
+        self._history_search_job = self.root.after(150, self._run_history_search)
+    
+    def _run_history_search(self):
+        self._history_search_job = None
+        self._update_history_combo()
+        if self._history_view and self.history_search_entry.get():
+            self.history_combo.current(0)
+    
+    def _selected_history_item(self) -> Optional[HistoryItem]:
+        """下拉框当前选中的历史记录"""
+        idx = self.history_combo.current()
+        if 0 <= idx < len(self._history_view):
+            return self.history_manager.get(self._history_view[idx])
+        return None
     
     def _on_history_select(self, event):
         """选择历史记录"""
-        idx = self.history_combo.current()
-        item = self.history_manager.get_item(idx)
+        item = self._selected_history_item()
         if item:
             self.send_text.delete("1.0", tk.END)
             self.send_text.insert("1.0", item.data)
     
     def _add_remark(self):
-        """为选中的历史记录添加备注"""
-        idx = self.history_combo.current()
-        if idx < 0:
-            messagebox.showwarning("提示", "请先选择一条历史记录")
-            return
-        
-        item = self.history_manager.get_item(idx)
+        """为选中的历史记录添加备注、分组和标签"""
+        item = self._selected_history_item()
         if not item:
+            messagebox.showwarning("提示", "请先选择一条历史记录")
             return
         
         # 弹出输入对话框
         dialog = tk.Toplevel(self.root)
         dialog.title("添加备注")
-        dialog.geometry("300x120")
+        dialog.geometry("300x230")
         dialog.transient(self.root)
         dialog.grab_set()
         
         ttk.Label(dialog, text="备注:").pack(pady=(10, 5))
         remark_entry = ttk.Entry(dialog, width=35)
-        remark_entry.pack(pady=(0, 10))
+        remark_entry.pack(pady=(0, 5))
         remark_entry.insert(0, item.remark)
+        ttk.Label(dialog, text="分组（如设备类型）:").pack(pady=(0, 5))
+        group_combo = ttk.Combobox(dialog, width=33, values=self.history_manager.groups())
+        group_combo.pack(pady=(0, 5))
+        group_combo.set(item.group)
+        ttk.Label(dialog, text="标签（逗号分隔）:").pack(pady=(0, 5))
+        tags_entry = ttk.Entry(dialog, width=35)
+        tags_entry.pack(pady=(0, 10))
+        tags_entry.insert(0, ", ".join(item.tags))
         
         def save_remark():
-            remark = remark_entry.get().strip()
-            item.remark = remark
+            self.history_manager.update(item.data, remark_entry.get().strip(), group_combo.get().strip(),
+                                        tags_entry.get())
+            self._save_history_item(item, front=False)
             self._update_history_combo()
-            self._save_config()
             dialog.destroy()
         
         btn_frame = ttk.Frame(dialog)
@@ -769,21 +1100,26 @@ class TCPToolGUI:
     
     def _delete_history_item(self):
         """删除选中的发送历史记录"""
-        idx = self.history_combo.current()
-        if idx < 0:
+        item = self._selected_history_item()
+        if not item:
             messagebox.showwarning("提示", "请先选择一条历史记录")
             return
         
         if messagebox.askyesno("确认删除", "确定要删除这条历史记录吗？"):
-            self.history_manager.delete_item(idx)
+            self.history_manager.delete(item.data)
+            self.config_store.delete_item('send_history', 'data', item.data)
             self._update_history_combo()
-            self._save_config()
             # 清空发送区
             self.send_text.delete("1.0", tk.END)
     
     def _clear_receive(self):
         """清空接收区"""
         self.receive_text.delete("1.0", tk.END)
+        self.receive_text.mark_unset(*[f"rec{i}" for i in range(len(self.display_log))])
+        self.display_log.clear()
+        self._stale_records.clear()
+        self.scrollback.close()
+        self.scrollback = self._new_scrollback()
     
     def _clear_send(self):
         """清空发送区"""
@@ -792,7 +1128,8 @@ class TCPToolGUI:
     def _save_receive(self):
         """保存接收数据"""
         from tkinter import filedialog
-        content = self.receive_text.get("1.0", tk.END)
+        # 按当前显示模式完整渲染，包括尚未滚动到的记录
+        content = ''.join(self.display_log.render_all(self.display_mode))
         if not content.strip():
             return
         
@@ -806,12 +1143,144 @@ class TCPToolGUI:
     
     def on_close(self):
         """关闭窗口"""
+        interface_inventory.remove_listener(self._on_interfaces_changed)
         self.tcp_client.disconnect()
         self.tcp_server.stop()
         self.udp_client.disconnect()
         self.udp_server.stop()
+        self.tcp_proxy.stop()
+        self.udp_proxy.stop()
+        self.nic_monitor.stop()
+        self.config_store.remove_listener(self._on_config_reloaded)
+        self.config_store.stop()
         self.root.destroy()
     
+    # ===== 记录查找 =====
+    
+    def _new_scrollback(self) -> Scrollback:
+        """按配置文件中的 scrollback 设置创建记录索引"""
+        try:
+            return Scrollback.from_dict(self.config_store.data.get('scrollback') or {})
+        except (TypeError, ValueError) as e:
+            print(f"回看缓冲配置无效: {e}")
+            return Scrollback()
+    
+    def _open_search_dialog(self):
+        """按端点/方向/时间/长度/内容查找接收区中的记录，双击结果定位"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("查找记录")
+        dialog.transient(self.root)
+        dialog.columnconfigure(1, weight=1)
+        dialog.rowconfigure(8, weight=1)
+        
+        endpoint_combo = ttk.Combobox(dialog, values=sorted(self.record_endpoints.to_dict().values()), width=24)
+        direction_combo = ttk.Combobox(dialog, values=list(SEARCH_DIRECTIONS), state="readonly", width=12)
+        direction_combo.set("全部方向")
+        entries = {key: ttk.Entry(dialog, width=26) for key in ("since", "until", "min_len", "max_len", "pattern")}
+        fields = [
+            ("端点(ip:port):", endpoint_combo),
+            ("方向:", direction_combo),
+            ("起始时间:", entries["since"]),
+            ("结束时间:", entries["until"]),
+            ("最小长度:", entries["min_len"]),
+            ("最大长度:", entries["max_len"]),
+            ("内容:", entries["pattern"]),
+        ]
+        for row, (label, widget) in enumerate(fields):
+            ttk.Label(dialog, text=label).grid(row=row, column=0, sticky=tk.W, padx=10, pady=2)
+            widget.grid(row=row, column=1, sticky=tk.W, padx=10, pady=2)
+        ttk.Label(dialog, text="时间格式 HH:MM:SS 或 YYYY-MM-DD HH:MM:SS；内容为文字或 hex:AA 55",
+                  foreground="gray").grid(row=len(fields), column=0, columnspan=2, sticky=tk.W, padx=10)
+        
+        result_frame = ttk.Frame(dialog)
+        result_frame.grid(row=8, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10, pady=5)
+        result_frame.columnconfigure(0, weight=1)
+        result_frame.rowconfigure(0, weight=1)
+        result_list = tk.Listbox(result_frame, width=90, height=15, font=("Consolas", 9))
+        result_list.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=result_list.yview)
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        result_list.configure(yscrollcommand=scrollbar.set)
+        info_label = ttk.Label(dialog, text="")
+        info_label.grid(row=9, column=0, columnspan=2, sticky=tk.W, padx=10)
+        
+        state = {"query": None, "scanned": None, "seqs": []}
+        
+        def parse_time(text: str):
+            text = text.strip()
+            if not text:
+                return ''
+            for fmt in ("%Y-%m-%d %H:%M:%S", "%H:%M:%S"):
+                try:
+                    value = datetime.strptime(text, fmt)
+                except ValueError:
+                    continue
+                if fmt == "%H:%M:%S":
+                    value = datetime.combine(datetime.now().date(), value.time())
+                return value.timestamp() * 1000
+            raise ValueError(f"时间格式无效: {text}")
+        
+        def run(more: bool):
+            if not more:
+                try:
+                    state["query"] = TrafficQuery.from_dict({
+                        "endpoint": endpoint_combo.get().strip(),
+                        "direction": SEARCH_DIRECTIONS[direction_combo.get()],
+                        "since": parse_time(entries["since"].get()),
+                        "until": parse_time(entries["until"].get()),
+                        "min_len": entries["min_len"].get().strip(),
+                        "max_len": entries["max_len"].get().strip(),
+                        "pattern": entries["pattern"].get().strip(),
+                    }, self.record_endpoints)
+                except ValueError as e:
+                    messagebox.showerror("错误", f"查找条件无效: {e}", parent=dialog)
+                    return
+                state["scanned"] = None
+                state["seqs"] = []
+                result_list.delete(0, tk.END)
+            if state["query"] is None:
+                return
+            started = time.perf_counter()
+            seqs, blob, state["scanned"], done = self.scrollback.search(state["query"], state["scanned"],
+                                                                         SEARCH_PAGE_LIMIT)
+            elapsed = (time.perf_counter() - started) * 1000
+            endpoints = self.record_endpoints.to_dict()
+            labels = {DIRECTION_NAMES[name]: label for label, name in SEARCH_DIRECTIONS.items() if name}
+            for seq, record in zip(seqs, unpack_records(blob)):
+                when = time.strftime("%H:%M:%S", time.localtime(record["seconds"])) + f".{record['nanos'] // 1_000_000:03d}"
+                preview = bytes_to_hex(record["data"][:16]) + (" ..." if len(record["data"]) > 16 else "")
+                result_list.insert(tk.END, f"#{seq:<8} {when}  {labels.get(record['direction'], ''):<6} "
+                                           f"{endpoints.get(record['endpoint'], ''):<21} {len(record['data']):>6}字节  {preview}")
+            state["seqs"].extend(seqs)
+            more_btn.config(state=tk.DISABLED if done else tk.NORMAL)
+            info_label.config(text=f"共 {len(state['seqs'])} 条{'（已查完）' if done else ''}，"
+                                   f"本批用时 {elapsed:.1f} ms")
+        
+        def locate(event=None):
+            selection = result_list.curselection()
+            if selection:
+                self._show_record(state["seqs"][selection[0]] - 1)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.grid(row=10, column=0, columnspan=2, pady=5)
+        ttk.Button(btn_frame, text="查找", command=lambda: run(False)).pack(side=tk.LEFT, padx=5)
+        more_btn = ttk.Button(btn_frame, text="下一批", command=lambda: run(True), state=tk.DISABLED)
+        more_btn.pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        result_list.bind("<Double-Button-1>", locate)
+        result_list.bind("<Return>", locate)
+        entries["pattern"].bind("<Return>", lambda e: run(False))
+    
+    def _show_record(self, index: int):
+        """滚动到接收区中的第 index 条记录并高亮"""
+        if not 0 <= index < len(self.display_log):
+            return
+        text = self.receive_text
+        end = f"rec{index + 1}" if index + 1 < len(self.display_log) else "end-1c"
+        text.tag_remove("search_hit", "1.0", tk.END)
+        text.tag_add("search_hit", f"rec{index}", end)
+        text.see(f"rec{index}")
+    
     # ===== UDP相关方法 =====
     
     def _on_protocol_change(self):
@@ -820,23 +1289,27 @@ class TCPToolGUI:
     
     def _on_udp_client_data(self, ip: str, port: int, data: bytes):
         """UDP客户端接收数据"""
-        show_hex = self.show_hex.get()
-        formatted = format_received_data(data, show_hex, self.show_binary.get())
-        self.receive_text.insert(tk.END, f"[来自 {ip}:{port}]\n{formatted}")
-        self.receive_text.see(tk.END)
+        mark = self._scan_triggers(("udp_client", (ip, port)), data)
+        self.root.after(0, lambda: self._add_udp_record(ip, port, data, mark))
     
     def _on_udp_server_data(self, ip: str, port: int, data: bytes):
         """UDP服务器接收数据"""
-        show_hex = self.show_hex.get()
-        formatted = format_received_data(data, show_hex, self.show_binary.get())
-        self.receive_text.insert(tk.END, f"[来自 {ip}:{port}]\n{formatted}")
-        self.receive_text.see(tk.END)
+        mark = self._scan_triggers(("udp_server", (ip, port)), data)
+        self.root.after(0, lambda: self._add_udp_record(ip, port, data, mark))
         
         # 更新客户端列表
         client_addr = f"{ip}:{port}"
         if client_addr not in self.client_listbox.get(0, tk.END):
             self.client_listbox.insert(tk.END, client_addr)
     
+    def _add_udp_record(self, ip: str, port: int, data: bytes, mark: str):
+        """显示UDP接收数据"""
+        if mark:
+            self._notify_trigger()
+        check = self.checksum_config.check(data) or ""
+        self._add_display_record(data, prefix=f"[来自 {ip}:{port}]\n{check}{mark}", highlight=bool(mark),
+                                 source=f"{ip}:{port}")
+    
     def _toggle_udp_connection(self, skip_save: bool = False):
         """切换UDP连接"""
         if self.udp_client.connected:
@@ -878,7 +1351,8 @@ class TCPToolGUI:
             self.server_status_label.config(text="未启动", foreground="red")
             self.client_listbox.delete(0, tk.END)
         else:
-            bind_ip = self.interface_combo.get().split("(")[-1].rstrip(")") if "(" in self.interface_combo.get() else "0.0.0.0"
+            iface = self._get_selected_interface()
+            bind_ip = iface.ip if iface else "0.0.0.0"
             port_str = self.listen_port_entry.get().strip()
             
             if not port_str:
@@ -896,3 +1370,471 @@ class TCPToolGUI:
                 self.server_status_label.config(text="运行中", foreground="green")
             else:
                 messagebox.showerror("错误", "启动UDP服务器失败")
+    
+    # ===== 代理相关方法 =====
+    
+    def _toggle_proxy(self):
+        """切换代理状态"""
+        proxy = self.tcp_proxy if self.protocol_mode.get() == "TCP" else self.udp_proxy
+        if self.tcp_proxy.running or self.udp_proxy.running:
+            self.tcp_proxy.stop()
+            self.udp_proxy.stop()
+            self.start_proxy_btn.config(text="启动代理")
+            self.proxy_status_label.config(text="未启动", foreground="red")
+            return
+        
+        iface = self._get_selected_interface()
+        bind_ip = iface.ip if iface else "0.0.0.0"
+        target_ip = self.proxy_target_ip_entry.get().strip()
+        try:
+            listen_port = int(self.proxy_listen_port_entry.get().strip())
+            target_port = int(self.proxy_target_port_entry.get().strip())
+        except ValueError:
+            messagebox.showerror("错误", "端口必须是数字")
+            return
+        if not target_ip:
+            messagebox.showwarning("提示", "请填写上游IP")
+            return
+        
+        if proxy.start(bind_ip, listen_port, target_ip, target_port):
+            self.start_proxy_btn.config(text="停止代理")
+            self.proxy_status_label.config(
+                text=f"运行中 ({bind_ip}:{listen_port} → {target_ip}:{target_port})", foreground="green")
+            self._update_proxy_latency()
+        else:
+            messagebox.showerror("错误", "启动代理失败")
+    
+    def _update_proxy_latency(self):
+        """定时刷新代理附加延迟"""
+        proxy = self.tcp_proxy if self.tcp_proxy.running else self.udp_proxy
+        if not proxy.running:
+            self.proxy_latency_label.config(text="")
+            return
+        self.proxy_latency_label.config(text=f"转发延迟: {proxy.latency.summary()}")
+        self.root.after(1000, self._update_proxy_latency)
+    
+    def _on_proxy_traffic(self, direction: str, client_addr: Tuple[str, int], data: bytes):
+        """代理旁路数据"""
+        mark = self._scan_triggers((direction, client_addr), data)
+        self.root.after(0, lambda: self._append_receive(data, client_addr=client_addr, direction=direction, mark=mark))
+    
+    # ===== 网络损伤模拟 =====
+    
+    def _apply_impairment(self):
+        """把当前损伤参数挂到所有网络对象和代理上"""
+        tx = self.impairment_config if self.impair_tx.get() else None
+        rx = self.impairment_config if self.impair_rx.get() else None
+        for endpoint in (self.tcp_client, self.tcp_server, self.udp_client, self.udp_server):
+            attach_impairment(endpoint, tx, rx)
+        # 代理: 发送方向对应客户端→上游，接收方向对应上游→客户端
+        self.tcp_proxy.set_impairment(tx, rx)
+        self.udp_proxy.set_impairment(tx, rx)
+    
+    def _impairment_summary(self) -> str:
+        """当前生效的损伤计数摘要"""
+        lines = []
+        names = {"tx": "发送", "rx": "接收", "c2s": "客户端→上游", "s2c": "上游→客户端"}
+        sources = [("TCP客户端", impairment_stats(self.tcp_client)), ("TCP服务器", impairment_stats(self.tcp_server)),
+                   ("UDP客户端", impairment_stats(self.udp_client)), ("UDP服务器", impairment_stats(self.udp_server)),
+                   ("TCP代理", self.tcp_proxy.impairment_stats()), ("UDP代理", self.udp_proxy.impairment_stats())]
+        for source, stats in sources:
+            for key, st in stats.items():
+                if st['packets_in']:
+                    lines.append(f"{source}{names[key]}: 输入{st['packets_in']} 投递{st['delivered']} 丢弃{st['dropped']} "
+                                 f"重复{st['duplicated']} 乱序{st['reordered']} 排队{st['pending']}")
+        return "\n".join(lines) or "暂无数据"
+    
+    def _open_impairment_dialog(self):
+        """损伤模拟设置对话框"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("网络损伤模拟")
+        dialog.transient(self.root)
+        
+        cfg = self.impairment_config
+        fields = [
+            ("delay_ms", "固定延迟(ms):", cfg.delay_ms),
+            ("jitter_ms", "抖动(ms):", cfg.jitter_ms),
+            ("loss", "丢包率(%):", cfg.loss * 100),
+            ("duplicate", "重复率(%):", cfg.duplicate * 100),
+            ("reorder", "乱序率(%, 仅UDP):", cfg.reorder * 100),
+            ("bandwidth_kbps", "带宽上限(kbps):", cfg.bandwidth_kbps),
+        ]
+        entries = {}
+        for row, (key, label, value) in enumerate(fields):
+            ttk.Label(dialog, text=label).grid(row=row, column=0, sticky=tk.W, padx=10, pady=2)
+            entry = ttk.Entry(dialog, width=12)
+            entry.grid(row=row, column=1, padx=10, pady=2)
+            entry.insert(0, f"{value:g}")
+            entries[key] = entry
+        
+        distribution_var = tk.StringVar(value=cfg.distribution)
+        row = len(fields)
+        ttk.Label(dialog, text="抖动分布:").grid(row=row, column=0, sticky=tk.W, padx=10, pady=2)
+        ttk.Combobox(dialog, textvariable=distribution_var, values=["uniform", "normal"],
+                     state="readonly", width=10).grid(row=row, column=1, padx=10, pady=2)
+        ttk.Checkbutton(dialog, text="发送方向 (代理: 客户端→上游)", variable=self.impair_tx).grid(
+            row=row + 1, column=0, columnspan=2, sticky=tk.W, padx=10)
+        ttk.Checkbutton(dialog, text="接收方向 (代理: 上游→客户端)", variable=self.impair_rx).grid(
+            row=row + 2, column=0, columnspan=2, sticky=tk.W, padx=10)
+        
+        stats_label = ttk.Label(dialog, text=self._impairment_summary(), justify=tk.LEFT)
+        stats_label.grid(row=row + 4, column=0, columnspan=2, sticky=tk.W, padx=10, pady=(5, 10))
+        
+        def apply():
+            try:
+                values = {key: float(entry.get().strip() or 0) for key, entry in entries.items()}
+            except ValueError:
+                messagebox.showerror("错误", "参数必须是数字", parent=dialog)
+                return
+            for key in ("loss", "duplicate", "reorder"):
+                values[key] = min(max(values[key], 0), 100) / 100
+            values["distribution"] = distribution_var.get()
+            try:
+                self.impairment_config = ImpairmentConfig.from_dict(values)
+            except ValueError as e:
+                messagebox.showerror("错误", f"参数无效: {e}", parent=dialog)
+                return
+            self._apply_impairment()
+        
+        def refresh_stats():
+            if dialog.winfo_exists():
+                stats_label.config(text=self._impairment_summary())
+                dialog.after(1000, refresh_stats)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.grid(row=row + 3, column=0, columnspan=2, pady=5)
+        ttk.Button(btn_frame, text="应用", command=apply).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        refresh_stats()
+    
+    # ===== 校验和 =====
+    
+    def _open_checksum_dialog(self):
+        """校验和设置对话框"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("校验和")
+        dialog.transient(self.root)
+        
+        cfg = self.checksum_config
+        labels = {a.label: name for name, a in ALGORITHMS.items()}
+        algorithm_var = tk.StringVar(value=ALGORITHMS[cfg.algorithm].label if cfg.algorithm else "")
+        ttk.Label(dialog, text="预设:").grid(row=0, column=0, sticky=tk.W, padx=10, pady=2)
+        preset_combo = ttk.Combobox(dialog, values=list(PRESETS), state="readonly", width=20)
+        preset_combo.grid(row=0, column=1, padx=10, pady=2)
+        ttk.Label(dialog, text="算法:").grid(row=1, column=0, sticky=tk.W, padx=10, pady=2)
+        ttk.Combobox(dialog, textvariable=algorithm_var, values=list(labels), state="readonly",
+                     width=20).grid(row=1, column=1, padx=10, pady=2)
+        ttk.Label(dialog, text="起始偏移:").grid(row=2, column=0, sticky=tk.W, padx=10, pady=2)
+        start_entry = ttk.Entry(dialog, width=12)
+        start_entry.grid(row=2, column=1, sticky=tk.W, padx=10, pady=2)
+        start_entry.insert(0, str(cfg.start))
+        ttk.Label(dialog, text="结束偏移(空=末尾):").grid(row=3, column=0, sticky=tk.W, padx=10, pady=2)
+        end_entry = ttk.Entry(dialog, width=12)
+        end_entry.grid(row=3, column=1, sticky=tk.W, padx=10, pady=2)
+        if cfg.end is not None:
+            end_entry.insert(0, str(cfg.end))
+        append_var = tk.BooleanVar(value=cfg.append)
+        verify_var = tk.BooleanVar(value=cfg.verify)
+        ttk.Checkbutton(dialog, text="发送时自动追加", variable=append_var).grid(
+            row=4, column=0, columnspan=2, sticky=tk.W, padx=10)
+        ttk.Checkbutton(dialog, text="校验接收数据（校验值在帧尾）", variable=verify_var).grid(
+            row=5, column=0, columnspan=2, sticky=tk.W, padx=10)
+        
+        def on_preset(event):
+            name, start, end = PRESETS[preset_combo.get()]
+            algorithm_var.set(ALGORITHMS[name].label)
+            start_entry.delete(0, tk.END)
+            start_entry.insert(0, str(start))
+            end_entry.delete(0, tk.END)
+            if end is not None:
+                end_entry.insert(0, str(end))
+        preset_combo.bind('<<ComboboxSelected>>', on_preset)
+        
+        stats_label = ttk.Label(dialog, text="", justify=tk.LEFT)
+        stats_label.grid(row=7, column=0, columnspan=2, sticky=tk.W, padx=10, pady=(5, 10))
+        
+        def apply():
+            try:
+                config = ChecksumConfig.from_dict({
+                    "algorithm": labels.get(algorithm_var.get(), ""),
+                    "start": start_entry.get().strip(),
+                    "end": end_entry.get().strip(),
+                    "append": append_var.get(),
+                    "verify": verify_var.get(),
+                })
+            except ValueError:
+                messagebox.showerror("错误", "偏移必须是整数", parent=dialog)
+                return
+            self.checksum_config = config
+            self.checksum_label.config(text=config.summary())
+            self.config_store.set('checksum', config.to_dict())
+        
+        def refresh_stats():
+            if not dialog.winfo_exists():
+                return
+            cfg = self.checksum_config
+            stats_label.config(text=f"已校验{cfg.checked}帧 错误{cfg.errors}帧" if cfg.verify else "未启用接收校验")
+            dialog.after(1000, refresh_stats)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.grid(row=6, column=0, columnspan=2, pady=5)
+        ttk.Button(btn_frame, text="应用", command=apply).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        refresh_stats()
+    
+    # ===== 触发匹配 =====
+    
+    def _scan_triggers(self, stream, data: bytes) -> str:
+        """在网络线程中扫描接收数据，命中时返回显示前缀"""
+        matches = self.triggers.scan(stream, data)
+        return match_label(matches) if matches else ""
+    
+    def _notify_trigger(self):
+        """命中触发模式：更新计数并提示（响铃每秒最多一次）"""
+        self.trigger_label.config(text=f"触发 {self.triggers.total} 次")
+        now = time.monotonic()
+        if now - self._trigger_bell_at >= 1.0:
+            self._trigger_bell_at = now
+            self.root.bell()
+    
+    def _open_trigger_dialog(self):
+        """触发模式设置对话框"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("触发匹配")
+        dialog.transient(self.root)
+        
+        ttk.Label(dialog, text="每行一个模式，格式: 名称=hex:AA 55 或 名称=text:ALARM（不写前缀按十六进制）",
+                  justify=tk.LEFT).pack(anchor=tk.W, padx=10, pady=(10, 2))
+        patterns_text = tk.Text(dialog, width=60, height=10)
+        patterns_text.pack(padx=10, pady=2)
+        patterns_text.insert("1.0", "\n".join(p.to_line() for p in self.triggers.patterns))
+        stats_label = ttk.Label(dialog, text="", justify=tk.LEFT)
+        
+        def apply():
+            patterns = []
+            for lineno, line in enumerate(patterns_text.get("1.0", tk.END).splitlines(), 1):
+                if not line.strip():
+                    continue
+                try:
+                    patterns.append(TriggerPattern.parse(line))
+                except ValueError as e:
+                    messagebox.showerror("错误", f"第{lineno}行无效: {e}", parent=dialog)
+                    return
+            self.triggers.set_patterns(patterns)
+            self.trigger_label.config(text="")
+            self.config_store.set('triggers', self.triggers.to_list())
+        
+        def reset_counts():
+            self.triggers.reset_counts()
+            self.trigger_label.config(text="")
+        
+        def refresh_stats():
+            if not dialog.winfo_exists():
+                return
+            lines = [f"{st['name']}: {st['count']}次" for st in self.triggers.stats()]
+            stats_label.config(text="\n".join(lines) or "未设置触发模式")
+            dialog.after(1000, refresh_stats)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text="应用", command=apply).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="清零计数", command=reset_counts).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        stats_label.pack(anchor=tk.W, padx=10, pady=(5, 10))
+        refresh_stats()
+    
+    # ===== 自动应答 =====
+    
+    def _apply_responder(self):
+        """启用时把规则引擎挂到TCP/UDP服务器上"""
+        responder = self.responder if self.auto_reply_enabled.get() else None
+        self.tcp_server.responder = responder
+        self.udp_server.responder = responder
+    
+    def _save_responder_config(self):
+        """启用状态或规则变化后应用并保存"""
+        self._apply_responder()
+        self.config_store.set('auto_reply', {'enabled': self.auto_reply_enabled.get(),
+                                             'rules': self.responder.to_list()})
+    
+    def _on_auto_reply(self, rule: Rule, reply: bytes):
+        """自动应答已发送（网络线程回调），显示为发送记录"""
+        self.root.after(0, lambda: self._add_display_record(reply, sent=True, prefix=f"[自动应答 {rule.name}] "))
+    
+    def _open_responder_dialog(self):
+        """自动应答规则对话框"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("自动应答")
+        dialog.transient(self.root)
+        
+        ttk.Checkbutton(dialog, text="启用（TCP/UDP服务器模式收到数据时自动应答）",
+                        variable=self.auto_reply_enabled, command=self._save_responder_config).pack(anchor=tk.W, padx=10, pady=(10, 2))
+        help_text = ("每行一条规则: 名称 | 匹配方式 | 模式 | 应答 [| 延迟ms [| 校验算法[:起始[:结束]]]]\n"
+                     f"匹配方式: {', '.join(f'{k}({v})' for k, v in MATCH_LABELS.items())}\n"
+                     "模式/应答默认十六进制，text: 开头为文本；掩码模式用 ? 表示任意半字节，如 CC DD ?? 0?\n"
+                     "应答字段: {in[2]} {in[2:4]} 回显请求字节，{1} {名称} 正则分组，{count} 应答序号\n"
+                     "例: 查询 | prefix | CC DD A1 | CC DD B1 {in[3]} 00 | 50 | relay_sum:2")
+        ttk.Label(dialog, text=help_text, justify=tk.LEFT, foreground="gray").pack(anchor=tk.W, padx=10, pady=2)
+        rules_text = tk.Text(dialog, width=80, height=12)
+        rules_text.pack(padx=10, pady=2)
+        rules_text.insert("1.0", "\n".join(rule.to_line() for rule in self.responder.rules))
+        stats_label = ttk.Label(dialog, text="", justify=tk.LEFT)
+        
+        def apply():
+            rules = []
+            for lineno, line in enumerate(rules_text.get("1.0", tk.END).splitlines(), 1):
+                if not line.strip():
+                    continue
+                try:
+                    rules.append(Rule.parse(line))
+                except (ValueError, re.error) as e:
+                    messagebox.showerror("错误", f"第{lineno}行无效: {e}", parent=dialog)
+                    return
+            self.responder.set_rules(rules)
+            self._save_responder_config()
+        
+        def refresh_stats():
+            if not dialog.winfo_exists():
+                return
+            lines = [f"应答{self.responder.replies}次 未命中{self.responder.unmatched}帧"]
+            lines += [f"{st['name']}: {st['hits']}次" for st in self.responder.stats() if st['hits']]
+            stats_label.config(text="\n".join(lines))
+            dialog.after(1000, refresh_stats)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text="应用", command=apply).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        stats_label.pack(anchor=tk.W, padx=10, pady=(5, 10))
+        refresh_stats()
+    
+    # ===== 发送限速 =====
+    
+    def _open_rate_limit_dialog(self):
+        """发送限速设置对话框"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("发送限速")
+        dialog.transient(self.root)
+        
+        current = self.tcp_client.rate_limiter or RateLimiter()
+        fields = [
+            ("conn_bps", "每连接 字节/秒:", current.bytes_per_sec),
+            ("conn_mps", "每连接 消息/秒:", current.msgs_per_sec),
+            ("global_bps", "全局 字节/秒:", GLOBAL_LIMITER.bytes_per_sec),
+            ("global_mps", "全局 消息/秒:", GLOBAL_LIMITER.msgs_per_sec),
+        ]
+        entries = {}
+        for row, (key, label, value) in enumerate(fields):
+            ttk.Label(dialog, text=label).grid(row=row, column=0, sticky=tk.W, padx=10, pady=2)
+            entry = ttk.Entry(dialog, width=12)
+            entry.grid(row=row, column=1, padx=10, pady=2)
+            entry.insert(0, f"{value:g}")
+            entries[key] = entry
+        
+        row = len(fields)
+        nonblocking_var = tk.BooleanVar(value=not GLOBAL_LIMITER.blocking)
+        ttk.Checkbutton(dialog, text="非阻塞（超限直接丢弃并计为拒绝）", variable=nonblocking_var).grid(
+            row=row, column=0, columnspan=2, sticky=tk.W, padx=10)
+        
+        stats_label = ttk.Label(dialog, text="", justify=tk.LEFT)
+        stats_label.grid(row=row + 2, column=0, columnspan=2, sticky=tk.W, padx=10, pady=(5, 10))
+        
+        def apply():
+            try:
+                values = {key: float(entry.get().strip() or 0) for key, entry in entries.items()}
+            except ValueError:
+                messagebox.showerror("错误", "参数必须是数字", parent=dialog)
+                return
+            blocking = not nonblocking_var.get()
+            for endpoint in (self.tcp_client, self.tcp_server, self.udp_client, self.udp_server):
+                if values["conn_bps"] or values["conn_mps"]:
+                    endpoint.rate_limiter = RateLimiter(values["conn_bps"], values["conn_mps"], blocking=blocking)
+                else:
+                    endpoint.rate_limiter = None
+            GLOBAL_LIMITER.configure(values["global_bps"], values["global_mps"], blocking=blocking)
+        
+        def refresh_stats():
+            if not dialog.winfo_exists():
+                return
+            lines = []
+            sources = [("TCP客户端", self.tcp_client), ("TCP服务器", self.tcp_server),
+                       ("UDP客户端", self.udp_client), ("UDP服务器", self.udp_server)]
+            for name, limiter in [(n, e.rate_limiter) for n, e in sources] + [("全局", GLOBAL_LIMITER)]:
+                if limiter and limiter.enabled():
+                    st = limiter.stats_snapshot()
+                    lines.append(f"{name}: 放行{st['allowed']} 限速等待{st['throttled']}次/"
+                                 f"{st['throttled_time']:.2f}s 拒绝{st['rejected']}")
+            stats_label.config(text="\n".join(lines) or "未启用限速")
+            dialog.after(1000, refresh_stats)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.grid(row=row + 1, column=0, columnspan=2, pady=5)
+        ttk.Button(btn_frame, text="应用", command=apply).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        refresh_stats()
+    
+    # ===== 网卡吞吐监视 =====
+    
+    def _open_nic_monitor(self):
+        """网卡统计窗口"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("网卡统计")
+        dialog.geometry("760x260")
+        
+        top = ttk.Frame(dialog, padding="5")
+        top.pack(fill=tk.X)
+        ttk.Label(top, text="采样间隔(秒):").pack(side=tk.LEFT)
+        interval_entry = ttk.Entry(top, width=6)
+        interval_entry.pack(side=tk.LEFT, padx=(5, 10))
+        interval_entry.insert(0, f"{self.nic_monitor.interval:g}")
+        
+        columns = ("rx", "tx", "rx_pps", "tx_pps", "drop", "err")
+        headings = ("接收速率", "发送速率", "接收包/秒", "发送包/秒", "丢包(本周期/累计)", "错误(本周期/累计)")
+        tree = ttk.Treeview(dialog, columns=columns, height=8)
+        tree.heading("#0", text="网卡")
+        tree.column("#0", width=110)
+        for col, text in zip(columns, headings):
+            tree.heading(col, text=text)
+            tree.column(col, width=105, anchor=tk.E)
+        tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        
+        def update(samples):
+            if not dialog.winfo_exists():
+                return
+            for name, st in samples.items():
+                total = self.nic_monitor.totals.get(name, {})
+                values = (
+                    format_rate(st.rx_bps), format_rate(st.tx_bps),
+                    f"{st.rx_pps:.0f}", f"{st.tx_pps:.0f}",
+                    f"{st.drop_in + st.drop_out}/{total.get('drop_in', 0) + total.get('drop_out', 0)}",
+                    f"{st.err_in + st.err_out}/{total.get('err_in', 0) + total.get('err_out', 0)}",
+                )
+                if tree.exists(name):
+                    tree.item(name, values=values)
+                else:
+                    tree.insert("", tk.END, iid=name, text=name, values=values)
+                # 本周期出现丢包或错误时高亮
+                tree.item(name, tags=("alert",) if st.drop_in + st.drop_out + st.err_in + st.err_out else ())
+        tree.tag_configure("alert", foreground="red")
+        
+        def on_samples(samples):
+            self.root.after(0, lambda: update(samples))
+        
+        def restart():
+            try:
+                interval = float(interval_entry.get().strip())
+            except ValueError:
+                messagebox.showerror("错误", "采样间隔必须是数字", parent=dialog)
+                return
+            # 运行中调用start只更新采样间隔
+            self.nic_monitor.start(interval)
+        
+        def on_close():
+            self.nic_monitor.remove_listener(on_samples)
+            self.nic_monitor.stop()
+            dialog.destroy()
+        
+        ttk.Button(top, text="应用", command=restart).pack(side=tk.LEFT)
+        dialog.protocol("WM_DELETE_WINDOW", on_close)
+        self.nic_monitor.add_listener(on_samples)
+        self.nic_monitor.start()
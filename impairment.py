@@ -0,0 +1,303 @@
+"""
+网络损伤模拟
+对发送/接收/代理的数据注入延迟、抖动、丢包、重复、乱序和带宽限制，
+所有流共用一个定时器堆线程计时，到期的数据交给各损伤环节自己的投递线程发送，
+某个连接发送阻塞或回调较慢时不会拖住其他连接
+"""
+
+import collections
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from network import TCPClient, TCPServer
+
+
+class TimerHeap:
+    """基于最小堆的单线程定时调度器"""
+    def __init__(self):
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, due: float, callback: Callable, *args):
+        """在 time.monotonic() 到达 due 时执行 callback(*args)"""
+        entry = (due, next(self._seq), callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            # 新任务排在堆顶时唤醒调度线程重新计算等待时间
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def schedule_after(self, delay: float, callback: Callable, *args):
+        """延迟 delay 秒后执行"""
+        self.schedule(time.monotonic() + delay, callback, *args)
+
+    def pending(self) -> int:
+        """待执行任务数"""
+        return len(self._heap)
+
+    def _run(self):
+        """调度线程"""
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, callback, args = self._heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"定时任务执行错误: {e}")
+
+
+class SerialWorker:
+    """按提交顺序在独立线程中执行任务，空闲一段时间后线程退出，有新任务时再启动"""
+    IDLE_EXIT = 30.0
+
+    def __init__(self, name: str = "worker"):
+        self.name = name
+        self._queue: collections.deque = collections.deque()
+        self._cond = threading.Condition()
+        self._running = False
+
+    def submit(self, callback: Callable, *args):
+        """提交任务，不阻塞"""
+        with self._cond:
+            self._queue.append((callback, args))
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, name=self.name, daemon=True).start()
+            else:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._queue:
+                    self._cond.wait(self.IDLE_EXIT)
+                    if not self._queue:
+                        self._running = False
+                        return
+                callback, args = self._queue.popleft()
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"{self.name}执行错误: {e}")
+
+
+_scheduler: Optional[TimerHeap] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> TimerHeap:
+    """获取全局共享的定时器堆"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = TimerHeap()
+    return _scheduler
+
+
+class ImpairmentConfig:
+    """损伤参数"""
+    def __init__(self, delay_ms: float = 0, jitter_ms: float = 0, distribution: str = "uniform",
+                 loss: float = 0, duplicate: float = 0, reorder: float = 0, reorder_gap_ms: float = 10,
+                 bandwidth_kbps: float = 0):
+        self.delay_ms = delay_ms            # 固定延迟
+        self.jitter_ms = jitter_ms          # 随机抖动幅度
+        self.distribution = distribution    # 抖动分布: uniform / normal
+        self.loss = loss                    # 丢包率 0~1
+        self.duplicate = duplicate          # 重复率 0~1
+        self.reorder = reorder              # 乱序率 0~1（仅数据报）
+        self.reorder_gap_ms = reorder_gap_ms  # 乱序包额外滞后时间
+        self.bandwidth_kbps = bandwidth_kbps  # 带宽上限，0表示不限
+
+    def is_active(self) -> bool:
+        """是否有任何损伤生效"""
+        return any((self.delay_ms, self.jitter_ms, self.loss, self.duplicate, self.reorder, self.bandwidth_kbps))
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ImpairmentConfig":
+        """由字典创建，参数无效或超出范围时抛出 ValueError"""
+        config = cls()
+        for key, value in d.items():
+            if key not in config.__dict__ or value is None:
+                continue
+            if key == "distribution":
+                if value not in ("uniform", "normal"):
+                    raise ValueError(f"未知的抖动分布: {value}")
+                config.distribution = value
+                continue
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} 必须是数字")
+            if not 0 <= value < float('inf'):
+                raise ValueError(f"{key} 不能为负数")
+            if key in ("loss", "duplicate", "reorder") and value > 1:
+                raise ValueError(f"{key} 必须在 0~1 之间")
+            setattr(config, key, value)
+        return config
+
+
+class Impairment:
+    """一个损伤环节，可挂到连接的发送/接收路径或代理上
+
+    stream=True 用于TCP字节流：只施加延迟/抖动/带宽限制并保持顺序，
+    丢包、重复和乱序会破坏字节流，因此被忽略。
+    """
+    def __init__(self, config: Optional[ImpairmentConfig] = None, stream: bool = False,
+                 scheduler: Optional[TimerHeap] = None):
+        self.config = config or ImpairmentConfig()
+        self.stream = stream
+        self.scheduler = scheduler or get_scheduler()
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self._link_free = 0.0     # 带宽限制下链路空闲时刻
+        self._last_due = 0.0      # 字节流模式下上一个包的投递时刻
+        self._inflight = 0        # 已进入定时器堆尚未投递的数量
+        self._worker = SerialWorker("损伤投递")  # 到期数据在此线程中按顺序投递
+        self.reset_stats()
+
+    def reset_stats(self):
+        """清空计数"""
+        self.stats = {
+            'packets_in': 0, 'bytes_in': 0,
+            'delivered': 0, 'bytes_out': 0,
+            'dropped': 0, 'duplicated': 0, 'reordered': 0,
+            'delayed': 0, 'throttled': 0,
+        }
+
+    def submit(self, data: bytes, deliver: Callable[[bytes], None]):
+        """提交一个数据块，按损伤参数在适当时刻调用 deliver(data)"""
+        config = self.config
+        if not config.is_active() and not self._inflight:
+            with self._lock:
+                self.stats['packets_in'] += 1
+                self.stats['bytes_in'] += len(data)
+            self._deliver(deliver, data)
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            stats = self.stats
+            stats['packets_in'] += 1
+            stats['bytes_in'] += len(data)
+            rng = self._rng
+            if not self.stream:
+                if config.loss and rng.random() < config.loss:
+                    stats['dropped'] += 1
+                    return
+                copies = 2 if config.duplicate and rng.random() < config.duplicate else 1
+                if copies == 2:
+                    stats['duplicated'] += 1
+            else:
+                copies = 1
+
+            # 带宽限制：按串行化时间排队
+            depart = now
+            if config.bandwidth_kbps:
+                tx_time = len(data) * 8 / (config.bandwidth_kbps * 1000)
+                depart = max(now, self._link_free) + tx_time
+                self._link_free = depart
+                if depart - now > tx_time:
+                    stats['throttled'] += 1
+
+            dues = []
+            for _ in range(copies):
+                delay = config.delay_ms
+                if config.jitter_ms:
+                    if config.distribution == "normal":
+                        delay += rng.gauss(0, config.jitter_ms / 2)
+                    else:
+                        delay += rng.uniform(-config.jitter_ms, config.jitter_ms)
+                due = depart + max(delay, 0) / 1000
+                if not self.stream and config.reorder and rng.random() < config.reorder:
+                    due += config.reorder_gap_ms / 1000
+                    stats['reordered'] += 1
+                if self.stream:
+                    # 字节流保持先进先出
+                    due = max(due, self._last_due)
+                    self._last_due = due
+                dues.append(due)
+
+        for due in dues:
+            # 字节流模式下若仍有排队数据，即使已到期也要进堆，避免越过前面的数据
+            if due <= now and not (self.stream and self._inflight):
+                self._deliver(deliver, data)
+            else:
+                with self._lock:
+                    if due > now:
+                        self.stats['delayed'] += 1
+                    self._inflight += 1
+                self.scheduler.schedule(due, self._worker.submit, self._deliver_scheduled, deliver, data)
+
+    def _deliver(self, deliver: Callable[[bytes], None], data: bytes):
+        """投递数据"""
+        with self._lock:
+            self.stats['delivered'] += 1
+            self.stats['bytes_out'] += len(data)
+        deliver(data)
+
+    def _deliver_scheduled(self, deliver: Callable[[bytes], None], data: bytes):
+        """到期的数据（在投递线程中执行）"""
+        try:
+            self._deliver(deliver, data)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def pending(self) -> int:
+        """排队中的数据块数"""
+        return self._inflight
+
+    def snapshot(self) -> dict:
+        """计数的一致副本"""
+        with self._lock:
+            return dict(self.stats)
+
+    def summary(self) -> str:
+        """单行文字摘要"""
+        s = self.snapshot()
+        return (f"输入{s['packets_in']} 投递{s['delivered']} 丢弃{s['dropped']} "
+                f"重复{s['duplicated']} 乱序{s['reordered']} 延迟{s['delayed']} 限速{s['throttled']}")
+
+
+def make_impairment(config: Optional[ImpairmentConfig], stream: bool) -> Optional[Impairment]:
+    """根据参数创建损伤环节，参数为空或全部为0时返回None"""
+    if config and config.is_active():
+        return Impairment(config, stream=stream)
+    return None
+
+
+def attach_impairment(endpoint, tx: Optional[ImpairmentConfig] = None, rx: Optional[ImpairmentConfig] = None):
+    """为网络对象挂载（或移除）发送/接收损伤环节，TCP对象自动使用字节流模式"""
+    stream = isinstance(endpoint, (TCPClient, TCPServer))
+    endpoint.tx_impairment = make_impairment(tx, stream)
+    endpoint.rx_impairment = make_impairment(rx, stream)
+
+
+def impairment_stats(endpoint) -> dict:
+    """汇总网络对象上挂载的损伤计数"""
+    result = {}
+    for key in ('tx_impairment', 'rx_impairment'):
+        impairment = getattr(endpoint, key, None)
+        if impairment:
+            result[key[:2]] = dict(impairment.snapshot(), pending=impairment.pending())
+    return result
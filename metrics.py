@@ -0,0 +1,120 @@
+"""
+运行指标（Prometheus 文本格式）
+计数器按线程分片: 每个网络线程只写自己的分片（普通字典），不加锁、不与其他线程竞争；
+抓取时汇总全部分片。已结束线程的分片在抓取时并入汇总，线程频繁创建也不会无限增长
+"""
+
+import bisect
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+# 延迟直方图的分桶上限（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """计数器和直方图"""
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self._retired: dict = {}        # 已结束线程的计数
+        self._lock = threading.Lock()   # 只在线程第一次计数和抓取时使用
+        self._help: Dict[str, Tuple[str, str]] = {}  # 指标名 -> (类型, 说明)
+
+    def describe(self, name: str, kind: str, text: str):
+        """登记指标类型（counter/gauge/histogram）和说明"""
+        self._help[name] = (kind, text)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1):
+        """计数器加 value"""
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name: str, labels: Labels, seconds: float):
+        """直方图记录一个值"""
+        shard = self._shard()
+        key = (name, labels, bisect.bisect_left(self.buckets, seconds))
+        shard[key] = shard.get(key, 0) + 1
+        key = (name, labels, 'sum')
+        shard[key] = shard.get(key, 0) + seconds
+
+    def collect(self) -> dict:
+        """汇总全部分片"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    _merge(self._retired, shard)
+            self._shards = alive
+            total = dict(self._retired)
+        for _, shard in alive:
+            _merge(total, shard)
+        return total
+
+    def render(self, gauges: Iterable[Tuple[str, Labels, float]] = ()) -> str:
+        """输出 Prometheus 文本格式，gauges 为抓取时计算的 (指标名, 标签, 值)"""
+        series: Dict[str, List[str]] = {}
+        histograms: Dict[Tuple[str, Labels], list] = {}
+        for key, value in sorted(self.collect().items(), key=lambda item: item[0][:2]):
+            if len(key) == 2:
+                series.setdefault(key[0], []).append(f"{key[0]}{_labels(key[1])} {_number(value)}")
+            else:
+                counts = histograms.setdefault(key[:2], [0] * (len(self.buckets) + 2))
+                counts[-1 if key[2] == 'sum' else key[2]] += value
+        for (name, labels), counts in sorted(histograms.items()):
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else _number(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(counts[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        for name, labels, value in gauges:
+            series.setdefault(name, []).append(f"{name}{_labels(labels)} {_number(value)}")
+        out = []
+        for name in sorted(series):
+            kind, text = self._help.get(name, ("untyped", ""))
+            if text:
+                out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+
+def _merge(total: dict, shard: dict):
+    # 其他线程可能正在写入该分片，先复制（dict() 复制期间不会切换线程）
+    for key, value in dict(shard).items():
+        total[key] = total.get(key, 0) + value
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
@@ -2,35 +2,207 @@ import socket
 import psutil
 import threading
 import time
-from typing import List, Tuple, Optional, Callable
+from typing import Dict, List, Tuple, Optional, Callable
+
+from ratelimit import GLOBAL_LIMITER, RateLimiter, acquire_send
+from timestamps import enable_kernel_timestamps, recv_timestamped, stamp
 
 
 class NetworkInterface:
     """网络接口信息"""
-    def __init__(self, name: str, ip: str, is_ipv4: bool = True):
+    def __init__(self, name: str, ip: str, is_ipv4: bool = True, netmask: Optional[str] = None,
+                 broadcast: Optional[str] = None, mtu: int = 0, is_up: bool = True):
         self.name = name
         self.ip = ip
         self.is_ipv4 = is_ipv4
+        self.netmask = netmask
+        self.broadcast = broadcast
+        self.mtu = mtu
+        self.is_up = is_up
     
     def __str__(self):
         return f"{self.name} ({self.ip})"
     
     def __repr__(self):
         return self.__str__()
+    
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'ip': self.ip,
+            'is_ipv4': self.is_ipv4,
+            'netmask': self.netmask,
+            'broadcast': self.broadcast,
+            'mtu': self.mtu,
+            'is_up': self.is_up,
+        }
 
 
-def get_network_interfaces() -> List[NetworkInterface]:
-    """获取所有网络接口信息"""
+def _enumerate_interfaces() -> Tuple[tuple, List[NetworkInterface]]:
+    """枚举网卡，返回(用于比较变化的签名, 接口列表)"""
+    addrs = psutil.net_if_addrs()
+    try:
+        stats = psutil.net_if_stats()
+    except Exception:
+        stats = {}
+    
     interfaces = []
-    stats = psutil.net_if_addrs()
+    signature = []
+    for name, addr_list in addrs.items():
+        st = stats.get(name)
+        mtu = st.mtu if st else 0
+        is_up = st.isup if st else True
+        signature.append((name, mtu, is_up))
+        for addr in addr_list:
+            if addr.family not in (socket.AF_INET, socket.AF_INET6):
+                continue
+            is_ipv4 = addr.family == socket.AF_INET
+            signature.append((addr.address, addr.netmask, addr.broadcast))
+            interfaces.append(NetworkInterface(name, addr.address, is_ipv4, addr.netmask,
+                                               addr.broadcast, mtu, is_up))
+    return tuple(signature), interfaces
+
+
+class InterfaceInventory:
+    """网卡清单缓存服务
+
+    查询直接返回缓存；后台线程在Linux上监听netlink地址/链路变化通知，
+    其他平台定期比较签名，只有网卡真正变化时才重建列表并通知监听者。
+    """
+    # netlink多播组: RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR
+    NETLINK_GROUPS = 0x1 | 0x10 | 0x100
+    
+    def __init__(self, poll_interval: float = 3.0):
+        self.poll_interval = poll_interval
+        self._interfaces: List[NetworkInterface] = []
+        self._signature: Optional[tuple] = None
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[List[NetworkInterface]], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self.version = 0  # 每次变化加1
     
-    for name, addrs in stats.items():
-        for addr in addrs:
-            # 只获取IPv4地址
-            if addr.family == socket.AF_INET:
-                interfaces.append(NetworkInterface(name, addr.address))
+    def get(self, include_ipv6: bool = False) -> List[NetworkInterface]:
+        """获取缓存的网卡列表（首次调用时同步枚举一次）"""
+        if self._signature is None:
+            self.refresh()
+        interfaces = self._interfaces
+        if include_ipv6:
+            return list(interfaces)
+        return [iface for iface in interfaces if iface.is_ipv4]
     
-    return interfaces
+    def refresh(self) -> bool:
+        """重新枚举并比较，有变化时通知监听者，返回是否变化"""
+        with self._lock:
+            signature, interfaces = _enumerate_interfaces()
+            if signature == self._signature:
+                return False
+            self._signature = signature
+            self._interfaces = interfaces
+            self.version += 1
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(interfaces)
+            except Exception as e:
+                print(f"网卡变化通知失败: {e}")
+        return True
+    
+    def add_listener(self, listener: Callable[[List[NetworkInterface]], None]):
+        """注册变化监听（在后台线程中回调），并确保后台监视已启动"""
+        self._listeners.append(listener)
+        self.start()
+    
+    def remove_listener(self, listener: Callable[[List[NetworkInterface]], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+    
+    def start(self):
+        """启动后台监视线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch_loop, daemon=True)
+            self._thread.start()
+    
+    def _open_netlink(self) -> Optional[socket.socket]:
+        """打开netlink路由通知socket，不支持时返回None"""
+        if not hasattr(socket, "AF_NETLINK"):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0)  # NETLINK_ROUTE
+            sock.bind((0, self.NETLINK_GROUPS))
+            return sock
+        except OSError:
+            return None
+    
+    def _watch_loop(self):
+        """后台监视循环"""
+        nl = self._open_netlink()
+        while True:
+            if nl:
+                # 有通知时稍等片刻合并同一批变化，超时也做一次兜底比较
+                nl.settimeout(self.poll_interval * 10)
+                try:
+                    nl.recv(65536)
+                    time.sleep(0.2)
+                    nl.settimeout(0)
+                    try:
+                        while nl.recv(65536):
+                            pass
+                    except (BlockingIOError, socket.timeout):
+                        pass
+                except socket.timeout:
+                    pass
+                except OSError:
+                    nl.close()
+                    nl = None
+            else:
+                time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"刷新网卡失败: {e}")
+
+
+# 全局网卡清单
+interface_inventory = InterfaceInventory()
+
+
+def get_network_interfaces(include_ipv6: bool = False) -> List[NetworkInterface]:
+    """获取所有网络接口信息（来自缓存，默认只含IPv4）"""
+    return interface_inventory.get(include_ipv6)
+
+
+def send_frames(send: Callable[[bytes], bool], frames: List[bytes], interval: float = 0.0,
+                on_sent: Optional[Callable[[bytes], None]] = None) -> int:
+    """依次发送多帧，interval 为相邻帧的间隔（秒，按第一帧的时刻计算，误差不累积）
+
+    返回成功发送的帧数，某一帧失败时停止；on_sent(帧) 在每帧发出后立即调用
+    """
+    start = time.monotonic()
+    for i, frame in enumerate(frames):
+        if interval > 0 and i:
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if not send(frame):
+            return i
+        if on_sent:
+            on_sent(frame)
+    return len(frames)
+
+
+def _coalesced(frames: List[bytes], ok: bool, on_sent: Optional[Callable[[bytes], None]]) -> int:
+    """合并为一次写入的批量发送结果"""
+    if not ok:
+        return 0
+    if on_sent:
+        for frame in frames:
+            on_sent(frame)
+    return len(frames)
+
+
+def _can_coalesce(limiter: Optional[RateLimiter], impairment, interval: float) -> bool:
+    """TCP批量发送时能否合并为一次 sendall（无间隔、无限速、无损伤模拟）"""
+    return interval <= 0 and limiter is None and impairment is None and not GLOBAL_LIMITER.enabled()
 
 
 class TCPClient:
@@ -42,12 +214,19 @@ class TCPClient:
         self.on_data_received: Optional[Callable[[bytes], None]] = None
         self.on_disconnected: Optional[Callable[[], None]] = None
         self.running = False
+        self.recv_size = 4096  # 单次recv缓冲区大小
+        self.tx_impairment = None  # 发送路径损伤环节（impairment.Impairment）
+        self.rx_impairment = None  # 接收路径损伤环节
+        self.rate_limiter: Optional[RateLimiter] = None  # 连接级发送限速（另受全局限速约束）
+        self.kernel_timestamps = False  # 是否使用内核接收时间戳（连接/启动前设置）
+        self.timestamp_source: Optional[str] = None  # 实际生效的时间戳选项，None表示用户态时间
     
     def connect(self, target_ip: str, target_port: int, source_ip: str = "0.0.0.0") -> bool:
         """连接到服务器，可指定源IP"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(5)
+            self.timestamp_source = enable_kernel_timestamps(self.socket) if self.kernel_timestamps else None
             
             # 绑定源IP（如果指定了具体IP而不是0.0.0.0）
             if source_ip and source_ip != "0.0.0.0":
@@ -77,27 +256,59 @@ class TCPClient:
                 pass
             self.socket = None
     
-    def send(self, data: bytes) -> bool:
-        """发送数据"""
+    def send(self, data: bytes, limited: bool = True) -> bool:
+        """发送数据，limited=False 时不受限速约束（代理转发）"""
         if not self.connected or not self.socket:
             return False
+        if limited and not acquire_send(self.rate_limiter, len(data)):
+            return False
+        if self.tx_impairment:
+            self.tx_impairment.submit(data, self._send_now)
+            return True
+        return self._send_now(data)
+    
+    def send_many(self, frames: List[bytes], interval: float = 0.0,
+                  on_sent: Optional[Callable[[bytes], None]] = None) -> int:
+        """批量发送，返回成功发送的帧数；无间隔等限制时合并为一次 sendall"""
+        if _can_coalesce(self.rate_limiter, self.tx_impairment, interval):
+            return _coalesced(frames, self.connected and self._send_now(b"".join(frames)), on_sent)
+        return send_frames(self.send, frames, interval, on_sent)
+    
+    def _send_now(self, data: bytes) -> bool:
+        """立即发送"""
+        sock = self.socket
+        if not self.connected or not sock:
+            return False
         try:
-            self.socket.sendall(data)
+            sock.sendall(data)
             return True
         except Exception as e:
             print(f"发送失败: {e}")
             self.connected = False
             return False
     
+    def _dispatch(self, data: bytes, kernel_ns: Optional[int] = None):
+        """将接收数据交给回调（经过接收损伤环节），数据附带接收时间戳"""
+        if not self.on_data_received:
+            return
+        data = stamp(data, kernel_ns)
+        if self.rx_impairment:
+            self.rx_impairment.submit(data, self.on_data_received)
+        else:
+            self.on_data_received(data)
+    
     def _receive_loop(self):
         """接收数据循环"""
+        stamped = self.timestamp_source is not None
         while self.running and self.connected:
             try:
                 self.socket.settimeout(0.5)
-                data = self.socket.recv(4096)
+                if stamped:
+                    data, kernel_ns, _ = recv_timestamped(self.socket, self.recv_size)
+                else:
+                    data, kernel_ns = self.socket.recv(self.recv_size), None
                 if data:
-                    if self.on_data_received:
-                        self.on_data_received(data)
+                    self._dispatch(data, kernel_ns)
                 else:
                     # 连接关闭
                     self.connected = False
@@ -126,6 +337,14 @@ class TCPServer:
         self.on_client_disconnected: Optional[Callable[[str, int], None]] = None
         self.on_data_received: Optional[Callable[[str, int, bytes], None]] = None
         self.client_threads: dict = {}
+        self.client_map: Dict[Tuple[str, int], socket.socket] = {}  # 地址 -> 客户端socket
+        self.recv_size = 4096
+        self.tx_impairment = None
+        self.rx_impairment = None
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.kernel_timestamps = False
+        self.timestamp_source: Optional[str] = None
+        self.responder = None  # 自动应答规则引擎（responder.RuleEngine）
     
     def start(self, bind_ip: str, port: int) -> bool:
         """启动服务器"""
@@ -156,6 +375,7 @@ class TCPServer:
             except:
                 pass
         self.clients.clear()
+        self.client_map.clear()
         
         # 关闭服务器socket
         if self.socket:
@@ -165,22 +385,60 @@ class TCPServer:
                 pass
             self.socket = None
     
-    def send_to_client(self, client_addr: Tuple[str, int], data: bytes) -> bool:
-        """向指定客户端发送数据"""
-        for client in self.clients:
+    def send_to_client(self, client_addr: Tuple[str, int], data: bytes, limited: bool = True) -> bool:
+        """向指定客户端发送数据，limited=False 时不受限速约束（代理转发、自动应答）"""
+        client_addr = tuple(client_addr)
+        if client_addr not in self.client_map:
+            return False
+        if limited and not acquire_send(self.rate_limiter, len(data)):
+            return False
+        if self.tx_impairment:
+            self.tx_impairment.submit(data, lambda d: self._send_to_client_now(client_addr, d))
+            return True
+        return self._send_to_client_now(client_addr, data)
+    
+    def send_many_to_client(self, client_addr: Tuple[str, int], frames: List[bytes], interval: float = 0.0,
+                            on_sent: Optional[Callable[[bytes], None]] = None) -> int:
+        """向指定客户端批量发送，返回成功发送的帧数；无间隔等限制时合并为一次 sendall"""
+        client_addr = tuple(client_addr)
+        if _can_coalesce(self.rate_limiter, self.tx_impairment, interval):
+            return _coalesced(frames, self._send_to_client_now(client_addr, b"".join(frames)), on_sent)
+        return send_frames(lambda d: self.send_to_client(client_addr, d), frames, interval, on_sent)
+    
+    def _send_to_client_now(self, client_addr: Tuple[str, int], data: bytes) -> bool:
+        """立即向指定客户端发送"""
+        client = self.client_map.get(client_addr)
+        if not client:
+            return False
+        try:
+            client.sendall(data)
+            return True
+        except:
+            return False
+    
+    def disconnect_client(self, client_addr: Tuple[str, int]):
+        """主动断开指定客户端"""
+        client = self.client_map.get(tuple(client_addr))
+        if client:
             try:
-                addr = client.getpeername()
-                if addr == client_addr:
-                    client.sendall(data)
-                    return True
+                client.shutdown(socket.SHUT_RDWR)
             except:
                 pass
-        return False
     
     def broadcast(self, data: bytes):
         """向所有客户端广播数据"""
+        count = len(self.clients)
+        if not count or not acquire_send(self.rate_limiter, len(data) * count, count):
+            return
+        if self.tx_impairment:
+            self.tx_impairment.submit(data, self._broadcast_now)
+        else:
+            self._broadcast_now(data)
+    
+    def _broadcast_now(self, data: bytes):
+        """立即向所有客户端广播"""
         disconnected = []
-        for client in self.clients:
+        for client in list(self.clients):
             try:
                 client.sendall(data)
             except:
@@ -202,12 +460,12 @@ class TCPServer:
                     client.close()
                     break
                 
-                self.clients.append(client)
+                self.timestamp_source = enable_kernel_timestamps(client) if self.kernel_timestamps else None
                 
-                if self.on_client_connected:
-                    self.on_client_connected(addr[0], addr[1])
+                self.clients.append(client)
+                self.client_map[addr] = client
                 
-                # 为每个客户端启动接收线程
+                # 为每个客户端启动接收线程（接入回调在该线程中调用，回调阻塞不影响接受其他连接）
                 client_thread = threading.Thread(
                     target=self._client_receive_loop,
                     args=(client, addr),
@@ -223,15 +481,33 @@ class TCPServer:
                     print(f"监听错误: {e}")
                 break
     
+    def _dispatch(self, addr: Tuple[str, int], data: bytes, kernel_ns: Optional[int] = None):
+        """将接收数据交给回调（经过接收损伤环节），数据附带接收时间戳；设置了自动应答时直接在本线程应答"""
+        responder = self.responder
+        if responder:
+            responder.respond(data, lambda reply: self.send_to_client(addr, reply, limited=False))
+        if not self.on_data_received:
+            return
+        data = stamp(data, kernel_ns)
+        if self.rx_impairment:
+            self.rx_impairment.submit(data, lambda d: self.on_data_received(addr[0], addr[1], d))
+        else:
+            self.on_data_received(addr[0], addr[1], data)
+    
     def _client_receive_loop(self, client: socket.socket, addr: Tuple[str, int]):
         """客户端接收循环"""
+        if self.on_client_connected:
+            self.on_client_connected(addr[0], addr[1])
+        stamped = self.timestamp_source is not None
         while self.running:
             try:
                 client.settimeout(0.5)
-                data = client.recv(4096)
+                if stamped:
+                    data, kernel_ns, _ = recv_timestamped(client, self.recv_size)
+                else:
+                    data, kernel_ns = client.recv(self.recv_size), None
                 if data:
-                    if self.on_data_received:
-                        self.on_data_received(addr[0], addr[1], data)
+                    self._dispatch(addr, data, kernel_ns)
                 else:
                     # 客户端断开
                     break
@@ -245,6 +521,8 @@ class TCPServer:
         # 清理客户端
         if client in self.clients:
             self.clients.remove(client)
+        if self.client_map.get(addr) is client:
+            del self.client_map[addr]
         try:
             client.close()
         except:
@@ -263,19 +541,25 @@ class UDPClient:
         self.on_data_received: Optional[Callable[[str, int, bytes], None]] = None
         self.running = False
         self.target_addr: Optional[Tuple[str, int]] = None
+        self.recv_size = 4096
+        self.tx_impairment = None
+        self.rx_impairment = None
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.kernel_timestamps = False
+        self.timestamp_source: Optional[str] = None
     
     def connect(self, target_ip: str, target_port: int, local_port: int = 0, broadcast: bool = False) -> bool:
         """创建UDP socket，可指定本地端口和广播模式"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.timestamp_source = enable_kernel_timestamps(self.socket) if self.kernel_timestamps else None
             
             # 启用广播
             if broadcast:
                 self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
             
-            # 绑定本地端口
-            if local_port > 0:
-                self.socket.bind(("0.0.0.0", local_port))
+            # 绑定本地端口（0表示由系统分配，提前绑定以便接收线程立即可用）
+            self.socket.bind(("0.0.0.0", local_port))
             
             self.target_addr = (target_ip, target_port)
             self.connected = True
@@ -301,30 +585,62 @@ class UDPClient:
                 pass
             self.socket = None
     
-    def send(self, data: bytes, target_ip: str = None, target_port: int = None) -> bool:
-        """发送数据"""
+    def send(self, data: bytes, target_ip: str = None, target_port: int = None, limited: bool = True) -> bool:
+        """发送数据，limited=False 时不受限速约束（代理转发）"""
         if not self.socket:
             return False
+        if target_ip and target_port:
+            addr = (target_ip, target_port)
+        elif self.target_addr:
+            addr = self.target_addr
+        else:
+            return False
+        if limited and not acquire_send(self.rate_limiter, len(data)):
+            return False
+        if self.tx_impairment:
+            self.tx_impairment.submit(data, lambda d: self._sendto_now(d, addr))
+            return True
+        return self._sendto_now(data, addr)
+    
+    def send_many(self, frames: List[bytes], interval: float = 0.0, target_ip: str = None, target_port: int = None,
+                  on_sent: Optional[Callable[[bytes], None]] = None) -> int:
+        """批量发送（每帧一个数据报），返回成功发送的帧数"""
+        return send_frames(lambda d: self.send(d, target_ip, target_port), frames, interval, on_sent)
+    
+    def _sendto_now(self, data: bytes, addr: Tuple[str, int]) -> bool:
+        """立即发送到指定地址"""
+        sock = self.socket
+        if not sock:
+            return False
         try:
-            if target_ip and target_port:
-                self.socket.sendto(data, (target_ip, target_port))
-            elif self.target_addr:
-                self.socket.sendto(data, self.target_addr)
-            else:
-                return False
+            sock.sendto(data, addr)
             return True
         except Exception as e:
             print(f"UDP发送失败: {e}")
             return False
     
+    def _dispatch(self, addr: Tuple[str, int], data: bytes, kernel_ns: Optional[int] = None):
+        """将接收数据交给回调（经过接收损伤环节），数据附带接收时间戳"""
+        if not self.on_data_received:
+            return
+        data = stamp(data, kernel_ns)
+        if self.rx_impairment:
+            self.rx_impairment.submit(data, lambda d: self.on_data_received(addr[0], addr[1], d))
+        else:
+            self.on_data_received(addr[0], addr[1], data)
+    
     def _receive_loop(self):
         """接收数据循环"""
+        stamped = self.timestamp_source is not None
         while self.running:
             try:
                 self.socket.settimeout(0.5)
-                data, addr = self.socket.recvfrom(4096)
-                if data and self.on_data_received:
-                    self.on_data_received(addr[0], addr[1], data)
+                if stamped:
+                    data, kernel_ns, addr = recv_timestamped(self.socket, self.recv_size)
+                else:
+                    (data, addr), kernel_ns = self.socket.recvfrom(self.recv_size), None
+                if data:
+                    self._dispatch(addr, data, kernel_ns)
             except socket.timeout:
                 continue
             except Exception as e:
@@ -341,12 +657,20 @@ class UDPServer:
         self.receive_thread: Optional[threading.Thread] = None
         self.on_data_received: Optional[Callable[[str, int, bytes], None]] = None
         self.clients: dict = {}  # 记录客户端地址和最后活跃时间
+        self.recv_size = 4096
+        self.tx_impairment = None
+        self.rx_impairment = None
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.kernel_timestamps = False
+        self.timestamp_source: Optional[str] = None
+        self.responder = None  # 自动应答规则引擎（responder.RuleEngine）
     
     def start(self, bind_ip: str, port: int) -> bool:
         """启动UDP服务器"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.timestamp_source = enable_kernel_timestamps(self.socket) if self.kernel_timestamps else None
             self.socket.bind((bind_ip, port))
             self.running = True
             
@@ -369,12 +693,29 @@ class UDPServer:
                 pass
             self.socket = None
     
-    def send_to(self, ip: str, port: int, data: bytes) -> bool:
-        """向指定地址发送数据"""
+    def send_to(self, ip: str, port: int, data: bytes, limited: bool = True) -> bool:
+        """向指定地址发送数据，limited=False 时不受限速约束（代理转发、自动应答）"""
         if not self.socket:
             return False
+        if limited and not acquire_send(self.rate_limiter, len(data)):
+            return False
+        if self.tx_impairment:
+            self.tx_impairment.submit(data, lambda d: self._sendto_now(d, (ip, port)))
+            return True
+        return self._sendto_now(data, (ip, port))
+    
+    def send_many_to(self, ip: str, port: int, frames: List[bytes], interval: float = 0.0,
+                     on_sent: Optional[Callable[[bytes], None]] = None) -> int:
+        """向指定地址批量发送（每帧一个数据报），返回成功发送的帧数"""
+        return send_frames(lambda d: self.send_to(ip, port, d), frames, interval, on_sent)
+    
+    def _sendto_now(self, data: bytes, addr: Tuple[str, int]) -> bool:
+        """立即发送到指定地址"""
+        sock = self.socket
+        if not sock:
+            return False
         try:
-            self.socket.sendto(data, (ip, port))
+            sock.sendto(data, addr)
             return True
         except Exception as e:
             print(f"UDP发送失败: {e}")
@@ -384,6 +725,15 @@ class UDPServer:
         """广播数据到指定端口"""
         if not self.socket:
             return
+        if not acquire_send(self.rate_limiter, len(data)):
+            return
+        if self.tx_impairment:
+            self.tx_impairment.submit(data, lambda d: self._broadcast_now(d, port))
+        else:
+            self._broadcast_now(data, port)
+    
+    def _broadcast_now(self, data: bytes, port: int):
+        """立即广播"""
         try:
             # 创建广播socket
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -401,17 +751,33 @@ class UDPServer:
         self.clients = {addr: t for addr, t in self.clients.items() if current_time - t < timeout}
         return list(self.clients.keys())
     
+    def _dispatch(self, addr: Tuple[str, int], data: bytes, kernel_ns: Optional[int] = None):
+        """将接收数据交给回调（经过接收损伤环节），数据附带接收时间戳；设置了自动应答时直接在本线程应答"""
+        responder = self.responder
+        if responder:
+            responder.respond(data, lambda reply: self.send_to(addr[0], addr[1], reply, limited=False))
+        if not self.on_data_received:
+            return
+        data = stamp(data, kernel_ns)
+        if self.rx_impairment:
+            self.rx_impairment.submit(data, lambda d: self.on_data_received(addr[0], addr[1], d))
+        else:
+            self.on_data_received(addr[0], addr[1], data)
+    
     def _receive_loop(self):
         """接收数据循环"""
+        stamped = self.timestamp_source is not None
         while self.running:
             try:
                 self.socket.settimeout(0.5)
-                data, addr = self.socket.recvfrom(4096)
+                if stamped:
+                    data, kernel_ns, addr = recv_timestamped(self.socket, self.recv_size)
+                else:
+                    (data, addr), kernel_ns = self.socket.recvfrom(self.recv_size), None
                 if data:
                     # 记录客户端
                     self.clients[addr] = time.time()
-                    if self.on_data_received:
-                        self.on_data_received(addr[0], addr[1], data)
+                    self._dispatch(addr, data, kernel_ns)
             except socket.timeout:
                 continue
             except Exception as e:
@@ -0,0 +1,142 @@
+"""
+网卡吞吐监视
+基于 psutil.net_io_counters(pernic=True) 定时采样内核计数，
+计算每个网卡的收发速率以及丢包/错误增量
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+
+class NicSample:
+    """单个网卡一个采样周期的统计"""
+    __slots__ = ('name', 'rx_bps', 'tx_bps', 'rx_pps', 'tx_pps',
+                 'rx_bytes', 'tx_bytes', 'drop_in', 'drop_out', 'err_in', 'err_out')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rx_bps = self.tx_bps = 0.0      # 字节/秒
+        self.rx_pps = self.tx_pps = 0.0      # 包/秒
+        self.rx_bytes = self.tx_bytes = 0    # 累计字节
+        self.drop_in = self.drop_out = 0     # 本周期丢包增量
+        self.err_in = self.err_out = 0       # 本周期错误增量
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class NicMonitor:
+    """网卡吞吐采样器"""
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.interfaces: Optional[List[str]] = None  # 只关注的网卡，None表示全部
+        self.running = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event: Optional[threading.Event] = None  # 每个采样线程一个，停止后旧线程不会再采样
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Dict[str, NicSample]], None]] = []
+        self._last: Optional[dict] = None
+        self._last_time = 0.0
+        self.latest: Dict[str, NicSample] = {}
+        # 自监视开始以来的累计丢包/错误
+        self.totals: Dict[str, Dict[str, int]] = {}
+
+    def add_listener(self, listener: Callable[[Dict[str, NicSample]], None]):
+        """注册采样回调（在采样线程中调用）"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Dict[str, NicSample]], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def start(self, interval: Optional[float] = None):
+        """开始采样"""
+        if interval:
+            self.interval = max(float(interval), 0.1)
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._last = None
+            self.totals = {}
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._sample_loop, args=(self._stop_event,), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止采样，等待采样线程退出（在采样回调中调用时不等待）"""
+        with self._lock:
+            self.running = False
+            thread, event = self._thread, self._stop_event
+            self._thread = self._stop_event = None
+        if event:
+            event.set()
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=2.0)
+
+    def sample(self) -> Dict[str, NicSample]:
+        """采样一次，返回与上次采样之间的速率（首次调用只记录基准）"""
+        now = time.monotonic()
+        counters = psutil.net_io_counters(pernic=True)
+        last, elapsed = self._last, now - self._last_time
+        self._last, self._last_time = counters, now
+        if last is None or elapsed <= 0:
+            return {}
+
+        wanted = self.interfaces
+        result = {}
+        for name, cur in counters.items():
+            if wanted is not None and name not in wanted:
+                continue
+            prev = last.get(name)
+            if prev is None:
+                continue
+            s = NicSample(name)
+            s.rx_bytes, s.tx_bytes = cur.bytes_recv, cur.bytes_sent
+            # 计数器可能因网卡重置而回绕，负增量按0处理
+            s.rx_bps = max(cur.bytes_recv - prev.bytes_recv, 0) / elapsed
+            s.tx_bps = max(cur.bytes_sent - prev.bytes_sent, 0) / elapsed
+            s.rx_pps = max(cur.packets_recv - prev.packets_recv, 0) / elapsed
+            s.tx_pps = max(cur.packets_sent - prev.packets_sent, 0) / elapsed
+            s.drop_in = max(cur.dropin - prev.dropin, 0)
+            s.drop_out = max(cur.dropout - prev.dropout, 0)
+            s.err_in = max(cur.errin - prev.errin, 0)
+            s.err_out = max(cur.errout - prev.errout, 0)
+            total = self.totals.setdefault(name, {'drop_in': 0, 'drop_out': 0, 'err_in': 0, 'err_out': 0})
+            for key in total:
+                total[key] += getattr(s, key)
+            result[name] = s
+        self.latest = result
+        return result
+
+    def _sample_loop(self, stop_event: threading.Event):
+        """采样线程"""
+        self.sample()
+        next_time = time.monotonic() + self.interval
+        while not stop_event.wait(max(next_time - time.monotonic(), 0)):
+            next_time += self.interval
+            try:
+                samples = self.sample()
+            except Exception as e:
+                print(f"网卡采样失败: {e}")
+                continue
+            if stop_event.is_set():
+                break
+            for listener in list(self._listeners):
+                try:
+                    listener(samples)
+                except Exception as e:
+                    print(f"网卡统计回调失败: {e}")
+
+
+def format_rate(bps: float) -> str:
+    """字节/秒格式化为易读的速率"""
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if bps < 1024:
+            return f"{bps:.1f} {unit}"
+        bps /= 1024
+    return f"{bps:.1f} GB/s"
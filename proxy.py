@@ -0,0 +1,292 @@
+"""
+TCP/UDP 中继代理
+在本地端口监听，为每个客户端建立一条到上游设备的连接，双向转发并旁路抓取数据
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from impairment import Impairment, ImpairmentConfig, make_impairment
+from network import TCPClient, TCPServer, UDPClient, UDPServer
+from timestamps import times_of
+
+# 方向标识
+DIR_UPSTREAM = "c2s"    # 客户端 -> 上游
+DIR_DOWNSTREAM = "s2c"  # 上游 -> 客户端
+
+DIRECTION_LABELS = {
+    DIR_UPSTREAM: "客户端→上游",
+    DIR_DOWNSTREAM: "上游→客户端",
+}
+
+# 代理使用更大的接收缓冲区，减少大块数据的转发次数
+PROXY_RECV_SIZE = 65536
+
+
+class LatencyStats:
+    """转发附加延迟统计（从数据到达到发送完成，旁路回调在转发之后调用，不计入）
+
+    数据到达时刻取网络层的接收时间戳，开启内核时间戳时即为内核收到数据的时刻
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._stats = {d: [0, 0, 0, 0, 0] for d in DIRECTION_LABELS}  # 次数, 字节, 总ns, 最小ns, 最大ns
+
+    def record(self, direction: str, nbytes: int, elapsed_ns: int):
+        """记录一次转发"""
+        with self._lock:
+            s = self._stats[direction]
+            s[0] += 1
+            s[1] += nbytes
+            s[2] += elapsed_ns
+            if s[0] == 1 or elapsed_ns < s[3]:
+                s[3] = elapsed_ns
+            if elapsed_ns > s[4]:
+                s[4] = elapsed_ns
+
+    def snapshot(self) -> dict:
+        """获取统计快照，延迟单位为微秒"""
+        with self._lock:
+            result = {}
+            for direction, (count, nbytes, total, lo, hi) in self._stats.items():
+                result[direction] = {
+                    'packets': count,
+                    'bytes': nbytes,
+                    'avg_us': round(total / count / 1000, 1) if count else 0.0,
+                    'min_us': round(lo / 1000, 1),
+                    'max_us': round(hi / 1000, 1),
+                }
+            return result
+
+    def summary(self) -> str:
+        """单行文字摘要"""
+        parts = []
+        for direction, s in self.snapshot().items():
+            parts.append(f"{DIRECTION_LABELS[direction]} {s['packets']}包 平均{s['avg_us']}µs 最大{s['max_us']}µs")
+        return " | ".join(parts)
+
+
+def _impairment_stats(c2s: Optional[Impairment], s2c: Optional[Impairment]) -> dict:
+    """汇总代理双向的损伤计数"""
+    result = {}
+    if c2s:
+        result[DIR_UPSTREAM] = dict(c2s.snapshot(), pending=c2s.pending())
+    if s2c:
+        result[DIR_DOWNSTREAM] = dict(s2c.snapshot(), pending=s2c.pending())
+    return result
+
+
+class TCPProxy:
+    """TCP中继代理"""
+    def __init__(self):
+        self.server = TCPServer()
+        self.server.recv_size = PROXY_RECV_SIZE
+        self.upstreams: Dict[Tuple[str, int], TCPClient] = {}
+        self.target_addr: Optional[Tuple[str, int]] = None
+        self.source_ip = "0.0.0.0"
+        self.running = False
+        self.kernel_timestamps = False  # 监听端和上游连接是否使用内核接收时间戳
+        self.latency = LatencyStats()
+        self.c2s_impairment: Optional[Impairment] = None  # 客户端->上游方向的损伤环节
+        # 旁路回调: (方向, 客户端地址, 数据)，在转发完成后调用，不增加转发延迟
+        self.on_traffic: Optional[Callable[[str, Tuple[str, int], bytes], None]] = None
+        self.on_client_connected: Optional[Callable[[str, int], None]] = None
+        self.on_client_disconnected: Optional[Callable[[str, int], None]] = None
+
+        self.server.on_client_connected = self._on_client_connected
+        self.server.on_client_disconnected = self._on_client_disconnected
+        self.server.on_data_received = self._on_client_data
+
+    def start(self, bind_ip: str, port: int, target_ip: str, target_port: int, source_ip: str = "0.0.0.0") -> bool:
+        """启动代理"""
+        self.target_addr = (target_ip, target_port)
+        self.source_ip = source_ip
+        self.latency.reset()
+        self.server.kernel_timestamps = self.kernel_timestamps
+        if not self.server.start(bind_ip, port):
+            return False
+        self.running = True
+        return True
+
+    def stop(self):
+        """停止代理"""
+        self.running = False
+        self.server.stop()
+        for upstream in list(self.upstreams.values()):
+            upstream.disconnect()
+        self.upstreams.clear()
+
+    def set_impairment(self, c2s: Optional[ImpairmentConfig] = None, s2c: Optional[ImpairmentConfig] = None):
+        """设置双向损伤参数"""
+        self.c2s_impairment = make_impairment(c2s, stream=True)
+        self.server.tx_impairment = make_impairment(s2c, stream=True)
+        for upstream in list(self.upstreams.values()):
+            upstream.tx_impairment = self.c2s_impairment
+    
+    def impairment_stats(self) -> dict:
+        """双向损伤计数"""
+        return _impairment_stats(self.c2s_impairment, self.server.tx_impairment)
+
+    def _on_client_connected(self, ip: str, port: int):
+        """客户端接入，建立对应的上游连接"""
+        addr = (ip, port)
+        upstream = TCPClient()
+        upstream.recv_size = PROXY_RECV_SIZE
+        upstream.kernel_timestamps = self.kernel_timestamps
+        upstream.tx_impairment = self.c2s_impairment
+        upstream.on_data_received = lambda data: self._on_upstream_data(addr, data)
+        upstream.on_disconnected = lambda: self.server.disconnect_client(addr)
+        # 在该客户端的接收线程中同步连接（接收尚未开始，数据暂存在内核缓冲区），不阻塞监听线程
+        if not upstream.connect(self.target_addr[0], self.target_addr[1], self.source_ip):
+            print(f"代理上游连接失败: {self.target_addr[0]}:{self.target_addr[1]}")
+            self.server.disconnect_client(addr)
+            return
+        self.upstreams[addr] = upstream
+        if self.on_client_connected:
+            self.on_client_connected(ip, port)
+
+    def _on_client_disconnected(self, ip: str, port: int):
+        """客户端断开，关闭对应的上游连接"""
+        upstream = self.upstreams.pop((ip, port), None)
+        if upstream:
+            upstream.disconnect()
+        if self.on_client_disconnected:
+            self.on_client_disconnected(ip, port)
+
+    def _on_client_data(self, ip: str, port: int, data: bytes):
+        """客户端 -> 上游"""
+        start = times_of(data)[1]
+        addr = (ip, port)
+        upstream = self.upstreams.get(addr)
+        if not upstream or not upstream.send(data, limited=False):
+            self.server.disconnect_client(addr)
+            return
+        self.latency.record(DIR_UPSTREAM, len(data), time.monotonic_ns() - start)
+        if self.on_traffic:
+            self.on_traffic(DIR_UPSTREAM, addr, data)
+
+    def _on_upstream_data(self, addr: Tuple[str, int], data: bytes):
+        """上游 -> 客户端"""
+        start = times_of(data)[1]
+        if not self.server.send_to_client(addr, data, limited=False):
+            upstream = self.upstreams.pop(addr, None)
+            if upstream:
+                upstream.disconnect()
+            return
+        self.latency.record(DIR_DOWNSTREAM, len(data), time.monotonic_ns() - start)
+        if self.on_traffic:
+            self.on_traffic(DIR_DOWNSTREAM, addr, data)
+
+    def get_clients(self):
+        """获取当前代理的客户端列表"""
+        return list(self.upstreams.keys())
+
+
+class UDPProxy:
+    """UDP中继代理"""
+    def __init__(self, idle_timeout: float = 300):
+        self.server = UDPServer()
+        self.server.recv_size = PROXY_RECV_SIZE
+        self.upstreams: Dict[Tuple[str, int], UDPClient] = {}
+        self.target_addr: Optional[Tuple[str, int]] = None
+        self.running = False
+        self.idle_timeout = idle_timeout
+        self.kernel_timestamps = False
+        self.latency = LatencyStats()
+        self.c2s_impairment: Optional[Impairment] = None
+        self.on_traffic: Optional[Callable[[str, Tuple[str, int], bytes], None]] = None
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+        self.server.on_data_received = self._on_client_data
+
+    def start(self, bind_ip: str, port: int, target_ip: str, target_port: int) -> bool:
+        """启动代理"""
+        self.target_addr = (target_ip, target_port)
+        self.latency.reset()
+        self.server.kernel_timestamps = self.kernel_timestamps
+        if not self.server.start(bind_ip, port):
+            return False
+        self.running = True
+        return True
+
+    def stop(self):
+        """停止代理"""
+        self.running = False
+        self.server.stop()
+        with self._lock:
+            for upstream in self.upstreams.values():
+                upstream.disconnect()
+            self.upstreams.clear()
+
+    def set_impairment(self, c2s: Optional[ImpairmentConfig] = None, s2c: Optional[ImpairmentConfig] = None):
+        """设置双向损伤参数"""
+        self.c2s_impairment = make_impairment(c2s, stream=False)
+        self.server.tx_impairment = make_impairment(s2c, stream=False)
+        with self._lock:
+            for upstream in self.upstreams.values():
+                upstream.tx_impairment = self.c2s_impairment
+
+    def impairment_stats(self) -> dict:
+        """双向损伤计数"""
+        return _impairment_stats(self.c2s_impairment, self.server.tx_impairment)
+
+    def _get_upstream(self, addr: Tuple[str, int]) -> Optional[UDPClient]:
+        """获取或创建客户端对应的上游socket"""
+        upstream = self.upstreams.get(addr)
+        if upstream:
+            return upstream
+        with self._lock:
+            upstream = self.upstreams.get(addr)
+            if upstream:
+                return upstream
+            upstream = UDPClient()
+            upstream.recv_size = PROXY_RECV_SIZE
+            upstream.kernel_timestamps = self.kernel_timestamps
+            upstream.tx_impairment = self.c2s_impairment
+            upstream.on_data_received = lambda ip, port, data: self._on_upstream_data(addr, data)
+            if not upstream.connect(self.target_addr[0], self.target_addr[1]):
+                return None
+            self.upstreams[addr] = upstream
+            return upstream
+
+    def _sweep_idle(self):
+        """清理长时间无数据的客户端映射"""
+        now = time.time()
+        if now - self._last_sweep < 10:
+            return
+        self._last_sweep = now
+        # 在服务器接收线程中调用，clients字典不会被并发修改
+        active = {a for a, t in self.server.clients.items() if now - t < self.idle_timeout}
+        with self._lock:
+            for addr in [a for a in self.upstreams if a not in active]:
+                self.upstreams.pop(addr).disconnect()
+
+    def _on_client_data(self, ip: str, port: int, data: bytes):
+        """客户端 -> 上游"""
+        start = times_of(data)[1]
+        addr = (ip, port)
+        upstream = self._get_upstream(addr)
+        if upstream and upstream.send(data, limited=False):
+            self.latency.record(DIR_UPSTREAM, len(data), time.monotonic_ns() - start)
+        if self.on_traffic:
+            self.on_traffic(DIR_UPSTREAM, addr, data)
+        self._sweep_idle()
+
+    def _on_upstream_data(self, addr: Tuple[str, int], data: bytes):
+        """上游 -> 客户端"""
+        start = times_of(data)[1]
+        if self.server.send_to(addr[0], addr[1], data, limited=False):
+            self.latency.record(DIR_DOWNSTREAM, len(data), time.monotonic_ns() - start)
+        if self.on_traffic:
+            self.on_traffic(DIR_DOWNSTREAM, addr, data)
+
+    def get_clients(self):
+        """获取当前代理的客户端列表"""
+        return list(self.upstreams.keys())
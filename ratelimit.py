@@ -0,0 +1,162 @@
+"""
+令牌桶发送限速
+支持按字节/秒和消息/秒限速，可用于单个连接和全局，阻塞或非阻塞获取
+"""
+
+import threading
+import time
+from typing import Iterable, Optional
+
+
+class TokenBucket:
+    """令牌桶"""
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(burst) if burst else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        """按流逝时间补充令牌"""
+        elapsed = now - self.stamp
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.stamp = now
+
+    def wait_time(self, n: float, now: float) -> float:
+        """获取n个令牌还需等待的秒数，0表示可立即获取
+
+        超过桶容量的请求在桶满时放行（令牌变为负数，由后续请求偿还），避免永远无法发送
+        """
+        self._refill(now)
+        need = min(n, self.capacity)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def consume(self, n: float):
+        """扣除令牌"""
+        self.tokens -= n
+
+
+class RateLimiter:
+    """字节/秒 + 消息/秒 双令牌桶限速器"""
+    def __init__(self, bytes_per_sec: float = 0, msgs_per_sec: float = 0,
+                 burst_bytes: Optional[float] = None, burst_msgs: Optional[float] = None,
+                 blocking: bool = True, timeout: Optional[float] = 5.0, parent: Optional["RateLimiter"] = None):
+        self.parent = parent    # 上级限速器（如一组连接共用的限速），获取许可时一并检查
+        self.configure(bytes_per_sec, msgs_per_sec, burst_bytes, burst_msgs, blocking, timeout)
+        self.reset_stats()
+
+    def configure(self, bytes_per_sec: float = 0, msgs_per_sec: float = 0,
+                  burst_bytes: Optional[float] = None, burst_msgs: Optional[float] = None,
+                  blocking: bool = True, timeout: Optional[float] = 5.0):
+        """重新设置限速参数，0表示不限（与正在进行的获取互斥）"""
+        with _lock:
+            self.bytes_per_sec = bytes_per_sec
+            self.msgs_per_sec = msgs_per_sec
+            self.byte_bucket = TokenBucket(bytes_per_sec, burst_bytes) if bytes_per_sec > 0 else None
+            self.msg_bucket = TokenBucket(msgs_per_sec, burst_msgs) if msgs_per_sec > 0 else None
+            self.blocking = blocking
+            self.timeout = timeout
+
+    def enabled(self) -> bool:
+        """是否启用了任何限速"""
+        return self.byte_bucket is not None or self.msg_bucket is not None
+
+    def reset_stats(self):
+        """清空计数"""
+        with _lock:
+            self.stats = {
+                'allowed': 0,         # 放行的发送次数
+                'throttled': 0,       # 因限速而等待过的次数
+                'throttled_time': 0.0,  # 累计等待秒数
+                'rejected': 0,        # 非阻塞模式或超时被拒绝的次数
+            }
+
+    def _wait_time(self, nbytes: int, nmsgs: int, now: float) -> float:
+        wait = 0.0
+        if self.byte_bucket:
+            wait = self.byte_bucket.wait_time(nbytes, now)
+        if self.msg_bucket:
+            wait = max(wait, self.msg_bucket.wait_time(nmsgs, now))
+        return wait
+
+    def _consume(self, nbytes: int, nmsgs: int):
+        if self.byte_bucket:
+            self.byte_bucket.consume(nbytes)
+        if self.msg_bucket:
+            self.msg_bucket.consume(nmsgs)
+
+    def acquire(self, nbytes: int, nmsgs: int = 1) -> bool:
+        """获取发送许可"""
+        return acquire_all([self], nbytes, nmsgs)
+
+    def stats_snapshot(self) -> dict:
+        """计数的一致副本"""
+        with _lock:
+            return dict(self.stats)
+
+    def to_dict(self) -> dict:
+        return {
+            'bytes_per_sec': self.bytes_per_sec,
+            'msgs_per_sec': self.msgs_per_sec,
+            'blocking': self.blocking,
+            'timeout': self.timeout,
+            'stats': self.stats_snapshot(),
+        }
+
+
+# 所有限速器共用一把锁，保证多个桶之间的检查与扣除是原子的
+_lock = threading.Lock()
+
+# 全局限速器，对所有连接的发送生效（默认不限速）
+GLOBAL_LIMITER = RateLimiter()
+
+
+def acquire_all(limiters: Iterable[RateLimiter], nbytes: int, nmsgs: int = 1) -> bool:
+    """同时从多个限速器获取许可，任一限速器为非阻塞模式则整体非阻塞"""
+    limiters = [l for l in limiters if l.enabled()]
+    if not limiters:
+        return True
+    blocking = all(l.blocking for l in limiters)
+    timeouts = [l.timeout for l in limiters if l.timeout is not None]
+    start = time.monotonic()
+    deadline = start + min(timeouts) if timeouts else None
+    waited = 0.0
+    while True:
+        with _lock:
+            now = time.monotonic()
+            if waited:
+                waited = now - start
+            waits = [l._wait_time(nbytes, nmsgs, now) for l in limiters]
+            wait = max(waits)
+            if wait <= 0:
+                for l in limiters:
+                    l._consume(nbytes, nmsgs)
+                    l.stats['allowed'] += 1
+                    if waited:
+                        l.stats['throttled'] += 1
+                        l.stats['throttled_time'] += waited
+                return True
+            if not blocking or (deadline is not None and now + wait > deadline):
+                for l, w in zip(limiters, waits):
+                    if w > 0:
+                        l.stats['rejected'] += 1
+                    if waited:
+                        l.stats['throttled_time'] += waited
+                return False
+        time.sleep(wait)
+        waited = time.monotonic() - start
+
+
+def acquire_send(limiter: Optional[RateLimiter], nbytes: int, nmsgs: int = 1) -> bool:
+    """网络层发送前调用：同时检查连接自身的限速器（及其上级）和全局限速器
+    （代理转发和自动应答不经过这里，见 network 中各发送方法的 limited 参数）"""
+    if limiter is None and not GLOBAL_LIMITER.enabled():
+        return True
+    limiters = [GLOBAL_LIMITER]
+    while limiter is not None:
+        limiters.append(limiter)
+        limiter = limiter.parent
+    return acquire_all(limiters, nbytes, nmsgs)
@@ -0,0 +1,319 @@
+"""
+自动应答
+TCP/UDP服务器模拟设备：收到的帧按规则匹配（完整匹配、前缀、掩码、正则），
+命中后按模板生成应答（可回显请求中的字节、重新计算校验和），可延迟发送。
+应答直接在网络线程（延迟应答在共享定时器线程）中发送，不经过界面。
+
+规则按匹配方式建立哈希索引：
+  完整匹配  帧内容 -> 规则
+  前缀      每种前缀长度一张表: 帧[:长度] -> 规则
+  掩码      每种掩码一张表: 帧 & 掩码 -> 规则
+查找次数只取决于不同前缀长度/掩码的种类数，与规则数量无关；
+正则规则无法索引，按顺序逐条尝试（只尝试排在已命中规则之前的）
+"""
+
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from checksum import append_checksum, get_algorithm
+from utils import hex_to_bytes
+
+# 匹配方式
+MATCH_EXACT = "exact"
+MATCH_PREFIX = "prefix"
+MATCH_MASK = "mask"
+MATCH_REGEX = "regex"
+
+MATCH_LABELS = {
+    MATCH_EXACT: "完整匹配",
+    MATCH_PREFIX: "前缀",
+    MATCH_MASK: "掩码",
+    MATCH_REGEX: "正则",
+}
+
+# 应答模板中的字段: {in[2]} {in[2:4]} 回显请求字节，{1} {name} 正则分组，{count} 本规则的应答序号（1字节）
+_FIELD_RE = re.compile(r'\{([^{}]*)\}')
+_SLICE_RE = re.compile(r'^in\[(-?\d*)(?::(-?\d*))?\]$')
+
+
+def _parse_bytes(text: str) -> bytes:
+    """"text:" 开头按UTF-8文本，否则按十六进制"""
+    if text.startswith("text:"):
+        return text[5:].encode('utf-8')
+    return hex_to_bytes(text)
+
+
+def parse_mask(text: str) -> Tuple[bytes, bytes]:
+    """解析掩码模式，如 "CC DD ?? 0?"，返回 (值, 掩码)，"?" 表示任意半字节"""
+    digits = "".join(text.split())
+    if digits[:2].lower() == "0x":
+        digits = digits[2:]
+    if not digits or len(digits) % 2:
+        raise ValueError(f"掩码模式长度必须是偶数个十六进制字符: {text}")
+    value = bytearray()
+    mask = bytearray()
+    for i in range(0, len(digits), 2):
+        v = m = 0
+        for ch in digits[i:i + 2]:
+            v <<= 4
+            m <<= 4
+            if ch != "?":
+                try:
+                    v |= int(ch, 16)
+                except ValueError:
+                    raise ValueError(f"掩码模式含无效字符 '{ch}': {text}") from None
+                m |= 0xF
+        value.append(v)
+        mask.append(m)
+    return bytes(value), bytes(mask)
+
+
+class _Template:
+    """编译后的应答模板"""
+    def __init__(self, text: str):
+        is_text = text.startswith("text:")
+        body = text[5:] if is_text else text
+        self.parts: List = []
+        self.group_keys: List = []   # 引用的正则分组
+        pos = 0
+        for m in _FIELD_RE.finditer(body):
+            self._literal(body[pos:m.start()], is_text)
+            self.parts.append(self._field(m.group(1).strip()))
+            pos = m.end()
+        self._literal(body[pos:], is_text)
+        # 没有字段时直接返回常量
+        self.constant = self.parts[0] if len(self.parts) == 1 and isinstance(self.parts[0], bytes) else None
+        if not self.parts:
+            self.constant = b""
+
+    def _literal(self, text: str, is_text: bool):
+        if is_text:
+            if text:
+                self.parts.append(text.encode('utf-8'))
+        elif text.strip():
+            self.parts.append(hex_to_bytes(text))
+
+    def _field(self, name: str) -> Callable:
+        if name == "count":
+            return lambda frame, groups, count: bytes([count & 0xFF])
+        m = _SLICE_RE.match(name)
+        if m:
+            start = int(m.group(1)) if m.group(1) else None
+            if m.group(2) is None:
+                # {in[i]} 单个字节
+                if start is None:
+                    raise ValueError(f"应答模板字段无效: {{{name}}}")
+                return lambda frame, groups, count: frame[start:start + 1 or None]
+            end = int(m.group(2)) if m.group(2) else None
+            return lambda frame, groups, count: frame[start:end]
+        if name.isdigit() or name.isidentifier():
+            key = int(name) if name.isdigit() else name
+            self.group_keys.append(key)
+            return lambda frame, groups, count: (groups.group(key) or b"") if groups else b""
+        raise ValueError(f"应答模板字段无效: {{{name}}}")
+
+    def render(self, frame: bytes, groups: Optional[re.Match], count: int) -> bytes:
+        if self.constant is not None:
+            return self.constant
+        return b"".join(part if isinstance(part, bytes) else part(frame, groups, count) for part in self.parts)
+
+
+class Rule:
+    """一条应答规则"""
+    def __init__(self, name: str, match: str, pattern: str, reply: str, delay_ms: float = 0,
+                 checksum: str = "", enabled: bool = True):
+        if match not in MATCH_LABELS:
+            raise ValueError(f"不支持的匹配方式: {match}")
+        self.name = name or pattern
+        self.match = match
+        self.pattern = pattern          # 用户输入的原文
+        self.reply = reply              # 应答模板原文
+        self.delay_ms = delay_ms
+        self.checksum = checksum        # "算法[:起始[:结束]]"，在应答末尾追加
+        self.enabled = enabled
+        self.hits = 0
+        # 编译
+        self.regex: Optional[re.Pattern] = None
+        self.mask: Optional[bytes] = None
+        if match == MATCH_REGEX:
+            # 按 latin-1 编码，使 \xCC 之类的转义直接对应字节值
+            self.regex = re.compile(pattern.encode('latin-1'), re.DOTALL)
+            self.value = b""
+        elif match == MATCH_MASK:
+            self.value, self.mask = parse_mask(pattern)
+        else:
+            self.value = _parse_bytes(pattern)
+            if not self.value:
+                raise ValueError(f"匹配模式为空: {self.name}")
+        self.template = _Template(reply)
+        for key in self.template.group_keys:
+            if self.regex is None:
+                raise ValueError(f"只有正则规则的应答模板可以引用分组: {{{key}}}")
+            if (key not in self.regex.groupindex) if isinstance(key, str) else key > self.regex.groups:
+                raise ValueError(f"正则中没有分组: {{{key}}}")
+        self._checksum = self._parse_checksum(checksum)
+
+    @staticmethod
+    def _parse_checksum(spec: str) -> Optional[Tuple[str, int, Optional[int]]]:
+        if not spec:
+            return None
+        parts = spec.split(":")
+        get_algorithm(parts[0])
+        start = int(parts[1]) if len(parts) > 1 and parts[1] else 0
+        end = int(parts[2]) if len(parts) > 2 and parts[2] else None
+        return parts[0], start, end
+
+    def build_reply(self, frame: bytes, groups: Optional[re.Match] = None) -> bytes:
+        """按模板生成应答"""
+        self.hits += 1
+        reply = self.template.render(frame, groups, self.hits)
+        if self._checksum:
+            reply = append_checksum(reply, *self._checksum)
+        return reply
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "match": self.match, "pattern": self.pattern, "reply": self.reply,
+                "delay_ms": self.delay_ms, "checksum": self.checksum, "enabled": self.enabled}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Rule":
+        return cls(d.get("name", ""), d.get("match", MATCH_EXACT), d.get("pattern", ""), d.get("reply", ""),
+                   float(d.get("delay_ms") or 0), d.get("checksum") or "", bool(d.get("enabled", True)))
+
+    @classmethod
+    def parse(cls, line: str) -> "Rule":
+        """解析一行文字: 名称 | 匹配方式 | 模式 | 应答模板 [| 延迟ms [| 校验]]
+
+        字段之间用两侧带空格的 " | " 分隔，正则里的 "|" 不要带空格
+        """
+        fields = [f.strip() for f in line.split(" | ")]
+        if len(fields) < 4:
+            raise ValueError("格式应为: 名称 | 匹配方式 | 模式 | 应答 [| 延迟ms [| 校验]]")
+        name, match, pattern, reply = fields[:4]
+        delay = float(fields[4]) if len(fields) > 4 and fields[4] else 0
+        checksum = fields[5] if len(fields) > 5 else ""
+        return cls(name, match, pattern, reply, delay, checksum)
+
+    def to_line(self) -> str:
+        fields = [self.name, self.match, self.pattern, self.reply]
+        if self.delay_ms or self.checksum:
+            fields.append(f"{self.delay_ms:g}")
+        if self.checksum:
+            fields.append(self.checksum)
+        return " | ".join(fields)
+
+
+class _RuleIndex:
+    """规则索引（创建后不再修改，替换规则时整体换新）"""
+    def __init__(self, rules: List[Rule]):
+        self.exact: Dict[bytes, int] = {}
+        self.prefix: Dict[int, Dict[bytes, int]] = {}               # 前缀长度 -> {前缀: 规则序号}
+        self.masked: Dict[Tuple[int, int], Dict[int, int]] = {}     # (长度, 掩码) -> {帧&掩码: 规则序号}
+        self.regex: List[int] = []
+        self.rules = rules
+        for order, rule in enumerate(rules):
+            if not rule.enabled:
+                continue
+            # 同一个键只保留排在最前的规则
+            if rule.match == MATCH_EXACT:
+                self.exact.setdefault(rule.value, order)
+            elif rule.match == MATCH_PREFIX:
+                self.prefix.setdefault(len(rule.value), {}).setdefault(rule.value, order)
+            elif rule.match == MATCH_MASK:
+                mask = int.from_bytes(rule.mask, 'big')
+                value = int.from_bytes(rule.value, 'big') & mask
+                self.masked.setdefault((len(rule.mask), mask), {}).setdefault(value, order)
+            else:
+                self.regex.append(order)
+        # 前缀长度从长到短，便于按长度截断
+        self.prefix_lengths = sorted(self.prefix, reverse=True)
+
+    def lookup(self, frame: bytes) -> Tuple[Optional[Rule], Optional[re.Match]]:
+        """查找第一条（顺序最靠前的）匹配规则"""
+        best = self.exact.get(frame)
+        size = len(frame)
+        for length in self.prefix_lengths:
+            if length <= size:
+                order = self.prefix[length].get(frame[:length])
+                if order is not None and (best is None or order < best):
+                    best = order
+        if self.masked:
+            value = int.from_bytes(frame, 'big')
+            for (length, mask), table in self.masked.items():
+                if length == size:
+                    order = table.get(value & mask)
+                    if order is not None and (best is None or order < best):
+                        best = order
+        for order in self.regex:
+            if best is not None and order > best:
+                break
+            m = self.rules[order].regex.search(frame)
+            if m:
+                return self.rules[order], m
+        return (self.rules[best], None) if best is not None else (None, None)
+
+
+class RuleEngine:
+    """自动应答规则引擎，挂到 TCPServer/UDPServer 的 responder 属性上使用"""
+    def __init__(self):
+        self.rules: List[Rule] = []
+        self.replies = 0            # 已发送的应答数
+        self.unmatched = 0          # 未命中任何规则的帧数
+        # 应答回调 (规则, 应答数据)，在网络线程中调用，用于界面显示
+        self.on_reply: Optional[Callable[[Rule, bytes], None]] = None
+        self._index = _RuleIndex([])
+        self._lock = threading.Lock()
+        self._worker = None         # 延迟应答的发送线程，首次使用时创建
+
+    def set_rules(self, rules: List[Rule]):
+        """替换全部规则（重建索引）"""
+        index = _RuleIndex(list(rules))
+        with self._lock:
+            self.rules = index.rules
+            self._index = index
+            self.replies = 0
+            self.unmatched = 0
+
+    def respond(self, frame: bytes, send: Callable[[bytes], object]) -> Optional[Rule]:
+        """匹配一帧并发送应答，返回命中的规则"""
+        rule, groups = self._index.lookup(frame)
+        if rule is None:
+            self.unmatched += 1
+            return None
+        with self._lock:
+            reply = rule.build_reply(frame, groups)
+            self.replies += 1
+        if rule.delay_ms > 0:
+            # 由共享定时器计时（与损伤模拟共用，导入放在这里避免循环导入），
+            # 到期后交给本引擎的发送线程，发送阻塞不会拖住定时器
+            from impairment import SerialWorker, get_scheduler
+            with self._lock:
+                if self._worker is None:
+                    self._worker = SerialWorker("延迟应答")
+            get_scheduler().schedule_after(rule.delay_ms / 1000, self._worker.submit, self._send, rule, reply, send)
+        else:
+            self._send(rule, reply, send)
+        return rule
+
+    def _send(self, rule: Rule, reply: bytes, send: Callable[[bytes], object]):
+        send(reply)
+        if self.on_reply:
+            self.on_reply(rule, reply)
+
+    def stats(self) -> List[dict]:
+        """各规则的命中次数"""
+        return [dict(rule.to_dict(), hits=rule.hits) for rule in self.rules]
+
+    def to_list(self) -> List[dict]:
+        return [rule.to_dict() for rule in self.rules]
+
+    def from_list(self, items: List[dict]):
+        """从配置加载，跳过无效的规则"""
+        rules = []
+        for item in items:
+            try:
+                rules.append(Rule.from_dict(item))
+            except (TypeError, ValueError, re.error) as e:
+                print(f"加载应答规则失败: {e}")
+        self.set_rules(rules)
@@ -0,0 +1,54 @@
+"""
+Web版运行时选择
+threading: Flask-SocketIO 默认的线程模式（Werkzeug），每个连接/网络收发一个系统线程
+eventlet / gevent: 协程模式，启动前对 socket/threading 打补丁，网络收发线程、推送队列和
+socket.io 处理函数都运行在同一个事件循环中，阻塞调用只挂起当前协程，可承载数百个浏览器连接
+
+选择顺序: 启动参数 --runtime > 环境变量 TCPTOOL_RUNTIME > config.json 中的 "web_runtime" > threading
+必须在导入其他模块之前调用 setup()
+"""
+
+import argparse
+import json
+import os
+from typing import List, Optional
+
+RUNTIMES = ("threading", "eventlet", "gevent")
+ENV_VAR = "TCPTOOL_RUNTIME"
+CONFIG_KEY = "web_runtime"
+
+
+def choose_runtime(argv: Optional[List[str]] = None, config_file: Optional[str] = None) -> str:
+    """按启动参数、环境变量、配置文件的顺序确定运行时名称"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--runtime", choices=RUNTIMES)
+    args, _ = parser.parse_known_args(argv or [])
+    if args.runtime:
+        return args.runtime
+    name = os.environ.get(ENV_VAR, "").strip().lower()
+    if not name and config_file and os.path.exists(config_file):
+        try:
+            with open(config_file, "r", encoding="utf-8") as f:
+                name = str(json.load(f).get(CONFIG_KEY) or "").strip().lower()
+        except (OSError, ValueError) as e:
+            print(f"读取运行时配置失败: {e}")
+    if name and name not in RUNTIMES:
+        print(f"不支持的运行时: {name}，使用 threading")
+        return "threading"
+    return name or "threading"
+
+
+def setup(argv: Optional[List[str]] = None, config_file: Optional[str] = None) -> str:
+    """选择运行时并打补丁，返回 Flask-SocketIO 的 async_mode；协程库未安装时退回 threading"""
+    name = choose_runtime(argv, config_file)
+    try:
+        if name == "eventlet":
+            import eventlet
+            eventlet.monkey_patch()
+        elif name == "gevent":
+            from gevent import monkey
+            monkey.patch_all()
+    except ImportError as e:
+        print(f"加载运行时 {name} 失败: {e}，使用 threading")
+        return "threading"
+    return name
@@ -0,0 +1,457 @@
+"""
+收发记录回看缓冲
+每个会话按到达顺序保存原始收发记录（与二进制推送相同的记录格式，见 wire.py），
+记录从1开始编号，可按序号或时间范围分页查询：浏览器刷新或重连后只加载正在查看的一页。
+
+记录按块存放（每块最多 CHUNK_RECORDS 条 / CHUNK_BYTES 字节），超过条数或字节上限时整块淘汰最旧的。
+启用溢出文件时，淘汰的块写入固定大小的内存映射文件（写满后从头复用），
+内存中只保留每条记录的偏移、时间、长度和方向，百万条记录只占十几MB内存
+
+查询（search）使用的索引: 每块的时间、长度、方向列，每个端点的记录序号列表，
+以及可选的块级 3 字节 n-gram 索引（正在写入的块为集合，写满后压缩为位图），
+不可能包含查询字节串的块整块跳过，其余块在原始数据上直接查找
+"""
+
+import bisect
+import mmap
+import os
+import tempfile
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from timestamps import TimestampFormatter, times_of
+from traffic_query import TrafficQuery
+from wire import FLAG_NEGATIVE, FLAG_RELATIVE, HEADER, NO_ENDPOINT, pack_record
+
+CHUNK_RECORDS = 4096
+CHUNK_BYTES = 1024 * 1024
+
+# n-gram 位图大小（位），以及一块中不同 n-gram 超过该数时不再索引（位图已接近全满，无法跳过）
+GRAM_BITS = 65536
+GRAM_SET_LIMIT = 32768
+
+# 记录一律保存绝对时间，查询时按需要转换为相对时间
+_ABSOLUTE = TimestampFormatter()
+
+
+class _Chunk:
+    """一块连续的记录"""
+    __slots__ = ('first_seq', 'data', 'offsets', 'times', 'lengths', 'directions', 'grams', 'nbytes', 'spill_pos')
+
+    def __init__(self, first_seq: int, ngram: bool = False):
+        self.first_seq = first_seq
+        self.data: Optional[bytearray] = bytearray()  # 已写入溢出文件时为None
+        self.offsets = array('I')   # 各记录在块内的起始偏移
+        self.times = array('q')     # 各记录的接收时间（纳秒）
+        self.lengths = array('I')   # 各记录的数据长度
+        self.directions = bytearray()  # 各记录的方向
+        self.grams = set() if ngram else None  # n-gram 索引: 写入中为集合，写满后为位图，None 为未索引
+        self.nbytes = 0
+        self.spill_pos = -1         # 在溢出文件中的位置
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def record_span(self, index: int) -> Tuple[int, int]:
+        start = self.offsets[index]
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.nbytes
+        return start, end
+
+    def add_grams(self, data: bytes):
+        """把数据中的 3 字节组合加入索引"""
+        if isinstance(self.grams, set):
+            self.grams.update(zip(data, data[1:], data[2:]))
+            if len(self.grams) > GRAM_SET_LIMIT:
+                self.grams = None
+
+    def seal(self):
+        """块写满后把 n-gram 集合压缩为位图"""
+        if isinstance(self.grams, set):
+            bitmap = bytearray(GRAM_BITS // 8)
+            for gram in self.grams:
+                bit = _gram_bit(gram)
+                bitmap[bit >> 3] |= 1 << (bit & 7)
+            self.grams = bitmap
+
+    def may_contain(self, grams: list) -> bool:
+        """块中是否可能有包含这些 n-gram 的记录（位图有误判，但不会漏判）"""
+        if self.grams is None or not grams:
+            return True
+        if isinstance(self.grams, set):
+            return all(gram in self.grams for gram in grams)
+        return all(self.grams[bit >> 3] & (1 << (bit & 7)) for bit in map(_gram_bit, grams))
+
+
+def _gram_bit(gram: Tuple[int, int, int]) -> int:
+    return (((gram[0] << 8) | gram[1]) ^ (gram[2] << 5)) & (GRAM_BITS - 1)
+
+
+class SpillFile:
+    """溢出文件: 固定大小的内存映射文件，按块顺序环形写入"""
+    def __init__(self, size: int, directory: Optional[str] = None):
+        fd, self.path = tempfile.mkstemp(prefix='tcptool-scrollback-', suffix='.bin', dir=directory)
+        try:
+            os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.pos = 0
+
+    def write(self, data: bytes, spilled: deque) -> int:
+        """写入一块，返回写入位置；先从 spilled（旧到新）中淘汰将被覆盖的块"""
+        n = len(data)
+        if self.pos + n > self.size:
+            # 尾部放不下，从头写；尾部剩余的块是最旧的，一并淘汰
+            tail = self.pos
+            self.pos = 0
+            while spilled and spilled[0].spill_pos >= tail:
+                spilled.popleft()
+        while spilled and self.pos <= spilled[0].spill_pos < self.pos + n:
+            spilled.popleft()
+        pos = self.pos
+        self._mm[pos:pos + n] = data
+        self.pos += n
+        return pos
+
+    def read(self, pos: int, length: int) -> bytes:
+        return self._mm[pos:pos + length]
+
+    def close(self):
+        try:
+            self._mm.close()
+            os.remove(self.path)
+        except OSError as e:
+            print(f"删除回看溢出文件失败: {e}")
+
+
+class Scrollback:
+    """一个会话的收发记录（线程安全）"""
+    def __init__(self, max_records: int = 1_000_000, max_bytes: int = 64 * 1024 * 1024, spill_bytes: int = 0,
+                 ngram: bool = False):
+        self.max_records = max_records  # 内存中保留的记录数上限
+        self.max_bytes = max_bytes      # 内存中保留的字节数上限
+        self.ngram = ngram              # 是否建立 n-gram 索引（加快字节模式查询，每条记录多几微秒）
+        self._chunks: deque = deque()   # 内存中的块（旧到新）
+        self._spilled: deque = deque()  # 溢出文件中的块（旧到新）
+        self._spill: Optional[SpillFile] = None
+        if spill_bytes > 0:
+            try:
+                self._spill = SpillFile(spill_bytes)
+            except OSError as e:
+                print(f"创建回看溢出文件失败: {e}")
+        self._records = 0
+        self._bytes = 0
+        self.next_seq = 1
+        self.dropped = 0                # 已淘汰（不可再查询）的记录数
+        self._by_endpoint: Dict[int, array] = {}  # 端点编号 -> 记录序号列表
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Scrollback":
+        """按配置创建: {"max_records", "max_mb", "spill_mb", "ngram"}，参数无效时抛出 ValueError"""
+        return cls(int(d.get("max_records") or 1_000_000), int(float(d.get("max_mb") or 64) * 1024 * 1024),
+                   int(float(d.get("spill_mb") or 0) * 1024 * 1024), bool(d.get("ngram", False)))
+
+    def append(self, data: bytes, direction: int, endpoint_id: int = NO_ENDPOINT, note: str = "") -> int:
+        """追加一条记录，返回其序号"""
+        record = pack_record(data, direction, endpoint_id, note, _ABSOLUTE)
+        wall_ns = times_of(data)[0]
+        with self._lock:
+            chunk = self._chunks[-1] if self._chunks else None
+            if chunk is None or len(chunk) >= CHUNK_RECORDS or chunk.nbytes >= CHUNK_BYTES:
+                if chunk is not None:
+                    chunk.seal()
+                chunk = _Chunk(self.next_seq, self.ngram)
+                self._chunks.append(chunk)
+            chunk.offsets.append(chunk.nbytes)
+            chunk.times.append(wall_ns)
+            chunk.lengths.append(len(data))
+            chunk.directions.append(direction)
+            chunk.add_grams(data)
+            chunk.data += record
+            chunk.nbytes += len(record)
+            self._records += 1
+            self._bytes += len(record)
+            seq = self.next_seq
+            self.next_seq += 1
+            if endpoint_id != NO_ENDPOINT:
+                seqs = self._by_endpoint.get(endpoint_id)
+                if seqs is None:
+                    seqs = self._by_endpoint[endpoint_id] = array('Q')
+                seqs.append(seq)
+            dropped = self.dropped
+            while len(self._chunks) > 1 and (self._records > self.max_records or self._bytes > self.max_bytes):
+                self._evict()
+            if self.dropped != dropped:
+                self._trim_endpoints()
+        return seq
+
+    def _evict(self):
+        """淘汰内存中最旧的块，有溢出文件时写入文件（调用方已持有锁）"""
+        chunk = self._chunks.popleft()
+        self._records -= len(chunk)
+        self._bytes -= chunk.nbytes
+        if self._spill and chunk.nbytes <= self._spill.size:
+            before = sum(len(c) for c in self._spilled)
+            chunk.spill_pos = self._spill.write(bytes(chunk.data), self._spilled)
+            chunk.data = None
+            self._spilled.append(chunk)
+            self.dropped += before - sum(len(c) for c in self._spilled) + len(chunk)
+        else:
+            self.dropped += len(chunk)
+
+    def _trim_endpoints(self):
+        """从端点索引中去掉已淘汰的记录（调用方已持有锁）"""
+        chunks = self._spilled or self._chunks
+        first = chunks[0].first_seq if chunks else self.next_seq
+        for endpoint_id in list(self._by_endpoint):
+            seqs = self._by_endpoint[endpoint_id]
+            n = bisect.bisect_left(seqs, first)
+            if n >= len(seqs):
+                del self._by_endpoint[endpoint_id]
+            elif n:
+                del seqs[:n]
+
+    def endpoint_ids(self) -> List[int]:
+        """仍有记录引用的端点编号"""
+        with self._lock:
+            return list(self._by_endpoint)
+
+    def close(self):
+        with self._lock:
+            self._chunks.clear()
+            self._spilled.clear()
+            self._by_endpoint.clear()
+            if self._spill:
+                self._spill.close()
+                self._spill = None
+
+    # ===== 查询 =====
+
+    def bounds(self) -> dict:
+        """可查询的序号范围 [first, next) 和时间范围"""
+        with self._lock:
+            chunks = self._all_chunks()
+            first = chunks[0].first_seq if chunks else self.next_seq
+            return {
+                "first": first,
+                "next": self.next_seq,
+                "first_ns": chunks[0].times[0] if chunks else None,
+                "last_ns": chunks[-1].times[-1] if chunks else None,
+                "memory_records": self._records,
+                "memory_bytes": self._bytes,
+                "spilled_records": sum(len(c) for c in self._spilled),
+                "dropped": self.dropped,
+            }
+
+    def seq_at_time(self, wall_ns: int) -> int:
+        """接收时间不早于 wall_ns 的第一条记录的序号（都更早时返回 next_seq）
+
+        各网络线程的记录按到达顺序编号，时间基本递增，按二分查找定位
+        """
+        with self._lock:
+            return self._seq_at_time(self._all_chunks(), wall_ns)
+
+    def _seq_at_time(self, chunks: List[_Chunk], wall_ns: int) -> int:
+        index = bisect.bisect_right([c.times[0] for c in chunks], wall_ns) - 1
+        if index < 0:
+            return chunks[0].first_seq if chunks else self.next_seq
+        for chunk in chunks[index:]:
+            i = bisect.bisect_left(chunk.times, wall_ns)
+            if i < len(chunk):
+                return chunk.first_seq + i
+        return self.next_seq
+
+    def page(self, after: Optional[int] = None, before: Optional[int] = None, since_ns: Optional[int] = None,
+             until_ns: Optional[int] = None, limit: int = 500,
+             clock: Optional[TimestampFormatter] = None) -> Tuple[int, int, bytes]:
+        """查询一页记录，返回 (第一条序号, 条数, 打包的记录)
+
+        after: 序号大于 after 的最早 limit 条；before: 序号小于 before 的最近 limit 条；
+        since_ns/until_ns: 时间范围（纳秒），只给 since_ns 时从该时间起向后；都不给时返回最新一页。
+        clock 为相对时间模式时，时间转换为相对会话起点的时长
+        """
+        limit = max(1, limit)
+        if since_ns is not None and after is None and before is None:
+            after = self.seq_at_time(since_ns) - 1
+        with self._lock:
+            chunks = self._all_chunks()
+            first_available = chunks[0].first_seq if chunks else self.next_seq
+            if after is not None:
+                start = max(after + 1, first_available)
+            else:
+                end = min(before if before is not None else self.next_seq, self.next_seq)
+                start = max(end - limit, first_available)
+                limit = max(0, end - start)
+            parts = []
+            for seq, wall_ns, record in self._iter_from(chunks, start, limit):
+                if until_ns is not None and wall_ns > until_ns:
+                    break
+                parts.append(record)
+        if clock is not None and clock.relative:
+            parts = [_to_relative(record, clock) for record in parts]
+        return start, len(parts), b"".join(parts)
+
+    def search(self, query: TrafficQuery, after: Optional[int] = None, limit: int = 500,
+               clock: Optional[TimestampFormatter] = None) -> Tuple[List[int], bytes, int, bool]:
+        """按条件查找序号大于 after 的最早 limit 条记录，返回 (序号列表, 打包的记录, 已查到的序号, 是否查完)
+
+        继续查找下一批时把返回的"已查到的序号"作为 after 传入
+        """
+        limit = max(1, limit)
+        grams = list(zip(query.pattern, query.pattern[1:], query.pattern[2:]))
+        with self._lock:
+            chunks = self._all_chunks()
+            start = chunks[0].first_seq if chunks else self.next_seq
+            if after is not None:
+                start = max(start, after + 1)
+            if query.since_ns is not None:
+                start = max(start, self._seq_at_time(chunks, query.since_ns))
+            end = self.next_seq
+            if query.until_ns is not None:
+                end = min(end, self._seq_at_time(chunks, query.until_ns + 1))
+            hits: List[Tuple[int, bytes]] = []
+            scanned = end - 1
+            if query.endpoint_id is not None:
+                matches = self._search_endpoint(chunks, query, start, end)
+            else:
+                matches = self._search_chunks(chunks, query, grams, start, end)
+            for seq, record in matches:
+                hits.append((seq, record))
+                if len(hits) >= limit:
+                    scanned = seq
+                    break
+        records = [record for _, record in hits]
+        if clock is not None and clock.relative:
+            records = [_to_relative(record, clock) for record in records]
+        return [seq for seq, _ in hits], b"".join(records), max(scanned, start - 1), scanned >= end - 1
+
+    def _buffer(self, chunk: _Chunk):
+        """块数据所在的缓冲区及块在其中的起始位置"""
+        if chunk.data is not None:
+            return chunk.data, 0
+        return self._spill._mm, chunk.spill_pos
+
+    def _search_chunks(self, chunks: List[_Chunk], query: TrafficQuery, grams: list,
+                       start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+        """逐块查找：按字节模式或方向在块内跳跃到候选记录，再检查其余条件（调用方已持有锁）"""
+        index = max(0, bisect.bisect_right([c.first_seq for c in chunks], start) - 1)
+        for chunk in chunks[index:]:
+            if chunk.first_seq >= end:
+                return
+            lo = max(start - chunk.first_seq, 0)
+            hi = min(end - chunk.first_seq, len(chunk))
+            if lo >= hi or (query.pattern and not chunk.may_contain(grams)):
+                continue
+            buf, base = self._buffer(chunk)
+            if query.pattern:
+                candidates = self._pattern_candidates(chunk, buf, base, query.pattern, lo, hi)
+            elif query.direction is not None:
+                candidates = _byte_positions(chunk.directions, query.direction, lo, hi)
+            else:
+                candidates = range(lo, hi)
+            for i in candidates:
+                if not query.match_meta(chunk.directions[i], chunk.lengths[i]):
+                    continue
+                if query.since_ns is not None and chunk.times[i] < query.since_ns:
+                    continue
+                if query.until_ns is not None and chunk.times[i] > query.until_ns:
+                    continue
+                record_start, record_end = chunk.record_span(i)
+                yield chunk.first_seq + i, bytes(buf[base + record_start:base + record_end])
+
+    def _pattern_candidates(self, chunk: _Chunk, buf, base: int, pattern: bytes, lo: int, hi: int) -> Iterator[int]:
+        """在块的原始数据上直接查找字节串，返回数据部分包含它的记录下标"""
+        pos = base + chunk.offsets[lo]
+        stop = base + chunk.record_span(hi - 1)[1]
+        while True:
+            pos = buf.find(pattern, pos, stop)
+            if pos < 0:
+                return
+            i = bisect.bisect_right(chunk.offsets, pos - base, lo, hi) - 1
+            record_start, record_end = chunk.record_span(i)
+            data_start = base + record_start + HEADER.size + HEADER.unpack_from(buf, base + record_start)[5]
+            if pos < data_start:
+                pos = data_start                # 出现在记录头或备注中，从数据部分重新找
+            elif pos + len(pattern) > base + record_end:
+                pos += 1                        # 跨到了下一条记录
+            else:
+                yield i
+                pos = base + record_end
+
+    def _search_endpoint(self, chunks: List[_Chunk], query: TrafficQuery,
+                         start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+        """按端点的记录序号列表逐条检查（调用方已持有锁）"""
+        seqs = self._by_endpoint.get(query.endpoint_id)
+        if not seqs:
+            return
+        firsts = [c.first_seq for c in chunks]
+        for k in range(bisect.bisect_left(seqs, start), len(seqs)):
+            seq = seqs[k]
+            if seq >= end:
+                return
+            chunk = chunks[bisect.bisect_right(firsts, seq) - 1]
+            i = seq - chunk.first_seq
+            if not query.match_meta(chunk.directions[i], chunk.lengths[i]):
+                continue
+            if query.since_ns is not None and chunk.times[i] < query.since_ns:
+                continue
+            if query.until_ns is not None and chunk.times[i] > query.until_ns:
+                continue
+            buf, base = self._buffer(chunk)
+            record_start, record_end = chunk.record_span(i)
+            if query.pattern:
+                data_start = base + record_start + HEADER.size + HEADER.unpack_from(buf, base + record_start)[5]
+                if buf.find(query.pattern, data_start, base + record_end) < 0:
+                    continue
+            yield seq, bytes(buf[base + record_start:base + record_end])
+
+    def _all_chunks(self) -> List[_Chunk]:
+        return list(self._spilled) + list(self._chunks)
+
+    def _iter_from(self, chunks: List[_Chunk], seq: int, count: int) -> Iterator[Tuple[int, int, bytes]]:
+        """从 seq 开始依次取出最多 count 条 (序号, 时间, 记录)（调用方已持有锁）"""
+        index = bisect.bisect_right([c.first_seq for c in chunks], seq) - 1
+        if index < 0:
+            return
+        for chunk in chunks[index:]:
+            i = seq - chunk.first_seq
+            while i < len(chunk) and count > 0:
+                start, end = chunk.record_span(i)
+                if chunk.data is not None:
+                    record = bytes(chunk.data[start:end])
+                else:
+                    record = self._spill.read(chunk.spill_pos + start, end - start)
+                yield chunk.first_seq + i, chunk.times[i], record
+                i += 1
+                seq += 1
+                count -= 1
+            if count <= 0:
+                return
+
+
+def _byte_positions(values: bytearray, value: int, lo: int, hi: int) -> Iterator[int]:
+    """values[lo:hi] 中等于 value 的下标"""
+    target = bytes((value,))
+    i = values.find(target, lo, hi)
+    while i >= 0:
+        yield i
+        i = values.find(target, i + 1, hi)
+
+
+def _to_relative(record: bytes, clock: TimestampFormatter) -> bytes:
+    """把记录头中的绝对时间改为相对会话起点的时长"""
+    seconds, nanos, direction, flags, endpoint_id, note_len, data_len = HEADER.unpack_from(record)
+    start_wall_ns = time.time_ns() - (time.monotonic_ns() - clock.session_start_ns)
+    ns = seconds * 1_000_000_000 + nanos - start_wall_ns
+    flags |= FLAG_RELATIVE
+    if ns < 0:
+        ns = -ns
+        flags |= FLAG_NEGATIVE
+    seconds, nanos = divmod(ns, 1_000_000_000)
+    return HEADER.pack(seconds & 0xFFFFFFFF, nanos, direction, flags, endpoint_id, note_len, data_len) + \
+        record[HEADER.size:]
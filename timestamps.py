@@ -0,0 +1,166 @@
+"""
+时间戳服务
+在网络层接收时记录一次 time.time_ns()/time.monotonic_ns() 并随数据传递，
+显示时才格式化：每秒只生成一次 "时:分:秒" 前缀，支持毫秒/微秒/纳秒精度和相对会话开始的时间。
+可选开启内核接收时间戳（SO_TIMESTAMPNS / SO_TIMESTAMPING），通过 recvmsg 取得数据到达内核的时间
+"""
+
+import socket
+import struct
+import sys
+import time
+from typing import Optional, Tuple
+
+# 精度 -> (小数位数, 纳秒除数)
+PRECISIONS = {
+    "ms": (3, 1_000_000),
+    "us": (6, 1_000),
+    "ns": (9, 1),
+}
+
+PRECISION_LABELS = {
+    "ms": "毫秒",
+    "us": "微秒",
+    "ns": "纳秒",
+}
+
+
+class Payload(bytes):
+    """带接收时间戳的数据，可直接当作 bytes 使用
+
+    有内核时间戳时 wall_ns 即为内核接收时间，mono_ns 按同样的差值回推，
+    user_ns 保留Python层拿到数据时的墙上时间
+    """
+    wall_ns: int   # 墙上时间
+    mono_ns: int   # 单调时钟，用于计算间隔
+    user_ns: int   # Python层接收时的墙上时间 time.time_ns()
+    kernel: bool   # wall_ns 是否来自内核
+
+
+def stamp(data: bytes, kernel_ns: Optional[int] = None) -> Payload:
+    """为数据附加接收时间戳（已带时间戳的数据原样返回）"""
+    if isinstance(data, Payload):
+        return data
+    payload = Payload(data)
+    payload.user_ns = time.time_ns()
+    payload.mono_ns = time.monotonic_ns()
+    if kernel_ns:
+        payload.wall_ns = kernel_ns
+        # 内核时间早于用户态时间，差值即内核到Python的排队/调度耗时
+        payload.mono_ns -= max(payload.user_ns - kernel_ns, 0)
+        payload.kernel = True
+    else:
+        payload.wall_ns = payload.user_ns
+        payload.kernel = False
+    return payload
+
+
+def times_of(data: bytes) -> Tuple[int, int]:
+    """取数据的 (墙上时间, 单调时间)，没有时间戳的数据返回当前时间"""
+    if isinstance(data, Payload):
+        return data.wall_ns, data.mono_ns
+    return time.time_ns(), time.monotonic_ns()
+
+
+# ===== 内核接收时间戳（仅Linux） =====
+# Python 的 socket 模块没有导出这些常量，取自 asm-generic/socket.h
+SO_TIMESTAMPNS = 35
+SO_TIMESTAMPING = 37
+# SOF_TIMESTAMPING_RX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE
+_TIMESTAMPING_FLAGS = (1 << 3) | (1 << 4)
+_TIMESPEC = struct.Struct('@ll')
+# 控制消息缓冲区需能容纳 SCM_TIMESTAMPING 的3个timespec
+_ANCBUF_SIZE = socket.CMSG_SPACE(_TIMESPEC.size * 3) if hasattr(socket, 'CMSG_SPACE') else 0
+
+
+def kernel_timestamps_supported() -> bool:
+    """当前平台是否支持内核接收时间戳"""
+    return sys.platform.startswith('linux') and hasattr(socket.socket, 'recvmsg')
+
+
+def enable_kernel_timestamps(sock: socket.socket) -> Optional[str]:
+    """在socket上开启内核接收时间戳，返回使用的选项名，不支持时返回None"""
+    if not kernel_timestamps_supported():
+        return None
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        return "SO_TIMESTAMPNS"
+    except OSError:
+        pass
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING, _TIMESTAMPING_FLAGS)
+        return "SO_TIMESTAMPING"
+    except OSError:
+        return None
+
+
+def _parse_kernel_time(ancdata) -> Optional[int]:
+    """从控制消息中取出内核接收时间（纳秒）"""
+    for level, kind, payload in ancdata:
+        if level != socket.SOL_SOCKET or len(payload) < _TIMESPEC.size:
+            continue
+        if kind in (SO_TIMESTAMPNS, SO_TIMESTAMPING):
+            # SCM_TIMESTAMPING 的第一个timespec为软件时间戳
+            sec, nsec = _TIMESPEC.unpack_from(payload)
+            if sec or nsec:
+                return sec * 1_000_000_000 + nsec
+    return None
+
+
+def recv_timestamped(sock: socket.socket, size: int) -> Tuple[bytes, Optional[int], Optional[Tuple[str, int]]]:
+    """用 recvmsg 接收数据，返回 (数据, 内核接收时间ns或None, 对端地址)"""
+    data, ancdata, _, addr = sock.recvmsg(size, _ANCBUF_SIZE)
+    return data, _parse_kernel_time(ancdata), addr
+
+
+class TimestampFormatter:
+    """时间戳格式化器"""
+    def __init__(self, precision: str = "ms", relative: bool = False):
+        self.precision = "ms"
+        self.relative = False
+        self.version = 0  # 每次修改设置后递增，供渲染缓存判断是否失效
+        self._cached = (-1, "")  # (秒, 前缀)，整体替换以免多线程读到不一致的一对
+        self.session_start_ns = time.monotonic_ns()
+        self.configure(precision, relative)
+
+    def configure(self, precision: Optional[str] = None, relative: Optional[bool] = None):
+        """修改精度或相对时间模式"""
+        if precision is not None:
+            if precision not in PRECISIONS:
+                raise ValueError(f"不支持的时间戳精度: {precision}")
+            self.precision = precision
+        if relative is not None:
+            self.relative = bool(relative)
+        self.version += 1
+
+    def reset_session(self):
+        """把相对时间的起点设为现在"""
+        self.session_start_ns = time.monotonic_ns()
+        self.version += 1
+
+    def format(self, wall_ns: int, mono_ns: Optional[int] = None) -> str:
+        """格式化时间戳"""
+        digits, divisor = PRECISIONS[self.precision]
+        if self.relative and mono_ns is not None:
+            delta = mono_ns - self.session_start_ns
+            sign = "-" if delta < 0 else "+"
+            seconds, frac = divmod(abs(delta), 1_000_000_000)
+            return f"{sign}{seconds}.{frac // divisor:0{digits}d}"
+        seconds, frac = divmod(wall_ns, 1_000_000_000)
+        cached_second, prefix = self._cached
+        if seconds != cached_second:
+            # 同一秒内的时间戳共用前缀
+            prefix = time.strftime('%H:%M:%S', time.localtime(seconds))
+            self._cached = (seconds, prefix)
+        return f"{prefix}.{frac // divisor:0{digits}d}"
+
+    def format_data(self, data: bytes) -> str:
+        """格式化数据自带的接收时间戳"""
+        return self.format(*times_of(data))
+
+    def to_dict(self) -> dict:
+        return {'precision': self.precision, 'relative': self.relative}
+
+
+# 全局共享的格式化器，界面上的时间戳设置作用于它
+default_formatter = TimestampFormatter()
@@ -0,0 +1,83 @@
+"""
+收发记录查询条件
+按端点、方向、时间范围、长度和字节模式（十六进制或文字）筛选回看缓冲中的记录，
+查询本身由 Scrollback.search 借助索引完成（见 scrollback.py）
+"""
+
+from typing import Optional
+
+from utils import hex_to_bytes
+from wire import DIR_CLIENT_TO_SERVER, DIR_RECEIVED, DIR_SENT, DIR_SERVER_TO_CLIENT, EndpointTable
+
+# 方向名称（与页面的记录样式名一致）
+DIRECTION_NAMES = {
+    "received": DIR_RECEIVED,
+    "sent": DIR_SENT,
+    "c2s": DIR_CLIENT_TO_SERVER,
+    "s2c": DIR_SERVER_TO_CLIENT,
+}
+
+# 端点地址不存在时使用的编号，不会匹配任何记录
+UNKNOWN_ENDPOINT = -1
+
+
+def parse_pattern(text: str) -> bytes:
+    """解析字节模式: "hex:AA 55" 按十六进制，"text:ALARM" 或不带前缀按 UTF-8 文字"""
+    kind, sep, body = text.partition(":")
+    if sep and kind.strip().lower() == "hex":
+        return hex_to_bytes(body.strip())
+    if sep and kind.strip().lower() == "text":
+        return body.encode('utf-8')
+    return text.encode('utf-8')
+
+
+class TrafficQuery:
+    """一次查询的筛选条件，未指定的条件不参与筛选"""
+    __slots__ = ('endpoint_id', 'direction', 'since_ns', 'until_ns', 'min_len', 'max_len', 'pattern')
+
+    def __init__(self, endpoint_id: Optional[int] = None, direction: Optional[int] = None,
+                 since_ns: Optional[int] = None, until_ns: Optional[int] = None,
+                 min_len: Optional[int] = None, max_len: Optional[int] = None, pattern: bytes = b""):
+        self.endpoint_id = endpoint_id  # 端点编号（EndpointTable），None 为不限
+        self.direction = direction      # wire.DIR_*
+        self.since_ns = since_ns        # 接收时间范围（纳秒，含两端）
+        self.until_ns = until_ns
+        self.min_len = min_len          # 数据长度范围（字节，含两端）
+        self.max_len = max_len
+        self.pattern = pattern          # 数据中须包含的字节串
+
+    @classmethod
+    def from_dict(cls, d: dict, endpoints: Optional[EndpointTable] = None) -> "TrafficQuery":
+        """由页面/HTTP 参数创建: {"endpoint": "ip:port", "direction": "sent", "since"/"until": 毫秒时间戳,
+        "min_len", "max_len", "pattern": "hex:AA 55"}，参数无效时抛出 ValueError"""
+        def opt(name):
+            value = d.get(name)
+            return None if value in (None, '') else value
+
+        endpoint_id = None
+        endpoint = opt("endpoint")
+        if endpoint is not None:
+            found = endpoints.get(str(endpoint).strip()) if endpoints else None
+            endpoint_id = UNKNOWN_ENDPOINT if found is None else found
+        direction = opt("direction")
+        if direction is not None:
+            if str(direction) not in DIRECTION_NAMES:
+                raise ValueError(f"未知的方向: {direction}")
+            direction = DIRECTION_NAMES[str(direction)]
+        since, until = opt("since"), opt("until")
+        min_len, max_len = opt("min_len"), opt("max_len")
+        pattern = opt("pattern")
+        return cls(endpoint_id, direction,
+                   None if since is None else int(float(since) * 1_000_000),
+                   None if until is None else int(float(until) * 1_000_000),
+                   None if min_len is None else int(min_len),
+                   None if max_len is None else int(max_len),
+                   parse_pattern(str(pattern)) if pattern is not None else b"")
+
+    def match_meta(self, direction: int, length: int) -> bool:
+        """方向和长度条件"""
+        if self.direction is not None and direction != self.direction:
+            return False
+        if self.min_len is not None and length < self.min_len:
+            return False
+        return self.max_len is None or length <= self.max_len
@@ -0,0 +1,242 @@
+"""
+触发匹配
+把多个十六进制/文本模式编译为 Aho-Corasick 自动机，对接收数据逐块增量扫描，
+每个数据流（连接/对端）单独保存自动机状态，跨 recv 边界的模式也能匹配。
+扫描时间只与输入长度和匹配次数有关，与模式数量无关
+"""
+
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from utils import hex_to_bytes
+
+# 模式开头字节种类不超过该值时，根状态下用正则跳过无关字节
+SKIP_MAX_FIRST_BYTES = 32
+
+
+class TriggerPattern:
+    """一个触发模式"""
+    def __init__(self, name: str, pattern: str, is_hex: bool = True):
+        self.name = name or pattern
+        self.pattern = pattern      # 用户输入的原文
+        self.is_hex = is_hex
+        # 十六进制解析失败时抛出 HexParseError（ValueError 子类）
+        self.data = hex_to_bytes(pattern) if is_hex else pattern.encode('utf-8')
+        if not self.data:
+            raise ValueError(f"触发模式为空: {name}")
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "pattern": self.pattern, "hex": self.is_hex}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "TriggerPattern":
+        return cls(d.get("name", ""), d.get("pattern", ""), bool(d.get("hex", True)))
+
+    @classmethod
+    def parse(cls, line: str) -> "TriggerPattern":
+        """解析一行文字: "[名称=]hex:AA 55" 或 "[名称=]text:ALARM"，不带前缀按十六进制处理"""
+        # 以 hex:/text: 开头的行没有名称，模式本身可以包含 "="
+        if line.lstrip().lower().startswith(("hex:", "text:")):
+            name, spec = "", line
+        else:
+            name, sep, spec = line.partition("=")
+            if not sep:
+                name, spec = "", line
+        spec = spec.strip()
+        kind, sep, body = spec.partition(":")
+        if sep and kind.lower() in ("hex", "text"):
+            return cls(name.strip(), body.strip() if kind.lower() == "hex" else body, kind.lower() == "hex")
+        return cls(name.strip(), spec, True)
+
+    def to_line(self) -> str:
+        kind = "hex" if self.is_hex else "text"
+        # 未命名（名称即模式）时不写名称，否则模式中的 "=" 会在重新解析时被当作名称分隔符
+        if self.name == self.pattern:
+            return f"{kind}:{self.pattern}"
+        return f"{self.name}={kind}:{self.pattern}"
+
+
+class AhoCorasick:
+    """字节串多模式匹配自动机"""
+    def __init__(self, patterns: List[bytes]):
+        self.patterns = patterns
+        goto: List[Dict[int, int]] = [{}]
+        outputs: List[Tuple[int, ...]] = [()]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for b in pattern:
+                nxt = goto[state].get(b)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][b] = nxt
+                    goto.append({})
+                    outputs.append(())
+                state = nxt
+            outputs[state] += (index,)
+        # 广度优先计算失败指针，并把失败链上的输出合并到本状态
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())  # 第一层的失败指针都指向根
+        while queue:
+            state = queue.popleft()
+            for b, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and b not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(b, 0)
+                if outputs[fail[nxt]]:
+                    outputs[nxt] += outputs[fail[nxt]]
+        self.goto = goto
+        self.fail = fail
+        self.outputs = outputs
+        # 模式开头字节较少时，处于根状态时用正则（C实现）跳过不可能作为模式开头的字节；
+        # 开头字节很多时几乎每个字节都要进入自动机，逐字节循环更快
+        firsts = bytes(sorted(goto[0]))
+        self._skip = re.compile(b'[' + re.escape(firsts) + b']') if len(firsts) <= SKIP_MAX_FIRST_BYTES else None
+
+    def scan(self, data: bytes, state: int = 0) -> Tuple[int, List[Tuple[int, int]]]:
+        """从给定状态扫描数据，返回 (结束状态, [(模式下标, 匹配结束位置)])
+
+        匹配结束位置是数据内的下标（不含），匹配可能从之前的数据块开始
+        """
+        if self._skip is None:
+            return self._scan_bytes(data, state)
+        goto, fail, outputs, skip = self.goto, self.fail, self.outputs, self._skip
+        matches = []
+        pos, n = 0, len(data)
+        while pos < n:
+            if not state:
+                m = skip.search(data, pos)
+                if m is None:
+                    break
+                pos = m.start()
+            b = data[pos]
+            pos += 1
+            # 失败跳转次数不超过之前前进的次数，总时间仍是线性的
+            while True:
+                nxt = goto[state].get(b)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            if outputs[state]:
+                matches.extend((index, pos) for index in outputs[state])
+        return state, matches
+
+    def _scan_bytes(self, data: bytes, state: int) -> Tuple[int, List[Tuple[int, int]]]:
+        """逐字节扫描（不跳过根状态）"""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        matches = []
+        for pos, b in enumerate(data, 1):
+            while True:
+                nxt = goto[state].get(b)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            if outputs[state]:
+                matches.extend((index, pos) for index in outputs[state])
+        return state, matches
+
+
+class TriggerMatch:
+    """一次匹配"""
+    __slots__ = ('name', 'pattern', 'offset', 'count')
+
+    def __init__(self, name: str, pattern: bytes, offset: int, count: int):
+        self.name = name
+        self.pattern = pattern
+        self.offset = offset    # 匹配起点在该数据流中的字节偏移
+        self.count = count      # 该模式累计匹配次数
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "pattern": self.pattern.hex(' ').upper(),
+                "offset": self.offset, "count": self.count}
+
+
+class TriggerSet:
+    """一组触发模式 + 各数据流的扫描状态和计数（线程安全）"""
+    def __init__(self, max_streams: int = 1024):
+        self.max_streams = max_streams
+        self.patterns: List[TriggerPattern] = []
+        self.counts: List[int] = []
+        self.total = 0
+        self._automaton: Optional[AhoCorasick] = None
+        # 数据流 -> (自动机状态, 已扫描字节数)，最久未用的数据流先淘汰
+        self._streams: "OrderedDict[Hashable, Tuple[int, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_patterns(self, patterns: List[TriggerPattern]):
+        """替换全部模式（重新编译自动机，清空扫描状态和计数）"""
+        automaton = AhoCorasick([p.data for p in patterns]) if patterns else None
+        with self._lock:
+            self.patterns = list(patterns)
+            self.counts = [0] * len(patterns)
+            self.total = 0
+            self._automaton = automaton
+            self._streams.clear()
+
+    def scan(self, stream: Hashable, data: bytes) -> List[TriggerMatch]:
+        """扫描一个数据流新收到的数据，返回本块内完成的匹配"""
+        automaton = self._automaton
+        if automaton is None or not data:
+            return []
+        with self._lock:
+            if automaton is not self._automaton:
+                return []
+            state, scanned = self._streams.pop(stream, (0, 0))
+            state, found = automaton.scan(data, state)
+            self._streams[stream] = (state, scanned + len(data))
+            if len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+            matches = []
+            for index, end in found:
+                self.counts[index] += 1
+                pattern = self.patterns[index]
+                matches.append(TriggerMatch(pattern.name, pattern.data, scanned + end - len(pattern.data),
+                                            self.counts[index]))
+            self.total += len(found)
+        return matches
+
+    def reset(self, stream: Hashable):
+        """数据流结束（断开连接）时丢弃其扫描状态"""
+        with self._lock:
+            self._streams.pop(stream, None)
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = [0] * len(self.patterns)
+            self.total = 0
+
+    def stats(self) -> List[dict]:
+        """各模式的累计匹配次数"""
+        with self._lock:
+            return [dict(p.to_dict(), count=c) for p, c in zip(self.patterns, self.counts)]
+
+    def to_list(self) -> List[dict]:
+        return [p.to_dict() for p in self.patterns]
+
+    def from_list(self, items: List[dict]):
+        """从配置加载，跳过无效的模式"""
+        patterns = []
+        for item in items:
+            try:
+                patterns.append(TriggerPattern.from_dict(item))
+            except ValueError as e:
+                print(f"加载触发模式失败: {e}")
+        self.set_patterns(patterns)
+
+
+def match_label(matches: List[TriggerMatch]) -> str:
+    """匹配结果的显示前缀，如 "[触发: 告警×2, 心跳] " """
+    counts: Dict[str, int] = {}
+    for m in matches:
+        counts[m.name] = counts.get(m.name, 0) + 1
+    names = ", ".join(name if n == 1 else f"{name}×{n}" for name, n in counts.items())
+    return f"[触发: {names}] "
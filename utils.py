@@ -1,212 +1,442 @@
+import itertools
 import re
-from datetime import datetime
-from typing import List
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+
+from timestamps import TimestampFormatter, default_formatter
+
+
+# 可打印ASCII转换表：32~126保持原样，其余替换为'.'
+_PRINTABLE_TABLE = bytes(b if 32 <= b < 127 else 0x2E for b in range(256))
+
+# 字节 -> 8位二进制字符串查找表
+_BINARY_TABLE = [f'{b:08b}' for b in range(256)]
+
+# 流式输出时每次处理的行数
+_HEX_BLOCK_LINES = 256
+
+# 行偏移地址字符串缓存 {每行字节数: ['0000', '0010', ...]}，最多缓存 _OFFSET_CACHE_LINES 行
+_OFFSET_CACHE: Dict[int, List[str]] = {}
+_OFFSET_CACHE_LINES = 65536
+
+
+def _offset_labels(base: int, count: int, bytes_per_line: int) -> List[str]:
+    """获取从 base 开始的 count 个行偏移地址字符串"""
+    start = base // bytes_per_line
+    end = start + count
+    if end > _OFFSET_CACHE_LINES:
+        return [f'{i * bytes_per_line:04X}' for i in range(start, end)]
+    cache = _OFFSET_CACHE.get(bytes_per_line)
+    if cache is None or len(cache) < end:
+        cache = [f'{i * bytes_per_line:04X}' for i in range(max(end, 4096))]
+        _OFFSET_CACHE[bytes_per_line] = cache
+    return cache[start:end]
+
+
+def _hex_lines(data: bytes, base: int, bytes_per_line: int) -> List[str]:
+    """整块生成十六进制行：整体做hex/translate，再按行切片，避免逐字节的Python运算"""
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    hex_all = data.hex(' ').upper()
+    ascii_all = data.translate(_PRINTABLE_TABLE).decode('ascii')
+    width = bytes_per_line * 3  # 每字节占3个字符（两位十六进制+分隔空格）
+    full = len(data) - len(data) % bytes_per_line
+    offsets = _offset_labels(base, -(-len(data) // bytes_per_line), bytes_per_line)
+    # 完整行的十六进制部分长度固定为 width-1，补一个空格即达到对齐宽度
+    lines = [
+        f'{offset}  {hex_all[i * 3:i * 3 + width - 1]}   {ascii_all[i:i + bytes_per_line]}'
+        for offset, i in zip(offsets, range(0, full, bytes_per_line))
+    ]
+    if full < len(data):
+        lines.append(f'{offsets[-1]}  {hex_all[full * 3:]:<{width}}  {ascii_all[full:]}')
+    return lines
+
+
+def iter_hex_lines(data: bytes, bytes_per_line: int = 16) -> Iterator[str]:
+    """逐行生成十六进制显示（格式同 bytes_to_hex），分块处理，适合超大数据"""
+    block = bytes_per_line * _HEX_BLOCK_LINES
+    view = memoryview(data)
+    for start in range(0, len(view), block):
+        yield from _hex_lines(view[start:start + block], start, bytes_per_line)
 
 
 def bytes_to_hex(data: bytes, bytes_per_line: int = 16) -> str:
     """将字节转换为十六进制字符串"""
-    lines = []
-    for i in range(0, len(data), bytes_per_line):
-        chunk = data[i:i + bytes_per_line]
-        hex_part = ' '.join(f'{b:02X}' for b in chunk)
-        ascii_part = ''.join(chr(b) if 32 <= b < 127 else '.' for b in chunk)
-        lines.append(f'{i:04X}  {hex_part:<{bytes_per_line * 3}}  {ascii_part}')
-    return '\n'.join(lines)
+    return '\n'.join(_hex_lines(data, 0, bytes_per_line))
+
+
+class HexParseError(ValueError):
+    """十六进制输入解析错误，position 为出错字符在输入中的下标（无法定位时为None）"""
+    def __init__(self, position: Optional[int], reason: str):
+        self.position = position
+        self.reason = reason
+        super().__init__(reason if position is None else f"第{position + 1}个字符处: {reason}")
+
+
+# 十六进制输入词法：分隔符 / 0x前缀 / h后缀 / 连续十六进制串，其余字符均为非法
+_HEX_TOKEN_RE = re.compile(r"""
+    (?P<sep>[\s,]+)
+  | 0[xX](?P<prefixed>[0-9a-fA-F]{1,2})(?![0-9a-fA-F])
+  | (?P<badprefix>0[xX])
+  | (?P<suffixed>[0-9a-fA-F]{1,2})[hH](?![0-9a-zA-Z])
+  | (?P<run>[0-9a-fA-F]+)
+  | (?P<bad>.)
+""", re.VERBOSE | re.DOTALL)
+
+# 超过该长度的输入不进入解析缓存，避免缓存占用过多内存
+_HEX_CACHE_MAX_INPUT = 65536
+
+
+def _parse_hex(hex_str: str) -> bytes:
+    """单遍解析十六进制输入"""
+    # 标准格式和连续格式直接交给C实现，失败再用词法分析定位错误
+    try:
+        data = bytes.fromhex(hex_str)
+    except ValueError:
+        parts = []
+        append = parts.append
+        for m in _HEX_TOKEN_RE.finditer(hex_str):
+            kind = m.lastgroup
+            if kind == 'sep':
+                continue
+            value = m.group(kind)
+            if kind == 'run':
+                if len(value) % 2:
+                    raise HexParseError(m.start() + len(value) - 1, f"十六进制字符个数为奇数: '{value}'")
+                append(value)
+            elif kind == 'badprefix':
+                raise HexParseError(m.start(), "0x前缀后应为1~2位十六进制数")
+            elif kind == 'bad':
+                raise HexParseError(m.start(), f"无效字符 '{value}'")
+            else:
+                # 0x/h格式的单字符字节补零
+                append(value if len(value) == 2 else '0' + value)
+        data = bytes.fromhex(''.join(parts))
+    if not data:
+        raise HexParseError(None, "没有十六进制数据")
+    return data
+
+
+_parse_hex_cached = lru_cache(maxsize=256)(_parse_hex)
 
 
 def hex_to_bytes(hex_str: str) -> bytes:
-    """将十六进制字符串转换为字节
-    支持格式:
+    """将十六进制字符串转换为字节，无效输入抛出 HexParseError
+    支持格式（可混合使用，以空白或逗号分隔）:
     - 标准格式: "56 39 39 47 30 30 30 38 0D"
     - 带h后缀: "56h 39h 39h 47h 30h 30h 30h 38h 0Dh"
     - 连续格式: "56393947303030380D"
     - 0x前缀: "0x56 0x39 0x39"
     """
-    # 先尝试解析带h/H后缀的格式 (如 56h 39H)
-    h_pattern = re.findall(r'([0-9a-fA-F]{1,2})[hH]', hex_str)
-    if h_pattern:
-        # 如果匹配到h后缀格式，使用这种解析
-        hex_bytes = []
-        for h in h_pattern:
-            if len(h) == 1:
-                h = '0' + h
-            hex_bytes.append(h)
-        return bytes.fromhex(''.join(hex_bytes))
-    
-    # 移除所有空白字符、0x前缀和非十六进制字符
-    hex_str = re.sub(r'0x|0X', '', hex_str)  # 移除0x前缀
-    hex_str = re.sub(r'[^0-9a-fA-F]', '', hex_str)  # 只保留十六进制字符
-    
-    if len(hex_str) % 2 != 0:
-        hex_str = hex_str[:-1]  # 如果长度为奇数，移除最后一个字符
-    
-    if not hex_str:
-        return b''
-    
-    return bytes.fromhex(hex_str)
+    if len(hex_str) > _HEX_CACHE_MAX_INPUT:
+        return _parse_hex(hex_str)
+    return _parse_hex_cached(hex_str)
 
 
 def is_valid_hex(hex_str: str) -> bool:
-    """检查字符串是否为有效的十六进制
-    支持格式:
-    - 标准格式: "56 39 39 47"
-    - 带h后缀: "56h 39h 39h 47h"
-    - 连续格式: "56393947"
-    - 0x前缀: "0x56 0x39"
-    """
-    if not hex_str or not hex_str.strip():
-        return False
-    
-    # 检查是否是带h/H后缀的格式
-    h_pattern = re.findall(r'([0-9a-fA-F]{1,2})[hH]', hex_str)
-    if h_pattern:
-        return len(h_pattern) > 0
-    
-    # 移除所有空白字符、0x前缀
-    hex_clean = re.sub(r'0x|0X', '', hex_str)
-    hex_clean = re.sub(r'\s', '', hex_clean)
-    
-    if len(hex_clean) % 2 != 0:
-        return False
-    
-    if not hex_clean:
-        return False
-    
+    """检查字符串是否为有效的十六进制（与 hex_to_bytes 使用同一解析规则）"""
     try:
-        bytes.fromhex(hex_clean)
+        hex_to_bytes(hex_str)
         return True
-    except ValueError:
+    except HexParseError:
         return False
 
 
-def get_timestamp() -> str:
-    """获取当前时间戳字符串"""
-    return datetime.now().strftime('%H:%M:%S.%f')[:-3]
+def get_timestamp(data: Optional[bytes] = None, clock: Optional[TimestampFormatter] = None) -> str:
+    """获取时间戳字符串，传入带时间戳的接收数据时返回其接收时间"""
+    return (clock or default_formatter).format_data(data)
 
 
 def bytes_to_binary(data: bytes, bytes_per_line: int = 8) -> str:
-    """将字节转换为二进制字符串"""
+    """将字节转换为二进制字符串（查表生成，附十六进制参考）"""
+    if not data:
+        return ''
+    binary_all = ' '.join(map(_BINARY_TABLE.__getitem__, data))
+    hex_all = bytes(data).hex(' ').upper()
+    offsets = _offset_labels(0, -(-len(data) // bytes_per_line), bytes_per_line)
     lines = []
-    for i in range(0, len(data), bytes_per_line):
-        chunk = data[i:i + bytes_per_line]
-        # 二进制表示
-        binary_part = ' '.join(f'{b:08b}' for b in chunk)
-        # 十六进制表示（作为参考）
-        hex_part = ' '.join(f'{b:02X}' for b in chunk)
-        lines.append(f'{i:04X}  {binary_part}  |  {hex_part}')
+    for offset, i in zip(offsets, range(0, len(data), bytes_per_line)):
+        n = min(bytes_per_line, len(data) - i)
+        lines.append(f'{offset}  {binary_all[i * 9:i * 9 + n * 9 - 1]}  |  {hex_all[i * 3:i * 3 + n * 3 - 1]}')
     return '\n'.join(lines)
 
 
-def format_received_data(data: bytes, show_hex: bool = False, show_binary: bool = False) -> str:
-    """格式化接收到的数据"""
-    timestamp = get_timestamp()
+def format_payload(data: bytes, timestamp: str, show_hex: bool = False, show_binary: bool = False,
+                   sent: bool = False) -> str:
+    """按显示模式格式化一条数据"""
+    tag = " [发送]" if sent else ""
     if show_binary:
-        return f"[{timestamp}] [二进制]\n{bytes_to_binary(data)}\n"
+        return f"[{timestamp}]{tag} [二进制]\n{bytes_to_binary(data)}\n"
     elif show_hex:
-        return f"[{timestamp}]\n{bytes_to_hex(data)}\n"
+        return f"[{timestamp}]{tag}\n{bytes_to_hex(data)}\n"
     else:
         try:
             text = data.decode('utf-8')
-            return f"[{timestamp}] {text}\n"
+            return f"[{timestamp}]{tag} {text}\n"
         except UnicodeDecodeError:
-            return f"[{timestamp}] [二进制数据]\n{bytes_to_hex(data)}\n"
+            return f"[{timestamp}]{tag} [二进制数据]\n{bytes_to_hex(data)}\n"
 
 
-def format_sent_data(data: bytes, show_hex: bool = False, show_binary: bool = False) -> str:
-    """格式化发送的数据"""
-    timestamp = get_timestamp()
-    if show_binary:
-        return f"[{timestamp}] [发送] [二进制]\n{bytes_to_binary(data)}\n"
-    elif show_hex:
-        return f"[{timestamp}] [发送]\n{bytes_to_hex(data)}\n"
-    else:
-        try:
-            text = data.decode('utf-8')
-            return f"[{timestamp}] [发送] {text}\n"
-        except UnicodeDecodeError:
-            return f"[{timestamp}] [发送] [二进制数据]\n{bytes_to_hex(data)}\n"
+def format_received_data(data: bytes, show_hex: bool = False, show_binary: bool = False,
+                         clock: Optional[TimestampFormatter] = None) -> str:
+    """格式化接收到的数据"""
+    return format_payload(data, get_timestamp(data, clock), show_hex, show_binary)
+
+
+def format_sent_data(data: bytes, show_hex: bool = False, show_binary: bool = False,
+                     clock: Optional[TimestampFormatter] = None) -> str:
+    """格式化发送的数据（data 带时间戳时使用其发送时间）"""
+    return format_payload(data, get_timestamp(data, clock), show_hex, show_binary, sent=True)
+
+
+def parse_tags(tags) -> List[str]:
+    """标签可以是列表或逗号分隔的字符串（支持中文逗号），去掉空白和空项"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.replace("，", ",").split(",")
+    return [str(t).strip() for t in tags if str(t).strip()]
 
 
 class HistoryItem:
     """历史记录项"""
-    def __init__(self, data: str, remark: str = ""):
+    def __init__(self, data: str, remark: str = "", group: str = "", tags: Optional[List[str]] = None):
         self.data = data
         self.remark = remark
+        self.group = group              # 分组（如设备类型）
+        self.tags = parse_tags(tags)    # 标签
     
     def __str__(self):
+        group = f"<{self.group}> " if self.group else ""
         if self.remark:
-            return f"[{self.remark}] {self.data[:30]}{'...' if len(self.data) > 30 else ''}"
-        return self.data[:50] + ('...' if len(self.data) > 50 else '')
+            return f"{group}[{self.remark}] {self.data[:30]}{'...' if len(self.data) > 30 else ''}"
+        return group + self.data[:50] + ('...' if len(self.data) > 50 else '')
     
     def to_dict(self) -> dict:
-        return {"data": self.data, "remark": self.remark}
+        d = {"data": self.data, "remark": self.remark}
+        if self.group:
+            d["group"] = self.group
+        if self.tags:
+            d["tags"] = list(self.tags)
+        return d
     
     @classmethod
     def from_dict(cls, d: dict) -> "HistoryItem":
-        return cls(d.get("data", ""), d.get("remark", ""))
+        return cls(d.get("data", ""), d.get("remark", ""), d.get("group", ""), d.get("tags"))
+    
+    def search_text(self) -> str:
+        """用于检索的文本：备注、分组、标签、原始内容和去空白的十六进制"""
+        compact = re.sub(r'\s+', '', self.data)
+        return '\n'.join((self.remark, self.group, ' '.join(self.tags), self.data, compact)).lower()
+
+
+def _trigrams(text: str) -> set:
+    """文本的所有3字符子串"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
 
 
 class HistoryManager:
-    """发送历史管理器"""
-    def __init__(self, max_history: int = 50):
-        self.history: List[HistoryItem] = []
+    """发送历史管理器
+    
+    以发送内容为键的有序字典保存记录（最近使用的在最前），添加和移到最前均为O(1)；
+    备注、分组、标签和内容建立三元组倒排索引，支持子串/前缀检索
+    """
+    def __init__(self, max_history: int = 5000):
+        self._items: "OrderedDict[str, HistoryItem]" = OrderedDict()
         self.max_history = max_history
+        self._grams: Dict[str, set] = {}        # 三元组 -> 记录键集合
+        self._item_grams: Dict[str, set] = {}   # 记录键 -> 该记录的三元组
+        self._texts: Dict[str, str] = {}        # 记录键 -> 检索文本
+        self._groups: Dict[str, set] = {}       # 分组 -> 记录键集合
+        self._seq: Dict[str, int] = {}          # 记录键 -> 最近使用序号（越大越新）
+        self._counter = itertools.count()
+        self.version = 0  # 每次修改后递增，界面据此判断是否需要刷新
+    
+    @property
+    def history(self) -> List[HistoryItem]:
+        """按最近使用排序的记录列表"""
+        return list(self._items.values())
+    
+    def _index(self, key: str):
+        """为记录建立索引"""
+        item = self._items[key]
+        text = item.search_text()
+        grams = _trigrams(text)
+        self._texts[key] = text
+        self._item_grams[key] = grams
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(key)
+        if item.group:
+            self._groups.setdefault(item.group, set()).add(key)
+    
+    def _unindex(self, key: str):
+        """移除记录的索引"""
+        item = self._items[key]
+        for gram in self._item_grams.pop(key, ()):
+            keys = self._grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._grams[gram]
+        self._texts.pop(key, None)
+        if item.group in self._groups:
+            self._groups[item.group].discard(key)
+            if not self._groups[item.group]:
+                del self._groups[item.group]
     
-    def add(self, data: str, remark: str = ""):
-        """添加历史记录"""
+    def _touch(self, key: str):
+        """移到最前"""
+        self._items.move_to_end(key, last=False)
+        self._seq[key] = next(self._counter)
+    
+    def add(self, data: str, remark: str = "", group: str = "", tags: Optional[List[str]] = None) -> Optional[HistoryItem]:
+        """添加历史记录，已存在时移到最前（并更新非空的备注/分组/标签）"""
         if not data:
-            return
-        # 检查是否已存在相同数据
-        for item in self.history:
-            if item.data == data:
-                # 更新备注
-                if remark:
-                    item.remark = remark
-                # 移到最前面
-                self.history.remove(item)
-                self.history.insert(0, item)
-                return
+            return None
+        item = self._items.get(data)
+        if item is not None:
+            if remark or group or tags:
+                self.update(data, remark or None, group or None, tags)
+            self._touch(data)
+            self.version += 1
+            return item
         
         # 添加新记录
-        self.history.insert(0, HistoryItem(data, remark))
-        if len(self.history) > self.max_history:
-            self.history.pop()
+        item = HistoryItem(data, remark, group, tags)
+        self._items[data] = item
+        self._touch(data)
+        self._index(data)
+        while len(self._items) > self.max_history:
+            self.delete(next(reversed(self._items)))
+        self.version += 1
+        return item
+    
+    def update(self, data: str, remark: Optional[str] = None, group: Optional[str] = None,
+               tags: Optional[List[str]] = None) -> bool:
+        """修改记录的备注/分组/标签（None表示不修改）并重建索引"""
+        item = self._items.get(data)
+        if item is None:
+            return False
+        self._unindex(data)
+        if remark is not None:
+            item.remark = remark
+        if group is not None:
+            item.group = group
+        if tags is not None:
+            item.tags = parse_tags(tags)
+        self._index(data)
+        self.version += 1
+        return True
+    
+    def get(self, data: str) -> Optional[HistoryItem]:
+        """按发送内容获取记录"""
+        return self._items.get(data)
+    
+    def delete(self, data: str) -> bool:
+        """按发送内容删除记录"""
+        if data not in self._items:
+            return False
+        self._unindex(data)
+        del self._items[data]
+        self._seq.pop(data, None)
+        self.version += 1
+        return True
+    
+    def search(self, query: str = "", prefix: bool = False, group: Optional[str] = None,
+               tag: Optional[str] = None, limit: Optional[int] = None) -> List[HistoryItem]:
+        """检索历史记录，按最近使用排序
+        
+        query 在备注、分组、标签和发送内容中做子串匹配（不区分大小写，十六进制忽略空白），
+        prefix=True 时只匹配以 query 开头的发送内容或备注
+        """
+        query = query.strip().lower()
+        compact = re.sub(r'\s+', '', query)
+        keys = self._groups.get(group, set()) if group is not None else None
+        if len(compact) >= 3:
+            # 用三元组倒排索引求候选集，再逐条核对；带空白的查询同时按原样和去空白两种方式匹配
+            candidates = self._candidates(compact)
+            if compact != query and len(query) >= 3:
+                candidates |= self._candidates(query)
+            keys = candidates if keys is None else keys & candidates
+        if keys is None:
+            ordered = list(self._items)
+        else:
+            ordered = sorted(keys, key=self._seq.__getitem__, reverse=True)
+        
+        result = []
+        for key in ordered:
+            item = self._items[key]
+            if tag is not None and tag not in item.tags:
+                continue
+            if query:
+                if prefix:
+                    if not (key.lower().startswith(query) or re.sub(r'\s+', '', key).lower().startswith(compact)
+                            or item.remark.lower().startswith(query)):
+                        continue
+                elif query not in self._texts[key] and compact not in self._texts[key]:
+                    continue
+            result.append(item)
+            if limit and len(result) >= limit:
+                break
+        return result
+    
+    def _candidates(self, text: str) -> set:
+        """包含 text 全部三元组的记录键（从最稀有的三元组开始求交集）"""
+        keys = None
+        for gram in sorted(_trigrams(text), key=lambda g: len(self._grams.get(g, ()))):
+            found = self._grams.get(gram)
+            if not found:
+                return set()
+            keys = set(found) if keys is None else keys & found
+            if not keys:
+                return set()
+        return keys
+    
+    def groups(self) -> List[str]:
+        """所有分组名"""
+        return sorted(self._groups)
     
     def get_all(self) -> List[HistoryItem]:
         """获取所有历史记录"""
-        return self.history.copy()
+        return self.history
     
     def get_display_names(self) -> List[str]:
         """获取显示名称列表"""
-        return [str(item) for item in self.history]
+        return [str(item) for item in self._items.values()]
     
     def get_item(self, index: int) -> Optional[HistoryItem]:
         """获取指定索引的历史记录"""
-        if 0 <= index < len(self.history):
-            return self.history[index]
+        if 0 <= index < len(self._items):
+            return next(itertools.islice(self._items.values(), index, None))
         return None
     
     def delete_item(self, index: int) -> bool:
         """删除指定索引的历史记录"""
-        if 0 <= index < len(self.history):
-            self.history.pop(index)
-            return True
-        return False
+        item = self.get_item(index)
+        return self.delete(item.data) if item else False
     
     def clear(self):
         """清空历史记录"""
-        self.history.clear()
+        self._items.clear()
+        self._grams.clear()
+        self._item_grams.clear()
+        self._texts.clear()
+        self._groups.clear()
+        self._seq.clear()
+        self.version += 1
     
     def to_list(self) -> List[dict]:
         """转换为列表（用于序列化）"""
-        return [item.to_dict() for item in self.history]
+        return [item.to_dict() for item in self._items.values()]
     
     def from_list(self, data: List[dict]):
         """从列表加载"""
-        self.history = []
-        for item in data:
-            if isinstance(item, dict) and "data" in item:
-                self.history.append(HistoryItem.from_dict(item))
-        # 限制数量
-        if len(self.history) > self.max_history:
-            self.history = self.history[:self.max_history]
+        self.clear()
+        for d in data[:self.max_history]:
+            if isinstance(d, dict) and d.get("data") and d["data"] not in self._items:
+                item = HistoryItem.from_dict(d)
+                self._items[item.data] = item
+                self._seq[item.data] = -len(self._items)  # 保持文件中的顺序
+                self._index(item.data)
+        self.version += 1
@@ -3,18 +3,10 @@ TCP调试工具 - Web版本
 使用Flask + SocketIO提供Web服务
 """
 
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit
-import json
 import os
 import sys
-from typing import Optional, Tuple
 
-from network import get_network_interfaces, NetworkInterface, TCPClient, TCPServer, UDPClient, UDPServer
-from utils import (
-    bytes_to_hex, hex_to_bytes, is_valid_hex,
-    format_received_data, format_sent_data, HistoryManager
-)
+import runtime
 
 # 获取程序运行目录（支持打包后的exe）
 def get_app_dir():
@@ -26,26 +18,138 @@ def get_app_dir():
         # 直接运行py文件
         return os.path.dirname(os.path.abspath(__file__))
 
+# 配置文件路径
+CONFIG_FILE = os.path.join(get_app_dir(), "config.json")
+
+# 协程运行时（eventlet/gevent）要在导入 socket/threading 的使用者之前打补丁
+ASYNC_MODE = runtime.setup(sys.argv[1:] if __name__ == '__main__' else None, CONFIG_FILE)
+
+from flask import Flask, Response, jsonify, render_template, request
+from flask_socketio import SocketIO, emit, join_room
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from network import (
+    get_network_interfaces, interface_inventory, send_frames, NetworkInterface,
+    TCPClient, TCPServer, UDPClient, UDPServer
+)
+from proxy import TCPProxy, UDPProxy, DIRECTION_LABELS
+from impairment import ImpairmentConfig, attach_impairment, get_scheduler, impairment_stats
+from ratelimit import RateLimiter
+from config_store import ConfigStore
+from emit_queue import EmitQueue
+from metrics import Metrics
+from scrollback import Scrollback
+from traffic_query import DIRECTION_NAMES, TrafficQuery
+from wire import DIR_RECEIVED, DIR_SENT, DIRECTION_CODES, FLAG_RELATIVE, EndpointTable, pack_record, unpack_records
+from checksum import ALGORITHMS, PRESETS, ChecksumConfig
+from triggers import TriggerPattern, TriggerSet, match_label
+from responder import Rule, RuleEngine
+from nic_monitor import NicMonitor
+from timestamps import TimestampFormatter, kernel_timestamps_supported, stamp, times_of
+from utils import (
+    bytes_to_hex, hex_to_bytes, HexParseError,
+    format_received_data, format_sent_data, HistoryManager
+)
+
+# 发送历史列表一次最多返回的条数
+HISTORY_VIEW_LIMIT = 500
+
+# 浏览器全部断开后会话保留的时间（秒），期间重连可恢复
+SESSION_IDLE_TIMEOUT = 600
+# 每个会话为重连保留的最近推送批次（按字节数和批次数限制）
+RESUME_BUFFER_BYTES = 8 * 1024 * 1024
+RESUME_BUFFER_BATCHES = 2000
+# 估算非二进制事件占用的字节数
+BATCH_EVENT_OVERHEAD = 64
+
 app = Flask(__name__, template_folder=os.path.join(get_app_dir(), 'templates'))
 app.config['SECRET_KEY'] = 'tcp-tool-secret'
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
 
-# 配置文件路径
-CONFIG_FILE = os.path.join(get_app_dir(), "config.json")
+# 运行指标（/metrics），网络线程只写各自的计数分片
+metrics = Metrics()
+metrics.describe('tcptool_bytes_total', 'counter', '收发字节数（按方向和对端IP）')
+metrics.describe('tcptool_packets_total', 'counter', '收发数据包数（按方向和对端IP）')
+metrics.describe('tcptool_send_errors_total', 'counter', '发送失败次数')
+metrics.describe('tcptool_connect_failures_total', 'counter', '连接失败次数')
+metrics.describe('tcptool_reconnects_total', 'counter', '重连次数（TCP客户端重连同一目标 / 浏览器恢复会话）')
+metrics.describe('tcptool_receive_emit_latency_seconds', 'histogram', '数据接收到推送给浏览器的延迟')
+metrics.describe('tcptool_sessions', 'gauge', '会话数')
+metrics.describe('tcptool_browser_connections', 'gauge', '已连接的浏览器数')
+metrics.describe('tcptool_connections', 'gauge', '网络连接数（按会话和类型）')
+metrics.describe('tcptool_emit_queue_events', 'gauge', '推送队列中的事件数')
+metrics.describe('tcptool_emit_queue_bytes', 'gauge', '推送队列中的字节数')
+metrics.describe('tcptool_emit_batches_total', 'counter', '已推送的批次数')
+metrics.describe('tcptool_emit_dropped_total', 'counter', '推送队列溢出丢弃的事件数')
+# 方向编号 -> 指标标签
+DIRECTION_METRIC_LABELS = {code: name for name, code in DIRECTION_NAMES.items()}
+# 指标中不同对端IP的上限，超过后归入 "other"，避免序列数随客户端无限增长
+METRIC_PEER_LIMIT = 256
+_metric_peers: set = set()
+_metric_peers_lock = threading.Lock()   # 只在遇到新IP时使用，已登记的IP不加锁
 
-# 全局状态
-class AppState:
-    def __init__(self):
+def _metric_peer(source: Optional[str]) -> str:
+    """指标的对端标签: 只取IP（端口每个连接都不同），数量有上限"""
+    if not source:
+        return ''
+    ip = source.rpartition(':')[0] or source
+    if ip not in _metric_peers:
+        with _metric_peers_lock:
+            if ip not in _metric_peers:
+                if len(_metric_peers) >= METRIC_PEER_LIMIT:
+                    return 'other'
+                _metric_peers.add(ip)
+    return ip
+
+# 会话: 每个浏览器标签页一个，拥有独立的网络对象和推送队列
+class Session:
+    def __init__(self, session_id: str, scrollback: Optional[dict] = None):
+        self.id = session_id
+        self.room = f"session:{session_id}"
         self.tcp_client = TCPClient()
         self.tcp_server = TCPServer()
         self.udp_client = UDPClient()
         self.udp_server = UDPServer()
-        self.connection_history: list[tuple[str, int]] = []
-        self.udp_connection_history: list[tuple[str, int]] = []
-        self.history_manager = HistoryManager()
-        self.current_client_sid: Optional[str] = None
+        self.tcp_proxy = TCPProxy()
+        self.udp_proxy = UDPProxy()
+        self.checksum_config = ChecksumConfig()
+        self.triggers = TriggerSet()
+        self.responder = RuleEngine()
+        self.auto_reply_enabled = False
+        self.sids: set = set()          # 当前连接到该会话的浏览器
+        self.detached_at: Optional[float] = None  # 最后一个浏览器断开的时间
+        # 网络线程产生的事件经队列按批推送
+        self.emitter = EmitQueue(self._emit_batch)
+        self.emitter.on_emitted = self._on_emitted
+        self.last_target: Optional[Tuple[str, int]] = None  # TCP客户端上次连接成功的目标，用于统计重连
+        # 推送格式: text 服务器渲染文本 / binary 原始字节由页面渲染
+        self.transport = "text"
+        self.endpoints = EndpointTable(lambda: self.scrollback.endpoint_ids())
+        # 时间戳显示设置和会话内所有连接共用的发送限速，只作用于本会话
+        self.clock = TimestampFormatter()
+        self.send_limiter = RateLimiter()
+        # 全部收发记录，供刷新/重连后分页回看
+        try:
+            self.scrollback = Scrollback.from_dict(scrollback or {})
+        except (TypeError, ValueError) as e:
+            print(f"回看缓冲配置无效: {e}")
+            self.scrollback = Scrollback()
+        # 最近推送的批次 (序号, 字节数, 批次)，浏览器重连时从其游标之后补发
+        self._batches: deque = deque()
+        self._batch_bytes = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        # 可能阻塞的操作（连接、发送）在会话的任务线程中按顺序执行
+        self._tasks: deque = deque()
+        self._tasks_running = False
+        self._tasks_lock = threading.Lock()
         self._setup_callbacks()
     
     def _setup_callbacks(self):
@@ -57,53 +161,361 @@ class AppState:
         self.tcp_server.on_data_received = self._on_server_data
         self.udp_client.on_data_received = self._on_udp_client_data
         self.udp_server.on_data_received = self._on_udp_server_data
+        self.tcp_proxy.on_traffic = self._on_proxy_traffic
+        self.udp_proxy.on_traffic = self._on_proxy_traffic
+        self.responder.on_reply = self._on_auto_reply
+    
+    def attach(self, sid: str, cursor: int):
+        """浏览器连接到会话: 补发游标之后仍保留的批次，再加入房间接收新批次
+
+        游标为0（页面刷新）时不补发，由页面从回看缓冲按需加载
+        """
+        with self._lock:
+            # 先下发端点表，补发的二进制记录才能显示来源
+            socketio.emit('transport', self.transport_state(), to=sid)
+            missed = 0
+            if self._batches and 0 < cursor < self._batches[0][0] - 1:
+                missed = self._batches[0][0] - cursor - 1
+            for seq, _, batch in self._batches:
+                if cursor and seq > cursor:
+                    if missed:
+                        batch = dict(batch, missed=missed)
+                        missed = 0
+                    socketio.emit('event_batch', batch, to=sid)
+            join_room(self.room, sid=sid)
+            self.sids.add(sid)
+            self.detached_at = None
+    
+    def submit(self, func: Callable, *args):
+        """加入一个任务，socket.io 处理函数不等待其完成"""
+        with self._tasks_lock:
+            self._tasks.append((func, args))
+            if not self._tasks_running:
+                self._tasks_running = True
+                socketio.start_background_task(self._run_tasks)
+    
+    def call(self, func: Callable, *args):
+        """加入一个任务并等待其完成，返回结果或抛出其异常（HTTP接口与页面的操作按同一顺序执行）"""
+        done = threading.Event()
+        outcome: list = [None, None]
+        def run():
+            try:
+                outcome[0] = func(*args)
+            except Exception as e:
+                outcome[1] = e
+            finally:
+                done.set()
+        self.submit(run)
+        done.wait()
+        if outcome[1] is not None:
+            raise outcome[1]
+        return outcome[0]
+    
+    def _run_tasks(self):
+        """依次执行任务，队列空时退出（协程运行时下为协程）"""
+        while True:
+            with self._tasks_lock:
+                if not self._tasks:
+                    self._tasks_running = False
+                    return
+                func, args = self._tasks.popleft()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"会话任务执行失败: {e}")
+    
+    def transport_state(self) -> dict:
+        """推送格式和二进制记录的端点/方向对照表"""
+        return {
+            'mode': self.transport,
+            'endpoints': self.endpoints.to_dict(),
+            'directions': {DIRECTION_CODES[key]: label for key, label in DIRECTION_LABELS.items()}
+        }
+    
+    def detach(self, sid: str):
+        """浏览器断开，会话保留到空闲超时"""
+        with self._lock:
+            self.sids.discard(sid)
+            if not self.sids:
+                self.detached_at = time.monotonic()
+    
+    def close(self):
+        """关闭会话的全部连接和推送线程"""
+        self.tcp_client.disconnect()
+        self.tcp_server.stop()
+        self.udp_client.disconnect()
+        self.udp_server.stop()
+        self.tcp_proxy.stop()
+        self.udp_proxy.stop()
+        self.emitter.stop()
+        self.scrollback.close()
+    
+    def load_settings(self, config: dict):
+        """从配置加载校验、触发和自动应答设置（新建会话时调用，配置中保存的是最近一次修改的会话的设置）"""
+        if config.get('checksum'):
+            self.checksum_config = ChecksumConfig.from_dict(config['checksum'])
+        # 触发模式未修改时不重新编译，保留计数
+        triggers = config.get('triggers', [])
+        if triggers != self.triggers.to_list():
+            self.triggers.from_list(triggers)
+        auto_reply = config.get('auto_reply', {})
+        if auto_reply.get('rules', []) != self.responder.to_list():
+            self.responder.from_list(auto_reply.get('rules', []))
+        self.auto_reply_enabled = bool(auto_reply.get('enabled'))
+        self.apply_responder()
+    
+    def _emit_batch(self, batch: dict):
+        """推送一批事件（在推送线程中调用），相邻的二进制记录合并为一个附件"""
+        events = []
+        size = 0
+        for event in batch['events']:
+            if event[0] == 'rx' and events and events[-1][0] == 'rx':
+                events[-1][1].append(event[1])
+            elif event[0] == 'rx':
+                events.append(['rx', [event[1]]])
+            else:
+                events.append(event)
+        for event in events:
+            if event[0] == 'rx':
+                event[1] = b''.join(event[1])
+                size += len(event[1])
+            else:
+                size += BATCH_EVENT_OVERHEAD
+        batch['events'] = events
+        with self._lock:
+            self._seq += 1
+            batch['seq'] = self._seq
+            self._batches.append((self._seq, size, batch))
+            self._batch_bytes += size
+            while self._batch_bytes > RESUME_BUFFER_BYTES or len(self._batches) > RESUME_BUFFER_BATCHES:
+                self._batch_bytes -= self._batches.popleft()[1]
+            socketio.emit('event_batch', batch, room=self.room)
+    
+    def record(self, data: bytes, direction: int, source: Optional[str] = None, note: str = "") -> int:
+        """记入回看缓冲和收发计数，返回端点编号（新端点同时推送给页面）"""
+        endpoint_id, new = self.endpoints.lookup(source)
+        if new:
+            self.emitter.push('endpoints', {endpoint_id: source})
+        self.scrollback.append(data, direction, endpoint_id, note)
+        labels = (('direction', DIRECTION_METRIC_LABELS.get(direction, 'received')), ('peer', _metric_peer(source)))
+        metrics.inc('tcptool_bytes_total', labels, len(data))
+        metrics.inc('tcptool_packets_total', labels)
+        return endpoint_id
+    
+    def _on_emitted(self, received: List[int]):
+        """一批推送完成（推送线程），统计其中接收数据的接收到推送延迟"""
+        now = time.monotonic_ns()
+        labels = (('transport', self.transport),)
+        for received_ns in received:
+            metrics.observe('tcptool_receive_emit_latency_seconds', labels, (now - received_ns) / 1e9)
+    
+    def _queue_binary(self, data: bytes, direction: int, endpoint_id: int, note: str, received_ns: int = 0):
+        """二进制推送：放入原始字节，打包推迟到推送线程"""
+        self.emitter.push('rx', lambda: pack_record(data, direction, endpoint_id, note, self.clock), len(data),
+                          received_ns)
+    
+    def _queue_received(self, data: bytes, stream, source: Optional[str] = None, direction: Optional[str] = None,
+                        verify: bool = True):
+        """接收数据放入推送队列：触发扫描和校验在网络线程完成，格式化推迟到推送线程"""
+        prefix = (self.checksum_config.check(data) or "") if verify else ""
+        matches = self.triggers.scan(stream, data)
+        if matches:
+            prefix += match_label(matches)
+            self.emitter.push('trigger_match', {
+                'from': source or '',
+                'matches': [m.to_dict() for m in matches],
+                'total': self.triggers.total
+            })
+        code = DIRECTION_CODES.get(direction, DIR_RECEIVED)
+        endpoint_id = self.record(data, code, source, prefix)
+        received_ns = times_of(data)[1]
+        if self.transport == "binary":
+            self._queue_binary(data, code, endpoint_id, prefix, received_ns)
+            return
+        
+        def render() -> dict:
+            event = {'data': prefix + format_received_data(data, show_hex=True, clock=self.clock),
+                     'hex': bytes_to_hex(data)}
+            if source:
+                event['from'] = source
+            if direction:
+                event['direction'] = DIRECTION_LABELS[direction]
+                event['cls'] = direction    # 接收区按方向着色
+            return event
+        self.emitter.push('receive_data', render, len(data), received_ns)
     
     def _on_client_data(self, data: bytes):
         """客户端接收到数据"""
-        formatted = format_received_data(data, show_hex=True)
-        socketio.emit('receive_data', {'data': formatted, 'hex': bytes_to_hex(data)}, room=self.current_client_sid)
+        self._queue_received(data, ("tcp_client",))
+    
+    def _on_auto_reply(self, rule: Rule, reply: bytes):
+        """自动应答已发送（网络线程回调）"""
+        self.queue_sent(reply, f"[自动应答 {rule.name}] ")
+    
+    def queue_sent(self, data: bytes, note: str = "", target: Optional[str] = None):
+        """已发送的数据（页面、自动应答、HTTP接口）：记入回看缓冲，经推送队列发给会话的所有页面"""
+        data = stamp(data)
+        endpoint_id = self.record(data, DIR_SENT, target, note)
+        if self.transport == "binary":
+            self._queue_binary(data, DIR_SENT, endpoint_id, note)
+            return
+        self.emitter.push('send_success', lambda: {'data': note + format_sent_data(data, show_hex=True, clock=self.clock)},
+                          len(data))
+    
+    def apply_responder(self):
+        """启用时把规则引擎挂到TCP/UDP服务器上"""
+        responder = self.responder if self.auto_reply_enabled else None
+        self.tcp_server.responder = responder
+        self.udp_server.responder = responder
     
     def _on_client_disconnected(self):
         """客户端断开连接"""
-        socketio.emit('connection_status', {'connected': False, 'mode': 'client'}, room=self.current_client_sid)
+        self.triggers.reset(("tcp_client",))
+        self.emitter.push('connection_status', {'connected': False, 'mode': 'client'})
     
     def _on_server_client_connected(self, ip: str, port: int):
         """服务器有客户端连接"""
-        socketio.emit('server_client_connected', {'ip': ip, 'port': port}, room=self.current_client_sid)
+        self.emitter.push('server_client_connected', {'ip': ip, 'port': port})
     
     def _on_server_client_disconnected(self, ip: str, port: int):
         """服务器客户端断开"""
-        socketio.emit('server_client_disconnected', {'ip': ip, 'port': port}, room=self.current_client_sid)
+        self.triggers.reset(("tcp_server", (ip, port)))
+        self.emitter.push('server_client_disconnected', {'ip': ip, 'port': port})
     
     def _on_server_data(self, ip: str, port: int, data: bytes):
         """服务器接收到数据"""
-        formatted = format_received_data(data, show_hex=True)
-        socketio.emit('receive_data', {
-            'data': formatted, 
-            'hex': bytes_to_hex(data),
-            'from': f"{ip}:{port}"
-        }, room=self.current_client_sid)
+        self._queue_received(data, ("tcp_server", (ip, port)), f"{ip}:{port}")
     
     def _on_udp_client_data(self, ip: str, port: int, data: bytes):
         """UDP客户端接收到数据"""
-        formatted = format_received_data(data, show_hex=True)
-        socketio.emit('receive_data', {
-            'data': formatted,
-            'hex': bytes_to_hex(data),
-            'from': f"{ip}:{port}"
-        }, room=self.current_client_sid)
+        self._queue_received(data, ("udp_client", (ip, port)), f"{ip}:{port}")
     
     def _on_udp_server_data(self, ip: str, port: int, data: bytes):
         """UDP服务器接收到数据"""
-        formatted = format_received_data(data, show_hex=True)
-        socketio.emit('receive_data', {
-            'data': formatted,
-            'hex': bytes_to_hex(data),
-            'from': f"{ip}:{port}"
-        }, room=self.current_client_sid)
-        # 通知客户端列表更新
-        clients = self.udp_server.get_clients()
-        socketio.emit('udp_clients', {'clients': clients}, room=self.current_client_sid)
+        self._queue_received(data, ("udp_server", (ip, port)), f"{ip}:{port}")
+        # 客户端列表每批只推送一次
+        self.emitter.push_latest('udp_clients', lambda: {'clients': self.udp_server.get_clients()})
+    
+    def _on_proxy_traffic(self, direction: str, client_addr: Tuple[str, int], data: bytes):
+        """代理旁路数据"""
+        self._queue_received(data, (direction, client_addr), f"{client_addr[0]}:{client_addr[1]}", direction,
+                             verify=False)
+
+# 全局状态: 各会话共享的配置（连接历史、发送历史）和网卡监视
+class AppState:
+    def __init__(self):
+        self.nic_monitor = NicMonitor()
+        self.connection_history: list[tuple[str, int]] = []
+        self.udp_connection_history: list[tuple[str, int]] = []
+        self.history_manager = HistoryManager()
+        self.sessions: Dict[str, Session] = {}
+        self.sid_sessions: Dict[str, Session] = {}   # 浏览器连接 -> 会话
+        self._lock = threading.Lock()
+        self.udp_lock = threading.Lock()   # UDP端口占用检查与启动之间互斥
+        self.nic_monitor.add_listener(self._on_nic_samples)
+        # 预热网卡缓存并监听变化，页面加载时直接使用缓存
+        interface_inventory.get()
+        interface_inventory.add_listener(self._on_interfaces_changed)
+    
+    def open_session(self, sid: str, session_id: Optional[str], cursor: int) -> Tuple[Session, bool]:
+        """浏览器连接: 恢复已有会话或新建会话，返回 (会话, 是否恢复)"""
+        with self._lock:
+            session = self.sessions.get(session_id) if session_id else None
+            resumed = session is not None
+            if session is None:
+                session = self._new_session()
+            self.sid_sessions[sid] = session
+        session.attach(sid, cursor if resumed else 0)
+        return session, resumed
+    
+    def create_session(self) -> Session:
+        """HTTP接口创建的会话: 没有浏览器连接，最后一次调用接口后空闲超时关闭"""
+        with self._lock:
+            session = self._new_session()
+        self.touch(session)
+        return session
+    
+    def _new_session(self) -> Session:
+        """新建会话（调用方已持有锁）"""
+        session = Session(uuid.uuid4().hex, config_store.data.get('scrollback'))
+        session.load_settings(config_store.data)
+        self.sessions[session.id] = session
+        return session
+    
+    def touch(self, session: Session):
+        """HTTP接口访问会话: 没有浏览器连接时重新开始空闲计时"""
+        if not session.sids:
+            first = session.detached_at is None
+            session.detached_at = time.monotonic()
+            if first:
+                get_scheduler().schedule_after(SESSION_IDLE_TIMEOUT, self._reap, session.id)
+    
+    def close_session(self, session_id: str) -> bool:
+        """立即关闭会话"""
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+    
+    def close_sid(self, sid: str):
+        """浏览器断开，会话空闲超时后关闭"""
+        with self._lock:
+            session = self.sid_sessions.pop(sid, None)
+        if session:
+            session.detach(sid)
+            get_scheduler().schedule_after(SESSION_IDLE_TIMEOUT, self._reap, session.id)
+    
+    def _reap(self, session_id: str):
+        """关闭空闲超时的会话（在定时器线程中调用）"""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None or session.detached_at is None:
+                return
+            idle = time.monotonic() - session.detached_at
+            if idle < SESSION_IDLE_TIMEOUT:
+                # 期间又有访问（HTTP接口），按最后一次访问重新计时
+                get_scheduler().schedule_after(SESSION_IDLE_TIMEOUT - idle, self._reap, session_id)
+                return
+            del self.sessions[session_id]
+        session.close()
+    
+    def all_sessions(self) -> List[Session]:
+        with self._lock:
+            return list(self.sessions.values())
+    
+    def udp_port_taken(self, port: int, exclude: Session) -> bool:
+        """其他会话的UDP服务器或UDP代理是否已在该端口监听"""
+        for session in self.all_sessions():
+            if session is exclude:
+                continue
+            for server in (session.udp_server, session.udp_proxy.server):
+                sock = server.socket
+                try:
+                    if server.running and sock and sock.getsockname()[1] == port:
+                        return True
+                except OSError:
+                    pass
+        return False
+    
+    def _on_interfaces_changed(self, interfaces):
+        """网卡变化，推送给所有浏览器"""
+        socketio.emit('interfaces', _interface_list())
+    
+    def _on_nic_samples(self, samples):
+        """网卡采样结果，推送给所有会话"""
+        stats = {
+            'interval': self.nic_monitor.interval,
+            'samples': [st.to_dict() for st in samples.values()],
+            'totals': self.nic_monitor.totals
+        }
+        for session in self.all_sessions():
+            session.emitter.push_latest('nic_stats', stats)
+
+def _interface_list() -> list:
+    """网卡列表（含IPv6、掩码、广播地址、MTU和启用状态）"""
+    return [iface.to_dict() for iface in get_network_interfaces(include_ipv6=True)]
 
 # 全局状态实例
 app_state = AppState()
@@ -113,70 +525,126 @@ def index():
     """主页面"""
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics_page():
+    """Prometheus 抓取: 计数器来自网络线程各自的分片，连接数和推送队列在此刻读取（不加网络层的锁）"""
+    gauges = []
+    sessions = app_state.all_sessions()
+    gauges.append(('tcptool_sessions', (), len(sessions)))
+    gauges.append(('tcptool_browser_connections', (), sum(len(session.sids) for session in sessions)))
+    for session in sessions:
+        label = (('session', session.id),)
+        connections = {
+            'tcp_client': int(session.tcp_client.connected),
+            'tcp_server': len(session.tcp_server.clients),
+            'udp_client': int(session.udp_client.connected),
+            'udp_server': len(session.udp_server.clients),
+            'tcp_proxy': len(session.tcp_proxy.upstreams),
+            'udp_proxy': len(session.udp_proxy.upstreams),
+        }
+        for kind, count in connections.items():
+            gauges.append(('tcptool_connections', label + (('kind', kind),), count))
+        events, nbytes = session.emitter.depth()
+        gauges.append(('tcptool_emit_queue_events', label, events))
+        gauges.append(('tcptool_emit_queue_bytes', label, nbytes))
+        gauges.append(('tcptool_emit_batches_total', label, session.emitter.stats['batches']))
+        gauges.append(('tcptool_emit_dropped_total', label, session.emitter.stats['dropped']))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+def _session() -> Session:
+    """当前浏览器连接所属的会话"""
+    return app_state.sid_sessions[request.sid]
+
 @socketio.on('connect')
-def handle_connect():
-    """客户端连接"""
-    app_state.current_client_sid = request.sid
-    # 发送网卡列表
-    interfaces = get_network_interfaces()
-    interface_list = [{'name': iface.name, 'ip': iface.ip} for iface in interfaces]
-    emit('interfaces', interface_list)
-    
-    # 加载并发送配置
-    _load_config()
+def handle_connect(auth=None):
+    """客户端连接: auth 中带 session 和 cursor（已收到的最后批次序号）时恢复原会话"""
+    auth = auth if isinstance(auth, dict) else {}
+    try:
+        cursor = int(auth.get('cursor') or 0)
+    except (TypeError, ValueError):
+        cursor = 0
+    session, resumed = app_state.open_session(request.sid, auth.get('session'), cursor)
+    if resumed:
+        metrics.inc('tcptool_reconnects_total', (('kind', 'browser'),))
+    emit('session', {'id': session.id, 'resumed': resumed, 'history': session.scrollback.bounds()})
+    # 发送网卡列表（缓存）
+    emit('interfaces', _interface_list())
+    
+    # 发送配置（已在内存中，无需重新读取文件）
     emit('connection_history', app_state.connection_history)
     emit('udp_connection_history', app_state.udp_connection_history)
-    emit('send_history', app_state.history_manager.to_list())
+    handle_search_history({})
+    emit('timestamp_format', _timestamp_format())
     
     # 发送当前连接状态
     emit('connection_status', {
-        'connected': app_state.tcp_client.connected,
-        'mode': 'client' if app_state.tcp_client.connected else None,
+        'connected': session.tcp_client.connected,
+        'mode': 'client' if session.tcp_client.connected else None,
         'protocol': 'TCP'
     })
     emit('udp_connection_status', {
-        'connected': app_state.udp_client.connected,
-        'mode': 'client' if app_state.udp_client.connected else None,
+        'connected': session.udp_client.connected,
+        'mode': 'client' if session.udp_client.connected else None,
         'protocol': 'UDP'
     })
+    if session.tcp_server.running:
+        emit('server_status', {'running': True})
+    elif session.udp_server.running:
+        emit('udp_server_status', {'running': True})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    """客户端断开"""
-    app_state.current_client_sid = None
+    """客户端断开，会话保留到空闲超时"""
+    app_state.close_sid(request.sid)
 
 @socketio.on('get_interfaces')
 def handle_get_interfaces():
-    """获取网卡列表"""
-    interfaces = get_network_interfaces()
-    interface_list = [{'name': iface.name, 'ip': iface.ip} for iface in interfaces]
-    emit('interfaces', interface_list)
+    """获取网卡列表（缓存，变化由后台监视主动推送）"""
+    emit('interfaces', _interface_list())
 
 @socketio.on('client_connect')
 def handle_client_connect(data):
-    """客户端连接"""
+    """客户端连接（在会话任务中连接，连接超时不阻塞处理函数）"""
+    session = _session()
     ip = data.get('ip')
     port = data.get('port')
     source_ip = data.get('source_ip', '0.0.0.0')
-    
-    if app_state.tcp_client.connect(ip, port, source_ip):
-        emit('connection_status', {'connected': True, 'mode': 'client', 'target': f"{ip}:{port}"})
-    else:
-        emit('error', {'message': '连接失败'})
+    session.submit(_client_connect, session, request.sid, ip, port, source_ip)
+
+def _client_connect(session: Session, sid: str, ip: str, port: int, source_ip: str):
+    if not _connect_tcp_client(session, ip, port, source_ip):
+        socketio.emit('error', {'message': '连接失败'}, to=sid)
+
+def _connect_tcp_client(session: Session, ip: str, port: int, source_ip: str) -> bool:
+    """TCP客户端连接并统计重连/失败次数，成功时通知会话的所有页面"""
+    if not session.tcp_client.connect(ip, port, source_ip):
+        metrics.inc('tcptool_connect_failures_total', (('transport', 'tcp'),))
+        return False
+    if session.last_target == (ip, port):
+        metrics.inc('tcptool_reconnects_total', (('kind', 'tcp_client'),))
+    session.last_target = (ip, port)
+    socketio.emit('connection_status', {'connected': True, 'mode': 'client', 'target': f"{ip}:{port}"},
+                  room=session.room)
+    return True
 
 @socketio.on('client_disconnect')
 def handle_client_disconnect():
-    """客户端断开"""
-    app_state.tcp_client.disconnect()
-    emit('connection_status', {'connected': False, 'mode': 'client'})
+    """客户端断开（排在未完成的连接/发送之后）"""
+    session = _session()
+    session.submit(_client_disconnect, session)
+
+def _client_disconnect(session: Session):
+    session.tcp_client.disconnect()
+    socketio.emit('connection_status', {'connected': False, 'mode': 'client'}, room=session.room)
 
 @socketio.on('server_start')
 def handle_server_start(data):
     """启动服务器"""
+    session = _session()
     bind_ip = data.get('bind_ip', '0.0.0.0')
     port = data.get('port')
     
-    if app_state.tcp_server.start(bind_ip, port):
+    if session.tcp_server.start(bind_ip, port):
         emit('server_status', {'running': True, 'address': f"{bind_ip}:{port}"})
     else:
         emit('error', {'message': '启动服务器失败'})
@@ -184,12 +652,14 @@ def handle_server_start(data):
 @socketio.on('server_stop')
 def handle_server_stop():
     """停止服务器"""
-    app_state.tcp_server.stop()
+    session = _session()
+    session.tcp_server.stop()
     emit('server_status', {'running': False})
 
 @socketio.on('send_data')
 def handle_send_data(data):
     """发送数据"""
+    session = _session()
     data_str = data.get('data', '')
     is_hex = data.get('is_hex', True)
     save_history = data.get('save_history', False)
@@ -197,36 +667,42 @@ def handle_send_data(data):
     
     # 转换数据
     if is_hex:
-        if not is_valid_hex(data_str):
-            emit('error', {'message': '无效的十六进制数据'})
+        try:
+            send_bytes = hex_to_bytes(data_str)
+        except HexParseError as e:
+            emit('error', {'message': f'无效的十六进制数据，{e}', 'position': e.position})
             return
-        send_bytes = hex_to_bytes(data_str)
     else:
         send_bytes = data_str.encode('utf-8')
-    
-    # 发送
+    send_bytes = session.checksum_config.apply(send_bytes)
+    # 发送在会话任务中进行（限速或对端接收慢时 sendall 会阻塞）
+    session.submit(_tcp_send, session, request.sid, send_bytes, target_client, data_str if save_history else None)
+
+def _tcp_send(session: Session, sid: str, send_bytes: bytes, target_client, history_data: Optional[str]):
     success = False
-    if app_state.tcp_client.connected:
-        success = app_state.tcp_client.send(send_bytes)
-    elif app_state.tcp_server.running:
+    target = None
+    if session.tcp_client.connected:
+        success = session.tcp_client.send(send_bytes)
+    elif session.tcp_server.running:
         if target_client:
             client_addr = tuple(target_client)
-            success = app_state.tcp_server.send_to_client(client_addr, send_bytes)
+            target = f"{client_addr[0]}:{client_addr[1]}"
+            success = session.tcp_server.send_to_client(client_addr, send_bytes)
         else:
-            app_state.tcp_server.broadcast(send_bytes)
+            session.tcp_server.broadcast(send_bytes)
             success = True
     
     if success:
-        formatted = format_sent_data(send_bytes, show_hex=True)
-        emit('send_success', {'data': formatted})
+        session.queue_sent(send_bytes, target=target)
         
         # 保存到历史
-        if save_history:
-            app_state.history_manager.add(data_str)
-            _save_config()
-            emit('send_history', app_state.history_manager.to_list())
+        if history_data is not None:
+            item = app_state.history_manager.add(history_data)
+            _save_history_item(item)
+            socketio.emit('history_item', {'op': 'upsert', 'move': True, 'item': item.to_dict()}, to=sid)
     else:
-        emit('error', {'message': '发送失败'})
+        metrics.inc('tcptool_send_errors_total', (('transport', 'tcp'),))
+        socketio.emit('error', {'message': '发送失败'}, to=sid)
 
 @socketio.on('save_connection')
 def handle_save_connection(data):
@@ -245,46 +721,94 @@ def handle_save_connection(data):
     _save_config()
     emit('connection_history', app_state.connection_history)
 
+def _history_item_from_request(data: dict):
+    """按发送内容（优先）或下标定位历史记录"""
+    if data.get('data') is not None:
+        return app_state.history_manager.get(data['data'])
+    return app_state.history_manager.get_item(data.get('index', -1))
+
 @socketio.on('update_remark')
 def handle_update_remark(data):
-    """更新备注"""
-    index = data.get('index')
-    remark = data.get('remark', '')
-    
-    item = app_state.history_manager.get_item(index)
+    """更新备注，可同时修改分组和标签"""
+    item = _history_item_from_request(data)
     if item:
-        item.remark = remark
-        _save_config()
-        emit('send_history', app_state.history_manager.to_list())
+        app_state.history_manager.update(item.data, data.get('remark', ''), data.get('group'), data.get('tags'))
+        _save_history_item(item, front=False)
+        emit('history_item', {'op': 'upsert', 'move': False, 'item': item.to_dict()})
+
+@socketio.on('delete_history')
+def handle_delete_history(data):
+    """删除一条发送历史"""
+    item = _history_item_from_request(data)
+    if item and app_state.history_manager.delete(item.data):
+        config_store.delete_item('send_history', 'data', item.data)
+        emit('history_item', {'op': 'delete', 'item': {'data': item.data}})
+
+@socketio.on('search_history')
+def handle_search_history(data):
+    """检索发送历史，返回按最近使用排序的前 limit 条"""
+    query = data.get('query', '')
+    try:
+        limit = min(max(int(data.get('limit') or HISTORY_VIEW_LIMIT), 1), HISTORY_VIEW_LIMIT)
+    except (TypeError, ValueError):
+        emit('error', {'message': '检索条数必须是整数'})
+        return
+    items = app_state.history_manager.search(query, prefix=bool(data.get('prefix')),
+                                             group=data.get('group') or None, limit=limit)
+    emit('history_results', {
+        'query': query,
+        'items': [item.to_dict() for item in items],
+        'groups': app_state.history_manager.groups(),
+    })
 
 # ===== UDP事件处理 =====
 
 @socketio.on('udp_connect')
 def handle_udp_connect(data):
     """UDP客户端连接"""
+    session = _session()
     ip = data.get('ip')
     port = data.get('port')
     local_port = data.get('local_port', 0)
     broadcast = data.get('broadcast', False)
     
-    if app_state.udp_client.connect(ip, port, local_port, broadcast):
+    if session.udp_client.connect(ip, port, local_port, broadcast):
         emit('udp_connection_status', {'connected': True, 'mode': 'client', 'target': f"{ip}:{port}"})
     else:
+        metrics.inc('tcptool_connect_failures_total', (('transport', 'udp'),))
         emit('error', {'message': 'UDP连接失败'})
 
 @socketio.on('udp_disconnect')
 def handle_udp_disconnect():
     """UDP客户端断开"""
-    app_state.udp_client.disconnect()
+    session = _session()
+    session.udp_client.disconnect()
     emit('udp_connection_status', {'connected': False, 'mode': 'client'})
 
+def _start_udp(session: Session, port: int, start: Callable[[], bool]) -> bool:
+    """端口未被其他会话占用时启动UDP服务器/代理，端口已被占用时抛出 ValueError
+
+    UDP socket 设置了 SO_REUSEADDR，重复绑定同一端口不会失败，数据会被其中一个会话收走，因此在这里检查
+    """
+    with app_state.udp_lock:
+        if app_state.udp_port_taken(port, session):
+            raise ValueError(f'UDP端口 {port} 已被其他会话占用')
+        return start()
+
 @socketio.on('udp_server_start')
 def handle_udp_server_start(data):
     """启动UDP服务器"""
+    session = _session()
     bind_ip = data.get('bind_ip', '0.0.0.0')
     port = data.get('port')
     
-    if app_state.udp_server.start(bind_ip, port):
+    try:
+        port = int(port)
+        started = _start_udp(session, port, lambda: session.udp_server.start(bind_ip, port))
+    except (TypeError, ValueError) as e:
+        emit('error', {'message': f'启动UDP服务器失败: {e}'})
+        return
+    if started:
         emit('udp_server_status', {'running': True, 'address': f"{bind_ip}:{port}"})
     else:
         emit('error', {'message': '启动UDP服务器失败'})
@@ -292,12 +816,14 @@ def handle_udp_server_start(data):
 @socketio.on('udp_server_stop')
 def handle_udp_server_stop():
     """停止UDP服务器"""
-    app_state.udp_server.stop()
+    session = _session()
+    session.udp_server.stop()
     emit('udp_server_status', {'running': False})
 
 @socketio.on('udp_send')
 def handle_udp_send(data):
     """UDP发送数据"""
+    session = _session()
     data_str = data.get('data', '')
     is_hex = data.get('is_hex', True)
     target_ip = data.get('target_ip')
@@ -305,32 +831,34 @@ def handle_udp_send(data):
     
     # 转换数据
     if is_hex:
-        if not is_valid_hex(data_str):
-            emit('error', {'message': '无效的十六进制数据'})
+        try:
+            send_bytes = hex_to_bytes(data_str)
+        except HexParseError as e:
+            emit('error', {'message': f'无效的十六进制数据，{e}', 'position': e.position})
             return
-        send_bytes = hex_to_bytes(data_str)
     else:
         send_bytes = data_str.encode('utf-8')
-    
-    # 发送
+    send_bytes = session.checksum_config.apply(send_bytes)
+    if session.udp_server.running and not session.udp_client.connected and not (target_ip and target_port):
+        emit('error', {'message': 'UDP服务器模式需要指定目标地址'})
+        return
+    session.submit(_udp_send, session, request.sid, send_bytes, target_ip, target_port)
+
+def _udp_send(session: Session, sid: str, send_bytes: bytes, target_ip: Optional[str], target_port: Optional[int]):
     success = False
-    if app_state.udp_client.connected:
+    if session.udp_client.connected:
         if target_ip and target_port:
-            success = app_state.udp_client.send(send_bytes, target_ip, target_port)
+            success = session.udp_client.send(send_bytes, target_ip, target_port)
         else:
-            success = app_state.udp_client.send(send_bytes)
-    elif app_state.udp_server.running:
-        if target_ip and target_port:
-            success = app_state.udp_server.send_to(target_ip, target_port, send_bytes)
-        else:
-            emit('error', {'message': 'UDP服务器模式需要指定目标地址'})
-            return
+            success = session.udp_client.send(send_bytes)
+    elif session.udp_server.running:
+        success = session.udp_server.send_to(target_ip, target_port, send_bytes)
     
     if success:
-        formatted = format_sent_data(send_bytes, show_hex=True)
-        emit('send_success', {'data': formatted})
+        session.queue_sent(send_bytes, target=f"{target_ip}:{target_port}" if target_ip and target_port else None)
     else:
-        emit('error', {'message': '发送失败'})
+        metrics.inc('tcptool_send_errors_total', (('transport', 'udp'),))
+        socketio.emit('error', {'message': '发送失败'}, to=sid)
 
 @socketio.on('save_udp_connection')
 def handle_save_udp_connection(data):
@@ -349,42 +877,646 @@ def handle_save_udp_connection(data):
     _save_config()
     emit('udp_connection_history', app_state.udp_connection_history)
 
-def _load_config():
-    """加载配置"""
+# ===== 代理事件处理 =====
+
+def _proxy_stats_loop(proxy, room: str):
+    """代理运行期间每秒推送一次转发延迟统计"""
+    while proxy.running:
+        socketio.emit('proxy_stats', proxy.latency.snapshot(), room=room)
+        socketio.sleep(1)
+
+@socketio.on('proxy_start')
+def handle_proxy_start(data):
+    """启动中继代理"""
+    session = _session()
+    protocol = data.get('protocol', 'TCP')
+    bind_ip = data.get('bind_ip', '0.0.0.0')
+    port = data.get('port')
+    target_ip = data.get('target_ip')
+    target_port = data.get('target_port')
+    source_ip = data.get('source_ip') or '0.0.0.0'   # 上游连接的源IP，与监听地址无关
+    
+    if session.tcp_proxy.running or session.udp_proxy.running:
+        emit('error', {'message': '代理已在运行'})
+        return
+    
+    if protocol == 'UDP':
+        proxy = session.udp_proxy
+        try:
+            port = int(port)
+            started = _start_udp(session, port, lambda: proxy.start(bind_ip, port, target_ip, target_port))
+        except (TypeError, ValueError) as e:
+            emit('error', {'message': f'启动代理失败: {e}'})
+            return
+    else:
+        proxy = session.tcp_proxy
+        started = proxy.start(bind_ip, port, target_ip, target_port, source_ip)
+    
+    if started:
+        emit('proxy_status', {
+            'running': True,
+            'protocol': protocol,
+            'address': f"{bind_ip}:{port}",
+            'target': f"{target_ip}:{target_port}"
+        })
+        socketio.start_background_task(_proxy_stats_loop, proxy, session.room)
+    else:
+        emit('error', {'message': '启动代理失败'})
+
+@socketio.on('proxy_stop')
+def handle_proxy_stop():
+    """停止中继代理"""
+    session = _session()
+    session.tcp_proxy.stop()
+    session.udp_proxy.stop()
+    emit('proxy_status', {'running': False})
+
+# ===== 网络损伤模拟 =====
+
+@socketio.on('set_impairment')
+def handle_set_impairment(data):
+    """设置损伤参数，tx/rx 决定挂到发送还是接收路径（代理对应 客户端→上游/上游→客户端）"""
+    session = _session()
     try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                # 加载TCP连接历史
-                saved_history = config.get('connection_history', [])
-                app_state.connection_history = []
-                for item in saved_history:
-                    if isinstance(item, (list, tuple)) and len(item) == 2:
-                        app_state.connection_history.append((item[0], int(item[1])))
-                # 加载UDP连接历史
-                udp_history = config.get('udp_connection_history', [])
-                app_state.udp_connection_history = []
-                for item in udp_history:
-                    if isinstance(item, (list, tuple)) and len(item) == 2:
-                        app_state.udp_connection_history.append((item[0], int(item[1])))
-                # 加载发送历史
-                send_history = config.get('send_history', [])
-                app_state.history_manager.from_list(send_history)
+        config = ImpairmentConfig.from_dict(data.get('config', {}))
+    except (TypeError, ValueError) as e:
+        emit('error', {'message': f'损伤参数无效: {e}'})
+        return
+    tx = config if data.get('tx', True) else None
+    rx = config if data.get('rx', False) else None
+    for endpoint in (session.tcp_client, session.tcp_server, session.udp_client, session.udp_server):
+        attach_impairment(endpoint, tx, rx)
+    session.tcp_proxy.set_impairment(tx, rx)
+    session.udp_proxy.set_impairment(tx, rx)
+    emit('impairment_status', {'active': config.is_active(), 'config': config.to_dict()})
+
+@socketio.on('get_impairment_stats')
+def handle_get_impairment_stats():
+    """获取损伤计数"""
+    session = _session()
+    emit('impairment_stats', {
+        'tcp_client': impairment_stats(session.tcp_client),
+        'tcp_server': impairment_stats(session.tcp_server),
+        'udp_client': impairment_stats(session.udp_client),
+        'udp_server': impairment_stats(session.udp_server),
+        'tcp_proxy': session.tcp_proxy.impairment_stats(),
+        'udp_proxy': session.udp_proxy.impairment_stats(),
+    })
+
+# ===== 校验和 =====
+
+@socketio.on('set_checksum')
+def handle_set_checksum(data):
+    """设置校验和: 发送时自动追加 / 校验接收数据"""
+    session = _session()
+    try:
+        config = ChecksumConfig.from_dict(data or {})
+    except (TypeError, ValueError) as e:
+        emit('error', {'message': f'校验参数无效: {e}'})
+        return
+    session.checksum_config = config
+    config_store.set('checksum', config.to_dict())
+    handle_get_checksum()
+
+@socketio.on('get_checksum')
+def handle_get_checksum():
+    """获取校验和设置、可选算法和计数"""
+    session = _session()
+    cfg = session.checksum_config
+    emit('checksum_config', dict(cfg.to_dict(), checked=cfg.checked, errors=cfg.errors,
+                                 algorithms={name: a.label for name, a in ALGORITHMS.items()},
+                                 presets={name: list(p) for name, p in PRESETS.items()}))
+
+# ===== 触发匹配 =====
+
+@socketio.on('set_triggers')
+def handle_set_triggers(data):
+    """设置触发模式: {'patterns': [{'name', 'pattern', 'hex'}]} 或 {'lines': ["名称=hex:AA 55", ...]}"""
+    session = _session()
+    data = data or {}
+    patterns = []
+    try:
+        if 'lines' in data:
+            patterns = [TriggerPattern.parse(line) for line in data['lines'] if line.strip()]
+        else:
+            patterns = [TriggerPattern.from_dict(item) for item in data.get('patterns', [])]
+    except (TypeError, ValueError) as e:
+        emit('error', {'message': f'触发模式无效: {e}'})
+        return
+    session.triggers.set_patterns(patterns)
+    config_store.set('triggers', session.triggers.to_list())
+    handle_get_triggers()
+
+@socketio.on('reset_trigger_counts')
+def handle_reset_trigger_counts():
+    """清零触发计数"""
+    session = _session()
+    session.triggers.reset_counts()
+    handle_get_triggers()
+
+@socketio.on('get_triggers')
+def handle_get_triggers():
+    """获取触发模式及各自的匹配次数"""
+    session = _session()
+    emit('triggers', {
+        'patterns': session.triggers.stats(),
+        'lines': [p.to_line() for p in session.triggers.patterns],
+        'total': session.triggers.total
+    })
+
+# ===== 收发记录回看 =====
+
+RECORDS_PAGE_LIMIT = 5000
+
+def _records_query(session: Session, args) -> Tuple[int, int, bytes]:
+    """按 after/before（序号）、since/until（毫秒时间戳）、limit 查询一页，参数无效时抛出 ValueError"""
+    def opt_int(name):
+        value = args.get(name)
+        return None if value in (None, '') else int(value)
+    def opt_ns(name):
+        value = args.get(name)
+        return None if value in (None, '') else int(float(value) * 1_000_000)
+    limit = min(opt_int('limit') or 500, RECORDS_PAGE_LIMIT)
+    return session.scrollback.page(opt_int('after'), opt_int('before'), opt_ns('since'), opt_ns('until'), limit,
+                                   session.clock)
+
+@socketio.on('get_records')
+def handle_get_records(data):
+    """分页查询回看缓冲，记录以二进制推送格式打包返回；tag 原样带回，供页面区分用途"""
+    session = _session()
+    data = data or {}
+    try:
+        first, count, blob = _records_query(session, data)
+    except (TypeError, ValueError):
+        emit('error', {'message': '查询参数无效'})
+        return
+    emit('records', {'tag': data.get('tag'), 'first': first, 'count': count, 'blob': blob,
+                     'bounds': session.scrollback.bounds()})
+
+@app.route('/sessions/<session_id>/records')
+@app.route('/api/sessions/<session_id>/records')
+def session_records(session_id):
+    """HTTP 分页查询回看缓冲: ?after=&before=&since=&until=&limit=&format=json|binary
+
+    cursor 为本页最后一条的序号，下次以 after=cursor 读取之后的新记录
+    """
+    session = _http_session(session_id)
+    if session is None:
+        return jsonify({'error': '会话不存在'}), 404
+    try:
+        first, count, blob = _records_query(session, request.args)
+    except (TypeError, ValueError):
+        return jsonify({'error': '查询参数无效'}), 400
+    if request.args.get('format') == 'binary':
+        return Response(blob, mimetype='application/octet-stream',
+                        headers={'X-First-Seq': str(first), 'X-Count': str(count),
+                                 'X-Cursor': str(first + count - 1)})
+    return jsonify({'first': first, 'count': count, 'cursor': first + count - 1,
+                    'records': _records_json(session, range(first, first + count), blob),
+                    'bounds': session.scrollback.bounds()})
+
+def _http_session(session_id: str) -> Optional[Session]:
+    """HTTP 请求访问的会话（没有浏览器连接的会话重新开始空闲计时）"""
+    session = app_state.sessions.get(session_id)
+    if session is not None:
+        app_state.touch(session)
+    return session
+
+def _records_json(session: Session, seqs, blob: bytes) -> List[dict]:
+    """把打包的记录转换为 JSON 列表"""
+    endpoints = session.endpoints.to_dict()
+    records = []
+    for seq, record in zip(seqs, unpack_records(blob)):
+        records.append({'seq': seq, 'seconds': record['seconds'], 'nanos': record['nanos'],
+                        'relative': bool(record['flags'] & FLAG_RELATIVE), 'direction': record['direction'],
+                        'endpoint': endpoints.get(record['endpoint'], ''), 'note': record['note'],
+                        'data': record['data'].hex(' ').upper()})
+    return records
+
+def _search_query(session: Session, args) -> Tuple[List[int], bytes, int, bool]:
+    """按端点/方向/时间/长度/字节模式查找（参数见 TrafficQuery.from_dict），after 为上一批返回的 scanned"""
+    query = TrafficQuery.from_dict(args, session.endpoints)
+    after = args.get('after')
+    limit = min(int(args.get('limit') or 500), RECORDS_PAGE_LIMIT)
+    return session.scrollback.search(query, None if after in (None, '') else int(after), limit, session.clock)
+
+@socketio.on('search_records')
+def handle_search_records(data):
+    """查找回看缓冲中符合条件的记录，以二进制推送格式打包返回"""
+    session = _session()
+    data = data or {}
+    try:
+        seqs, blob, scanned, done = _search_query(session, data)
+    except (TypeError, ValueError) as e:
+        emit('error', {'message': f'查询参数无效: {e}'})
+        return
+    emit('search_results', {'tag': data.get('tag'), 'seqs': seqs, 'blob': blob, 'scanned': scanned, 'done': done,
+                            'bounds': session.scrollback.bounds()})
+
+@app.route('/sessions/<session_id>/search')
+@app.route('/api/sessions/<session_id>/search')
+def session_search(session_id):
+    """HTTP 查找: ?endpoint=&direction=&since=&until=&min_len=&max_len=&pattern=&after=&limit="""
+    session = _http_session(session_id)
+    if session is None:
+        return jsonify({'error': '会话不存在'}), 404
+    try:
+        seqs, blob, scanned, done = _search_query(session, request.args)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'查询参数无效: {e}'}), 400
+    return jsonify({'seqs': seqs, 'records': _records_json(session, seqs, blob), 'scanned': scanned, 'done': done,
+                    'bounds': session.scrollback.bounds()})
+
+# ===== HTTP 自动化接口 =====
+# 不需要浏览器: 创建会话后连接/启动、单发或批量发送，再用 /api/sessions/<id>/records?after=游标 读取收发记录
+
+API_MAX_FRAMES = 100000
+
+def _api_status(session: Session) -> dict:
+    """会话的连接状态和记录范围"""
+    return {
+        'id': session.id,
+        'tcp_client': {'connected': session.tcp_client.connected},
+        'tcp_server': {'running': session.tcp_server.running,
+                       'clients': [f"{ip}:{port}" for ip, port in list(session.tcp_server.client_map)]},
+        'udp_client': {'connected': session.udp_client.connected},
+        'udp_server': {'running': session.udp_server.running,
+                       'clients': [f"{ip}:{port}" for ip, port in list(session.udp_server.clients)]},
+        'records': session.scrollback.bounds(),
+    }
+
+def _api_tcp_client(session: Session, action: str, body: dict) -> bool:
+    if action == 'connect':
+        return _connect_tcp_client(session, body['ip'], int(body['port']), body.get('source_ip') or '0.0.0.0')
+    _client_disconnect(session)
+    return True
+
+def _api_tcp_server(session: Session, action: str, body: dict) -> bool:
+    if action == 'start':
+        bind_ip, port = body.get('bind_ip') or '0.0.0.0', int(body['port'])
+        if not session.tcp_server.start(bind_ip, port):
+            return False
+        socketio.emit('server_status', {'running': True, 'address': f"{bind_ip}:{port}"}, room=session.room)
+        return True
+    session.tcp_server.stop()
+    socketio.emit('server_status', {'running': False}, room=session.room)
+    return True
+
+def _api_udp_client(session: Session, action: str, body: dict) -> bool:
+    if action == 'connect':
+        ip, port = body['ip'], int(body['port'])
+        if not session.udp_client.connect(ip, port, int(body.get('local_port') or 0), bool(body.get('broadcast'))):
+            metrics.inc('tcptool_connect_failures_total', (('transport', 'udp'),))
+            return False
+        socketio.emit('udp_connection_status', {'connected': True, 'mode': 'client', 'target': f"{ip}:{port}"},
+                      room=session.room)
+        return True
+    session.udp_client.disconnect()
+    socketio.emit('udp_connection_status', {'connected': False, 'mode': 'client'}, room=session.room)
+    return True
+
+def _api_udp_server(session: Session, action: str, body: dict) -> bool:
+    if action == 'start':
+        bind_ip, port = body.get('bind_ip') or '0.0.0.0', int(body['port'])
+        if not _start_udp(session, port, lambda: session.udp_server.start(bind_ip, port)):
+            return False
+        socketio.emit('udp_server_status', {'running': True, 'address': f"{bind_ip}:{port}"}, room=session.room)
+        return True
+    session.udp_server.stop()
+    socketio.emit('udp_server_status', {'running': False}, room=session.room)
+    return True
+
+# (对象, 操作) -> 处理函数
+API_ACTIONS = {
+    ('tcp_client', 'connect'): _api_tcp_client, ('tcp_client', 'disconnect'): _api_tcp_client,
+    ('tcp_server', 'start'): _api_tcp_server, ('tcp_server', 'stop'): _api_tcp_server,
+    ('udp_client', 'connect'): _api_udp_client, ('udp_client', 'disconnect'): _api_udp_client,
+    ('udp_server', 'start'): _api_udp_server, ('udp_server', 'stop'): _api_udp_server,
+}
+
+def _api_frames(session: Session, body: dict) -> List[bytes]:
+    """请求中的待发送数据: "data" 单帧或 "frames" 多帧，"hex" 默认 true，"checksum" 默认 true；无效时抛出 ValueError"""
+    texts = body.get('frames')
+    if texts is None:
+        texts = [body.get('data', '')]
+    if not isinstance(texts, list) or not texts:
+        raise ValueError('frames 必须是非空列表')
+    if len(texts) > API_MAX_FRAMES:
+        raise ValueError(f'一次最多发送 {API_MAX_FRAMES} 帧')
+    is_hex = body.get('hex', True)
+    frames = []
+    for text in texts:
+        frame = hex_to_bytes(str(text)) if is_hex else str(text).encode('utf-8')
+        frames.append(session.checksum_config.apply(frame) if body.get('checksum', True) else frame)
+    return frames
+
+def _api_sender(session: Session, protocol: Optional[str], target: Optional[str]) -> Tuple[Callable, Optional[str]]:
+    """按协议和目标选择发送方式，返回 (send_many(帧列表, 间隔秒, on_sent), 目标端点)；没有可用连接时抛出 ValueError
+
+    不指定协议时与页面相同: TCP客户端 > TCP服务器 > UDP客户端 > UDP服务器
+    """
+    addr = None
+    if target:
+        ip, _, port = str(target).rpartition(':')
+        addr = (ip, int(port))
+    if protocol in (None, '', 'tcp'):
+        if session.tcp_client.connected:
+            return session.tcp_client.send_many, None
+        if session.tcp_server.running:
+            if addr:
+                return (lambda frames, interval, on_sent:
+                        session.tcp_server.send_many_to_client(addr, frames, interval, on_sent)), target
+            def broadcast(data: bytes) -> bool:
+                session.tcp_server.broadcast(data)
+                return True
+            return lambda frames, interval, on_sent: send_frames(broadcast, frames, interval, on_sent), None
+    if protocol in (None, '', 'udp'):
+        if session.udp_client.connected:
+            ip, port = addr or (None, None)
+            return (lambda frames, interval, on_sent:
+                    session.udp_client.send_many(frames, interval, ip, port, on_sent)), target
+        if session.udp_server.running and addr:
+            return (lambda frames, interval, on_sent:
+                    session.udp_server.send_many_to(addr[0], addr[1], frames, interval, on_sent)), target
+    raise ValueError('没有可用的连接（UDP服务器需要指定 target）')
+
+@app.route('/api/sessions', methods=['POST'])
+def api_create_session():
+    """创建会话（空闲超时后自动关闭）"""
+    session = app_state.create_session()
+    return jsonify(_api_status(session)), 201
+
+@app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+def api_session(session_id):
+    """GET 查看连接状态，DELETE 关闭会话"""
+    if request.method == 'DELETE':
+        if not app_state.close_session(session_id):
+            return jsonify({'error': '会话不存在'}), 404
+        return jsonify({'ok': True})
+    session = _http_session(session_id)
+    if session is None:
+        return jsonify({'error': '会话不存在'}), 404
+    return jsonify(_api_status(session))
+
+@app.route('/api/sessions/<session_id>/<target>/<action>', methods=['POST'])
+def api_control(session_id, target, action):
+    """连接/断开/启动/停止: tcp_client/connect {ip, port, source_ip}、tcp_server/start {bind_ip, port}、
+    udp_client/connect {ip, port, local_port, broadcast}、udp_server/start {bind_ip, port} 及对应的 disconnect/stop"""
+    session = _http_session(session_id)
+    if session is None:
+        return jsonify({'error': '会话不存在'}), 404
+    handler = API_ACTIONS.get((target, action))
+    if handler is None:
+        return jsonify({'error': f'未知的操作: {target}/{action}'}), 404
+    try:
+        # 在会话的任务线程中执行，与页面发起的操作按顺序进行
+        ok = session.call(handler, session, action, request.get_json(silent=True) or {})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'参数无效: {e}'}), 400
+    return jsonify(dict(_api_status(session), ok=ok)), 200 if ok else 502
+
+@app.route('/api/sessions/<session_id>/send', methods=['POST'])
+def api_send(session_id):
+    """发送: {"data": "AA 55"} 或 {"frames": [...], "interval_ms": 10}，可选 "hex"、"protocol"(tcp/udp)、
+    "target"("ip:port")、"checksum"；多帧由网络层一次连续发出（无间隔时 TCP 合并为一次写入），
+    在会话的任务线程中执行，不会与页面的发送交错，每帧发出时即记入回看缓冲"""
+    session = _http_session(session_id)
+    if session is None:
+        return jsonify({'error': '会话不存在'}), 404
+    body = request.get_json(silent=True) or {}
+    try:
+        frames = _api_frames(session, body)
+        interval = float(body.get('interval_ms') or 0) / 1000
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'参数无效: {e}'}), 400
+    
+    def send() -> Tuple[int, float]:
+        # 连接状态以任务执行时为准
+        send_many, target = _api_sender(session, body.get('protocol'), body.get('target'))
+        started = time.perf_counter()
+        sent = send_many(frames, interval, lambda frame: session.queue_sent(frame, "[HTTP] ", target))
+        return sent, time.perf_counter() - started
+    
+    try:
+        sent, elapsed = session.call(send)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'参数无效: {e}'}), 400
+    if sent < len(frames):
+        metrics.inc('tcptool_send_errors_total', (('transport', body.get('protocol') or 'auto'),))
+    return jsonify({'ok': sent == len(frames), 'sent': sent, 'total': len(frames),
+                    'bytes': sum(len(frame) for frame in frames[:sent]),
+                    'elapsed_ms': round(elapsed * 1000, 3)}), 200 if sent == len(frames) else 502
+
+# ===== 推送设置 =====
+
+@socketio.on('set_transport')
+def handle_set_transport(data):
+    """设置接收数据的推送格式: text（服务器渲染）或 binary（原始字节，页面渲染）"""
+    session = _session()
+    mode = (data or {}).get('mode', 'text')
+    if mode not in ('text', 'binary'):
+        emit('error', {'message': f'不支持的推送格式: {mode}'})
+        return
+    session.transport = mode
+    emit('transport', session.transport_state())
+
+@socketio.on('set_emit_options')
+def handle_set_emit_options(data):
+    """设置接收数据的推送间隔、提前推送的积累量和队列上限"""
+    session = _session()
+    data = data or {}
+    try:
+        interval = float(data['interval_ms']) / 1000 if data.get('interval_ms') else None
+        flush_bytes = int(float(data['flush_kb']) * 1024) if data.get('flush_kb') else None
+        max_bytes = int(float(data['max_kb']) * 1024) if data.get('max_kb') else None
+    except (TypeError, ValueError):
+        emit('error', {'message': '推送参数无效'})
+        return
+    session.emitter.configure(interval, flush_bytes, max_bytes)
+    handle_get_emit_stats()
+
+@socketio.on('get_emit_stats')
+def handle_get_emit_stats():
+    """获取推送计数"""
+    session = _session()
+    emit('emit_stats', session.emitter.to_dict())
+
+# ===== 自动应答 =====
+
+@socketio.on('set_auto_reply')
+def handle_set_auto_reply(data):
+    """设置自动应答: {'enabled': bool, 'lines': ["名称 | 匹配方式 | 模式 | 应答 ...", ...]} 或 {'rules': [...]}"""
+    session = _session()
+    data = data or {}
+    if 'lines' in data or 'rules' in data:
+        try:
+            if 'lines' in data:
+                rules = [Rule.parse(line) for line in data['lines'] if line.strip()]
+            else:
+                rules = [Rule.from_dict(item) for item in data['rules']]
+        except (TypeError, ValueError, re.error) as e:
+            emit('error', {'message': f'应答规则无效: {e}'})
+            return
+        session.responder.set_rules(rules)
+    if 'enabled' in data:
+        session.auto_reply_enabled = bool(data['enabled'])
+    session.apply_responder()
+    config_store.set('auto_reply', {'enabled': session.auto_reply_enabled, 'rules': session.responder.to_list()})
+    handle_get_auto_reply()
+
+@socketio.on('get_auto_reply')
+def handle_get_auto_reply():
+    """获取自动应答规则和计数"""
+    session = _session()
+    responder = session.responder
+    emit('auto_reply', {
+        'enabled': session.auto_reply_enabled,
+        'lines': [rule.to_line() for rule in responder.rules],
+        'rules': responder.stats(),
+        'replies': responder.replies,
+        'unmatched': responder.unmatched
+    })
+
+# ===== 时间戳 =====
+
+@socketio.on('set_timestamp_format')
+def handle_set_timestamp_format(data):
+    """设置时间戳精度和相对时间模式（开启相对时间时以此刻为起点）"""
+    session = _session()
+    relative = data.get('relative')
+    try:
+        session.clock.configure(data.get('precision'), relative)
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    if relative and data.get('reset_session', True):
+        session.clock.reset_session()
+    if 'kernel' in data:
+        # 内核接收时间戳在下次连接/启动时生效
+        enabled = bool(data['kernel']) and kernel_timestamps_supported()
+        for endpoint in (session.tcp_client, session.tcp_server, session.udp_client, session.udp_server,
+                         session.tcp_proxy, session.udp_proxy):
+            endpoint.kernel_timestamps = enabled
+    emit('timestamp_format', _timestamp_format())
+
+def _timestamp_format() -> dict:
+    """当前时间戳设置"""
+    session = _session()
+    return dict(session.clock.to_dict(),
+                kernel=session.tcp_client.kernel_timestamps,
+                kernel_supported=kernel_timestamps_supported())
+
+# ===== 发送限速 =====
+
+@socketio.on('set_rate_limit')
+def handle_set_rate_limit(data):
+    """设置每连接和会话总体（页面上的"全局"）的令牌桶限速，0表示不限，不影响其他会话"""
+    session = _session()
+    try:
+        conn = data.get('connection', {})
+        glob = data.get('global', {})
+        conn_bps = float(conn.get('bytes_per_sec') or 0)
+        conn_mps = float(conn.get('msgs_per_sec') or 0)
+        global_bps = float(glob.get('bytes_per_sec') or 0)
+        global_mps = float(glob.get('msgs_per_sec') or 0)
+    except (TypeError, ValueError):
+        emit('error', {'message': '限速参数无效'})
+        return
+    blocking = data.get('blocking', True)
+    shared = session.send_limiter
+    shared.configure(global_bps, global_mps, blocking=blocking)
+    for endpoint in (session.tcp_client, session.tcp_server, session.udp_client, session.udp_server):
+        if conn_bps or conn_mps:
+            endpoint.rate_limiter = RateLimiter(conn_bps, conn_mps, blocking=blocking, parent=shared)
+        else:
+            endpoint.rate_limiter = shared if shared.enabled() else None
+    handle_get_rate_limit_stats()
+
+@socketio.on('get_rate_limit_stats')
+def handle_get_rate_limit_stats():
+    """获取限速计数"""
+    session = _session()
+    stats = {}
+    for name, endpoint in (('tcp_client', session.tcp_client), ('tcp_server', session.tcp_server),
+                           ('udp_client', session.udp_client), ('udp_server', session.udp_server)):
+        if endpoint.rate_limiter and endpoint.rate_limiter is not session.send_limiter:
+            stats[name] = endpoint.rate_limiter.to_dict()
+    if session.send_limiter.enabled():
+        stats['global'] = session.send_limiter.to_dict()
+    emit('rate_limit_stats', stats)
+
+# ===== 网卡吞吐监视 =====
+
+@socketio.on('nic_monitor_start')
+def handle_nic_monitor_start(data=None):
+    """开始网卡采样（运行中再次调用只更新采样间隔）"""
+    data = data or {}
+    try:
+        interval = float(data.get('interval') or 1.0)
+    except (TypeError, ValueError):
+        emit('error', {'message': '采样间隔无效'})
+        return
+    app_state.nic_monitor.interfaces = data.get('interfaces') or None
+    app_state.nic_monitor.start(interval)
+    emit('nic_monitor_status', {'running': True, 'interval': app_state.nic_monitor.interval})
+
+@socketio.on('nic_monitor_stop')
+def handle_nic_monitor_stop():
+    """停止网卡采样"""
+    app_state.nic_monitor.stop()
+    emit('nic_monitor_status', {'running': False})
+
+def _load_config(config: Optional[dict] = None):
+    """从配置存储加载历史记录"""
+    try:
+        config = config_store.data if config is None else config
+        # 加载TCP连接历史
+        saved_history = config.get('connection_history', [])
+        app_state.connection_history = []
+        for item in saved_history:
+            if isinstance(item, (list, tuple)) and len(item) == 2:
+                app_state.connection_history.append((item[0], int(item[1])))
+        # 加载UDP连接历史
+        udp_history = config.get('udp_connection_history', [])
+        app_state.udp_connection_history = []
+        for item in udp_history:
+            if isinstance(item, (list, tuple)) and len(item) == 2:
+                app_state.udp_connection_history.append((item[0], int(item[1])))
+        # 加载发送历史
+        send_history = config.get('send_history', [])
+        app_state.history_manager.from_list(send_history)
+        # 校验、触发和自动应答设置属于各会话，配置中的值只作为新会话的初始设置，不推给已有会话
     except Exception as e:
         print(f"加载配置失败: {e}")
 
 def _save_config():
-    """保存配置"""
-    try:
-        config = {
-            'connection_history': app_state.connection_history,
-            'udp_connection_history': app_state.udp_connection_history,
-            'send_history': app_state.history_manager.to_list()
-        }
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"保存配置失败: {e}")
+    """保存连接历史（只更新内存，由配置存储延迟写盘）；发送历史按条目保存，见 _save_history_item"""
+    config_store.update({
+        'connection_history': list(app_state.connection_history),
+        'udp_connection_history': list(app_state.udp_connection_history),
+    })
+
+def _save_history_item(item, front: bool = True):
+    """保存一条发送历史（日志只记录这一条），front 表示移到最前"""
+    config_store.upsert_item('send_history', item.to_dict(), 'data', front=front,
+                             limit=app_state.history_manager.max_history)
+
+def _on_config_reloaded(config: dict):
+    """配置文件被外部修改，重新加载并推送给浏览器"""
+    _load_config(config)
+    socketio.emit('connection_history', app_state.connection_history)
+    socketio.emit('udp_connection_history', app_state.udp_connection_history)
+    items = app_state.history_manager.search(limit=HISTORY_VIEW_LIMIT)
+    socketio.emit('history_results', {
+        'query': '',
+        'items': [item.to_dict() for item in items],
+        'groups': app_state.history_manager.groups(),
+    })
+
+# 配置常驻内存：启动时加载一次，之后只在外部修改配置文件时重新加载
+config_store = ConfigStore(CONFIG_FILE)
+_load_config()
+config_store.add_listener(_on_config_reloaded)
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -392,5 +1524,7 @@ if __name__ == '__main__':
     print("=" * 50)
     print("访问地址: http://localhost:5000")
     print("按 Ctrl+C 停止服务")
+    print(f"运行时: {ASYNC_MODE}（--runtime threading|eventlet|gevent）")
     print("=" * 50)
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False)
+    # threading 运行时使用 Werkzeug 开发服务器（后台运行时需显式允许），生产环境建议 eventlet/gevent
+    socketio.run(app, host='0.0.0.0', port=5000, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,111 @@
+"""
+二进制推送格式
+浏览器使用二进制传输时，服务器不再渲染文本，而是把原始字节加一个20字节的头打包发送，
+由页面按当前显示模式（文本/十六进制/二进制）自行渲染。
+
+每条记录: 头部 + 备注(UTF-8) + 原始数据，头部为小端:
+  u32 秒  u32 纳秒  u8 方向  u8 标志  u32 端点编号  u16 备注长度  u32 数据长度
+时间为接收时间（相对时间模式下为相对会话起点的时长，标志位 FLAG_RELATIVE/FLAG_NEGATIVE），
+端点编号对应的 "ip:port" 通过 endpoints 事件单独下发一次
+"""
+
+import struct
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from timestamps import TimestampFormatter, default_formatter, times_of
+
+HEADER = struct.Struct('<IIBBIHI')
+
+# 方向
+DIR_RECEIVED = 0
+DIR_SENT = 1
+DIR_CLIENT_TO_SERVER = 2
+DIR_SERVER_TO_CLIENT = 3
+
+DIRECTION_CODES = {"c2s": DIR_CLIENT_TO_SERVER, "s2c": DIR_SERVER_TO_CLIENT}
+
+# 标志
+FLAG_RELATIVE = 0x01   # 时间为相对会话起点的时长
+FLAG_NEGATIVE = 0x02   # 相对时长为负（早于会话起点）
+
+# 端点编号0表示无来源
+NO_ENDPOINT = 0
+
+
+class EndpointTable:
+    """端点地址 <-> 编号，编号只增不复用，回看缓冲中的旧记录始终对应原来的地址
+
+    地址数超过 max_names 时忘记 in_use() 之外（已没有记录引用）的地址，之后再出现时分配新编号
+    """
+    def __init__(self, in_use: Optional[Callable[[], Iterable[int]]] = None, max_names: int = 65535):
+        self._ids: Dict[str, int] = {}
+        self._next = NO_ENDPOINT + 1
+        self.in_use = in_use
+        self._prune_at = max_names
+        self.max_names = max_names
+        self._lock = threading.Lock()
+
+    def lookup(self, name: Optional[str]) -> Tuple[int, bool]:
+        """获取编号，返回 (编号, 是否新分配)"""
+        if not name:
+            return NO_ENDPOINT, False
+        endpoint_id = self._ids.get(name)
+        if endpoint_id is not None:
+            return endpoint_id, False
+        with self._lock:
+            endpoint_id = self._ids.get(name)
+            if endpoint_id is not None:
+                return endpoint_id, False
+            if len(self._ids) >= self._prune_at and self.in_use is not None:
+                live = set(self.in_use())
+                self._ids = {n: i for n, i in self._ids.items() if i in live}
+                # 仍在使用的地址很多时放宽上限，避免每次分配都重新整理
+                self._prune_at = max(self.max_names, 2 * len(self._ids))
+            endpoint_id = self._next
+            self._next += 1
+            self._ids[name] = endpoint_id
+            return endpoint_id, True
+
+    def get(self, name: str) -> Optional[int]:
+        """已分配的编号，未出现过的地址返回 None"""
+        return self._ids.get(name)
+
+    def to_dict(self) -> Dict[int, str]:
+        return {endpoint_id: name for name, endpoint_id in self._ids.items()}
+
+
+def pack_record(data: bytes, direction: int = DIR_RECEIVED, endpoint_id: int = NO_ENDPOINT, note: str = "",
+                clock: Optional[TimestampFormatter] = None) -> bytes:
+    """打包一条记录"""
+    clock = clock or default_formatter
+    wall_ns, mono_ns = times_of(data)
+    flags = 0
+    if clock.relative:
+        ns = mono_ns - clock.session_start_ns
+        flags = FLAG_RELATIVE
+        if ns < 0:
+            ns = -ns
+            flags |= FLAG_NEGATIVE
+    else:
+        ns = wall_ns
+    seconds, nanos = divmod(ns, 1_000_000_000)
+    note_bytes = note.encode('utf-8') if note else b""
+    return b"".join((HEADER.pack(seconds & 0xFFFFFFFF, nanos, direction, flags, endpoint_id,
+                                 len(note_bytes), len(data)), note_bytes, bytes(data)))
+
+
+def unpack_records(blob: bytes) -> List[dict]:
+    """解包（页面脚本中有同样的实现，这里用于调试和校验）"""
+    records = []
+    view = memoryview(blob)
+    pos = 0
+    while pos < len(view):
+        seconds, nanos, direction, flags, endpoint_id, note_len, data_len = HEADER.unpack_from(view, pos)
+        pos += HEADER.size
+        note = bytes(view[pos:pos + note_len]).decode('utf-8')
+        pos += note_len
+        records.append({"seconds": seconds, "nanos": nanos, "direction": direction, "flags": flags,
+                        "endpoint": endpoint_id, "note": note, "data": bytes(view[pos:pos + data_len])})
+        pos += data_len
+    return records